@@ -0,0 +1,297 @@
+"""
+Asynchronous compilation and running of Stan models
+===================================================
+
+Stan programs are compiled and run as asyncio subprocesses, such that many jobs
+may be coordinated from one event loop. Concurrent jobs are limited by a
+semaphore, cancelled jobs terminate their subprocess, and output and progress
+are streamed as events.
+"""
+
+import asyncio
+import os
+import platform
+import re
+import tempfile
+import time
+import weakref
+from pathlib import Path
+
+import pandas as pd
+from cmdstanpy import cmdstan_path, from_csv, write_stan_json
+from cmdstanpy.compilation import CompilerOptions
+
+from .build import copy_atomic, exe_file_name, is_outdated, record_options
+
+
+PROGRESS = re.compile(r"Iteration:\s*(\d+)\s*/\s*(\d+)")
+LIMITS = weakref.WeakKeyDictionary()
+
+
+def default_limit():
+    """
+    @returns Semaphore limiting concurrent jobs in running event loop to number of CPUs
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in LIMITS:
+        LIMITS[loop] = asyncio.Semaphore(os.cpu_count() or 1)
+    return LIMITS[loop]
+
+
+def emit(progress, job, event, **kwargs):
+    """
+    Send an event about a job to a progress callback
+    """
+    if progress is not None:
+        progress(dict(job=job, event=event, time=time.time(), **kwargs))
+
+
+async def terminate(proc, timeout=5.):
+    """
+    Terminate a subprocess, killing it if it does not exit in time
+    """
+    if proc.returncode is not None:
+        return
+
+    proc.terminate()
+
+    try:
+        await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+
+
+async def run_process(cmd, job, progress=None, limit=None, cwd=None):
+    """
+    Run a subprocess, streaming its output as events
+
+    @param cmd Command and arguments
+    @param job Name of job in events
+    @param progress Callback for events, or None
+    @param limit Semaphore limiting concurrent jobs, by default number of CPUs
+    @param cwd Working directory
+    @returns Output of subprocess
+    """
+    if limit is None:
+        limit = default_limit()
+
+    lines = []
+
+    async with limit:
+        emit(progress, job, "start", cmd=[str(c) for c in cmd])
+        proc = await asyncio.create_subprocess_exec(
+            *[str(c) for c in cmd], cwd=cwd, limit=2**20,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+
+        try:
+            async for line in proc.stdout:
+                text = line.decode(errors="replace").rstrip()
+                lines.append(text)
+                match = PROGRESS.search(text)
+                if match:
+                    emit(progress, job, "progress", done=int(match[1]), total=int(match[2]))
+                else:
+                    emit(progress, job, "output", text=text)
+            returncode = await proc.wait()
+        except asyncio.CancelledError:
+            await terminate(proc)
+            emit(progress, job, "cancelled")
+            raise
+
+    output = "\n".join(lines)
+
+    if returncode:
+        emit(progress, job, "error", returncode=returncode)
+        raise RuntimeError(f"{job} failed with return code {returncode}:\n{output}")
+
+    emit(progress, job, "done")
+    return output
+
+
+async def abuild_stan_file(stan_file_name, force=False, exe_cache=None, progress=None, limit=None, **kwargs):
+    """
+    Compile Stan program asynchronously
+
+    @param stan_file_name File name of Stan program
+    @param force Whether to compile even if executable is newer than program and built under same options
+    @param exe_cache Cache of executables shared by identical programs
+    @param kwargs Options for compiling Stan program
+    @returns File name of executable Stan model
+    """
+    exe = exe_file_name(stan_file_name)
+    key = None
+
+    if exe_cache is not None:
+        with open(stan_file_name, encoding="utf-8") as stan_file:
+            key = exe_cache.key(stan_file.read(), kwargs)
+        cached = exe_cache.load(key)
+        if cached is not None:
+            copy_atomic(cached, exe)
+            record_options(stan_file_name, kwargs)
+            return exe
+        # as for compile_cached, an executable present must not be stored under this key
+        force = True
+
+    if not force and not is_outdated(stan_file_name, kwargs):
+        return exe
+
+    options = CompilerOptions(**kwargs)
+    options.validate()
+
+    for f in [exe, f"{os.path.splitext(stan_file_name)[0]}.hpp"]:
+        if os.path.exists(f):
+            os.remove(f)
+
+    make = os.getenv("MAKE", "make" if platform.system() != "Windows" else "mingw32-make")
+    cmd = [make, *options.compose(filename_in_msg=os.path.basename(stan_file_name)),
+           Path(os.path.abspath(exe)).as_posix()]
+    await run_process(cmd, f"build {stan_file_name}", progress, limit, cwd=cmdstan_path())
+
+    if exe_cache is not None:
+        exe_cache.store(key, exe)
+
+    record_options(stan_file_name, kwargs)
+    return exe
+
+
+class AsyncModel:
+    """
+    Run a compiled Stan model asynchronously
+    """
+
+    def __init__(self, exe_file_name, progress=None, limit=None):
+        """
+        @param exe_file_name File name of executable Stan model
+        @param progress Callback for events, or None
+        @param limit Semaphore limiting concurrent jobs, by default number of CPUs
+        """
+        self.exe_file_name = os.path.abspath(exe_file_name)
+        self.progress = progress
+        self.limit = limit
+
+    @property
+    def name(self):
+        """
+        @returns Name of model
+        """
+        return os.path.basename(self.exe_file_name)
+
+    @staticmethod
+    def _file(value, directory, name):
+        """
+        @returns File name of data or parameters, written to a json file if necessary
+        """
+        if value is None or isinstance(value, (str, os.PathLike)):
+            return value
+        file_name = os.path.join(directory, name)
+        write_stan_json(file_name, value)
+        return file_name
+
+    @staticmethod
+    def _output_dir(output_dir):
+        """
+        @returns Directory for output, and temporary directory if none given, or None
+        """
+        if output_dir is not None:
+            return output_dir, None
+        temporary = tempfile.TemporaryDirectory(prefix="stanhf_")
+        return temporary.name, temporary
+
+    @staticmethod
+    async def _fit(run, files, temporary):
+        """
+        @param run Awaitable running Stan model
+        @param files Stan csv files written by run
+        @param temporary Temporary directory of files, or None
+        @returns cmdstanpy fit owning temporary directory, if any, such that it is removed with the fit
+        """
+        try:
+            await run
+            fit = from_csv(files)
+        except BaseException:
+            if temporary is not None:
+                temporary.cleanup()
+            raise
+        fit._stanhf_temporary_directory = temporary  # pylint: disable=protected-access
+        return fit
+
+    async def _run(self, method, args, job):
+        """
+        @returns Output of running a method of Stan model
+        """
+        return await run_process([self.exe_file_name, method, *args], f"{job} {self.name}",
+                                 self.progress, self.limit)
+
+    @staticmethod
+    def _common(data, inits, output, seed=None, chain=1):
+        """
+        @returns Arguments common to all methods
+        """
+        args = [f"id={chain}"]
+        if data is not None:
+            args += ["data", f"file={data}"]
+        if inits is not None:
+            args.append(f"init={inits}")
+        if seed is not None:
+            args += ["random", f"seed={seed}"]
+        return args + ["output", f"file={output}"]
+
+    async def alog_prob(self, params, data=None, jacobian=True, sig_figs=None):
+        """
+        Evaluate target and its gradient at one point, or many points in a Stan csv file
+
+        @returns Data frame of target and gradient at each point
+        """
+        with tempfile.TemporaryDirectory(prefix="stanhf_") as directory:
+            params = self._file(params, directory, "params.json")
+            data = self._file(data, directory, "data.json")
+            output = os.path.join(directory, "output.csv")
+
+            args = [f"constrained_params={params}", f"jacobian={int(jacobian)}"]
+            args += self._common(data, None, output)
+            if sig_figs is not None:
+                args.append(f"sig_figs={sig_figs}")
+
+            await self._run("log_prob", args, "log_prob")
+            return pd.read_csv(output, comment="#")
+
+    async def asample(self, data=None, inits=None, chains=1, seed=None, output_dir=None, **kwargs):
+        """
+        Sample chains concurrently
+
+        @param output_dir Directory for output, kept and owned by the caller; by default a temporary
+                          one owned by the fit and removed with it
+        @param kwargs Arguments for sample method, e.g., num_samples=1000
+        @returns cmdstanpy fit
+        """
+        directory, temporary = self._output_dir(output_dir)
+        data = self._file(data, directory, "data.json")
+        inits = self._file(inits, directory, "init.json")
+        outputs = [os.path.join(directory, f"{os.path.splitext(self.name)[0]}_{c}.csv")
+                   for c in range(1, chains + 1)]
+        args = [f"{k}={v}" for k, v in kwargs.items()]
+
+        run = asyncio.gather(*[
+            self._run("sample", args + self._common(data, inits, o, seed, c), f"sample chain {c}")
+            for c, o in enumerate(outputs, 1)])
+
+        return await self._fit(run, outputs, temporary)
+
+    async def aoptimize(self, data=None, inits=None, seed=None, output_dir=None, **kwargs):
+        """
+        Optimize target
+
+        @param output_dir Directory for output, kept and owned by the caller; by default a temporary
+                          one owned by the fit and removed with it
+        @param kwargs Arguments for optimize method, e.g., jacobian=0
+        @returns cmdstanpy fit
+        """
+        directory, temporary = self._output_dir(output_dir)
+        data = self._file(data, directory, "data.json")
+        inits = self._file(inits, directory, "init.json")
+        output = os.path.join(directory, f"{os.path.splitext(self.name)[0]}_optimize.csv")
+        args = [f"{k}={v}" for k, v in kwargs.items()]
+
+        run = self._run("optimize", args + self._common(data, inits, output, seed), "optimize")
+        return await self._fit(run, output, temporary)
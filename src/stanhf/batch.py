@@ -0,0 +1,292 @@
+"""
+Convert many patches or many models
+===================================
+
+The background-only model and patchset are read and converted once and patches
+are applied incrementally on a process pool, or in this process for one worker.
+Patches that result in the same Stan program share one program, which is
+written by the worker that applied the patch and need be built and validated
+only once.
+
+Many models are converted, built and validated on a process pool, such that
+failures are isolated to each model and reported with timings of each stage.
+"""
+
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import pyhf
+
+from .convert import Convert, VALIDATE_POINTS
+from .patchset import PatchSetIndex
+from .instrument import profiled
+
+
+OUTPUTS = ("_data.json", "_init.json", "_index.json", "_manifest.json", "_summary.json")
+
+
+BASE = None
+PROGRAMS = {}
+
+
+def init_worker(hf, measurement=None, include=None, exclude=None):
+    """
+    Convert background-only model once per worker
+    """
+    global BASE  # pylint: disable=global-statement
+    BASE = Convert.from_workspace(pyhf.Workspace(hf), measurement=measurement, include=include, exclude=exclude)
+    PROGRAMS.clear()
+
+
+def apply_patch(base, patch_spec, root, programs):
+    """
+    Write data and initial values for a patch applied to background-only model, and its Stan program
+    if the first with its structure
+
+    @param base Converter for background-only model
+    @param patch_spec Patch specification with metadata
+    @param root Root for file names
+    @param programs File names of Stan programs already written by structure hash
+    @returns Converter for patch, structure hash and file names of Stan program or None, data and initial values
+    """
+    patch = pyhf.patchset.Patch(patch_spec)
+    convert = base.apply_patch(patch)
+    root = f"{root}_{patch.name}"
+    stan_file_name = None
+
+    if convert.structure_hash not in programs:
+        stan_file_name = programs[convert.structure_hash] = convert.write_stan_file(f"{root}.stan")
+
+    if convert.measurement is not None:
+        root = f"{root}_{convert.measurement}"
+
+    data_file_name = convert.write_stan_data_file(f"{root}_data.json")
+    init_file_name = convert.write_stan_init_file(f"{root}_init.json")
+    return convert, convert.structure_hash, stan_file_name, data_file_name, init_file_name
+
+
+def convert_patch(patch_spec, root):
+    """
+    Apply patch in a worker, writing a Stan program for the first patch with each structure in that worker
+
+    @returns Structure hash and file names of Stan program or None, data and initial values
+    """
+    return apply_patch(BASE, patch_spec, root, PROGRAMS)[1:]
+
+
+def convert_in_process(base, specs, root):
+    """
+    Apply patches in this process
+
+    @returns Converter for each structure hash, and structure hash and file names for each patch
+    """
+    converted = {}
+    written = {}
+    results = []
+
+    for spec in specs:
+        convert, *result = apply_patch(base, spec, root, written)
+        converted.setdefault(convert.structure_hash, convert)
+        results.append(result)
+
+    return converted, results
+
+
+@profiled()
+def convert_patchset(hf_file_name, patch_file_name, patch_numbers, workers=1, measurement=None,
+                     include=None, exclude=None):
+    """
+    Convert patches of a patchset applied to a model
+
+    Stan programs are written by the workers; with more than one worker, a
+    structure may be written once by each of them, and the first in order of
+    patches is used.
+
+    @param hf_file_name JSON file name of background-only model
+    @param patch_file_name JSON file name of patchset
+    @param patch_numbers Numbers of patches to apply
+    @param workers Number of processes, or 1 to convert in this process
+    @param measurement Name of measurement, by default the first one
+    @param include Patterns of names of components of model to include
+    @param exclude Patterns of names of components of model to exclude
+    @returns Manifest of files for each patch and converter for each distinct program
+    """
+    with open(hf_file_name, encoding="utf-8") as hf_file:
+        hf = json.load(hf_file)
+
+    index = PatchSetIndex(patch_file_name)
+    selected = [index.patch(n) for n in patch_numbers]
+    specs = [{"metadata": p.metadata, "patch": p.patch} for p in selected]
+
+    workspace = pyhf.Workspace(hf)
+    root = Convert(hf_file_name, include=include, exclude=exclude)._root
+
+    if workers == 1:
+        base = Convert.from_workspace(workspace, measurement=measurement, include=include, exclude=exclude)
+        converted, results = convert_in_process(base, specs, root)
+    else:
+        converted = None
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(hf, measurement, include, exclude)) as pool:
+            results = list(pool.map(convert_patch, specs, [root] * len(specs)))
+
+    manifest = {}
+    programs = {}
+    written = {}
+
+    for structure_hash, stan_file_name, _, _ in results:
+        if stan_file_name is not None:
+            written.setdefault(structure_hash, stan_file_name)
+
+    for patch, (structure_hash, _, data_file_name, init_file_name) in zip(selected, results):
+
+        if structure_hash not in programs:
+            if converted is not None:
+                convert = converted[structure_hash]
+            else:
+                # converted only if needed, e.g., for validation
+                convert = Convert.from_workspace(workspace, patch, measurement=measurement,
+                                                 include=include, exclude=exclude)
+            programs[structure_hash] = convert, written[structure_hash]
+
+        manifest[patch.name] = {"stan": programs[structure_hash][1],
+                                "data": data_file_name,
+                                "init": init_file_name,
+                                "structure_hash": structure_hash}
+
+    return manifest, programs
+
+
+def write_manifest(file_name, manifest):
+    """
+    Write manifest of files for each patch
+    """
+    with open(file_name, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+
+
+def find_hf_files(paths):
+    """
+    @param paths File names, directories or glob patterns
+    @returns File names of json files, excluding those written by stanhf
+    """
+    found = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(glob.glob(os.path.join(path, "*.json")))
+        elif os.path.isfile(path):
+            names = [path]
+        else:
+            names = sorted(glob.glob(path, recursive=True))
+        found += [n for n in names if not n.endswith(OUTPUTS)]
+
+    return list(dict.fromkeys(found))
+
+
+@contextmanager
+def timed(report, stage):
+    """
+    Record time taken by a stage in a report
+    """
+    report["stage"] = stage
+    start = time.perf_counter()
+    yield
+    report["time"][stage] = time.perf_counter() - start
+
+
+def process_model(hf_file_name, build=True, validate_par_names=True, validate_target=True,
+                  build_kwargs=None, validate_points=VALIDATE_POINTS, validate_kwargs=None, **kwargs):
+    """
+    Convert, build and validate one model, isolating any failure
+
+    @param hf_file_name JSON file name
+    @param build_kwargs Options for building
+    @param validate_points Number of points at which to validate target
+    @param validate_kwargs Options for validating, e.g., cache of outcomes of validation
+    @param kwargs Options for converting
+    @returns Report of status, timing of each stage, sizes and validation
+    """
+    report = {"hf": hf_file_name, "status": "ok", "error": None, "stage": None, "time": {},
+              "validation": {"par_names": None, "target": None}}
+
+    try:
+        with timed(report, "convert"):
+            convert = Convert(hf_file_name, **kwargs)
+
+            if "channels" not in convert._hf:
+                report.update(status="skipped", error="not a histfactory workspace", stage=None)
+                return report
+
+            report["summary"] = str(convert)
+            report["par_size"] = convert.par_size
+            report["model_size"] = convert.model_size
+
+        with timed(report, "emit"):
+            stan_file_name, data_file_name, init_file_name = convert.write_to_disk()
+            report["files"] = {"stan": stan_file_name, "data": data_file_name, "init": init_file_name}
+
+        if validate_par_names:
+            with timed(report, "validate_par_names"):
+                convert.validate_par_names(stan_file_name, **(validate_kwargs or {}))
+                report["validation"]["par_names"] = True
+
+        if build:
+            with timed(report, "build"):
+                report["files"]["exe"] = convert.build(stan_file_name, **(build_kwargs or {}))
+
+            if validate_target:
+                with timed(report, "validate_target"):
+                    report["discrepancy"] = convert.validate_target(
+                        report["files"]["exe"], stan_file_name, data_file_name, init_file_name, points=validate_points,
+                        **(validate_kwargs or {}))
+                    report["validation"]["target"] = True
+
+        report["stage"] = None
+
+    except Exception as err:  # pylint: disable=broad-except
+        report["status"] = "failed"
+        report["error"] = f"{type(err).__name__}: {err}"
+
+        if report["stage"].startswith("validate"):
+            report["validation"][report["stage"][len("validate_"):]] = False
+
+    return report
+
+
+def process_models(hf_file_names, workers=1, **kwargs):
+    """
+    Convert, build and validate many models on a process pool
+
+    @param hf_file_names JSON file names
+    @param workers Number of processes
+    @param kwargs Options for processing each model
+    @returns Report for each model, as they complete
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_model, f, **kwargs): f for f in hf_file_names}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                # e.g., worker killed by a crash in Stan or by running out of memory
+                yield {"hf": futures[future], "status": "failed", "error": f"{type(err).__name__}: {err}",
+                       "stage": "worker", "time": {}, "validation": {"par_names": None, "target": None}}
+
+
+def write_summary(file_name, reports, wall_time):
+    """
+    Write summary of processing many models
+    """
+    summary = {"total": len(reports),
+               "failed": sum(r["status"] == "failed" for r in reports),
+               "skipped": sum(r["status"] == "skipped" for r in reports),
+               "time": wall_time,
+               "models": sorted(reports, key=lambda r: r["hf"])}
+
+    with open(file_name, "w", encoding="utf-8") as summary_file:
+        json.dump(summary, summary_file, indent=4)
@@ -0,0 +1,145 @@
+"""
+Evaluate Stan models in process
+===============================
+
+Stan programs are compiled as shared libraries and loaded with BridgeStan,
+such that the target, its gradient and Hessian are evaluated without launching
+a cmdstan executable or writing json files. BridgeStan is an optional
+dependency; cmdstan executables remain the default.
+"""
+
+import json
+import os
+
+import numpy as np
+
+try:
+    import bridgestan
+except ImportError:
+    bridgestan = None
+
+from .pars import flatten_par
+from .stanstr import to_stan_json
+
+
+def compile_library(stan_file_name, stanc_options=None, cpp_options=None):
+    """
+    Compile Stan program as a shared library
+
+    @param stan_file_name File name of Stan program
+    @param stanc_options Options for stanc, as for cmdstanpy
+    @param cpp_options Options for make, as for cmdstanpy
+    @returns File name of shared library
+    """
+    if bridgestan is None:
+        raise ImportError("in-process evaluation requires bridgestan; install it by pip install stanhf[bridgestan]")
+
+    stanc_args = [f"--{k}" if v is True else f"--{k}={v}" for k, v in (stanc_options or {}).items()]
+    make_args = [f"{k}={v}" for k, v in (cpp_options or {}).items()]
+    return str(bridgestan.compile_model(stan_file_name, stanc_args=stanc_args, make_args=make_args))
+
+
+class InProcessModel:
+    """
+    Stan model loaded as a shared library
+
+    Functions of a point act on unconstrained parameters, as in BridgeStan,
+    and their vectorized versions on arrays of points, one per row.
+    """
+
+    def __init__(self, lib_file_name, data=None, seed=1234):
+        """
+        @param lib_file_name File name of shared library or Stan program
+        @param data File name of data or dictionary of data
+        @param seed Seed for random numbers in model
+        """
+        if bridgestan is None:
+            raise ImportError("in-process evaluation requires bridgestan; install it by pip install stanhf[bridgestan]")
+
+        if lib_file_name.endswith(".stan"):
+            lib_file_name = compile_library(lib_file_name)
+
+        if isinstance(data, dict):
+            data = json.dumps(to_stan_json(data))
+
+        self.model = bridgestan.StanModel(lib_file_name, data, seed=seed)
+        self.par_names = self.model.param_names()
+
+    def unconstrain(self, pars):
+        """
+        @param pars Dictionary of constrained parameters, as in initial values
+        @returns Unconstrained parameters
+        """
+        columns = dict(c for k, v in pars.items() for c in zip(*flatten_par(k, v)))
+        theta = np.array([columns[n] for n in self.par_names], dtype=float)
+        return self.model.param_unconstrain(theta)
+
+    def unconstrain_many(self, draws):
+        """
+        @param draws Dictionaries of constrained parameters
+        @returns Unconstrained parameters, one point per row
+        """
+        return np.array([self.unconstrain(d) for d in draws]).reshape(len(draws), self.model.param_unc_num())
+
+    def log_density(self, theta, propto=True, jacobian=True):
+        """
+        @returns Target at a point
+        """
+        return self.model.log_density(np.asarray(theta, dtype=float), propto=propto, jacobian=jacobian)
+
+    def log_density_gradient(self, theta, propto=True, jacobian=True):
+        """
+        @returns Target and its gradient at a point
+        """
+        return self.model.log_density_gradient(np.asarray(theta, dtype=float), propto=propto, jacobian=jacobian)
+
+    def log_density_hessian(self, theta, propto=True, jacobian=True):
+        """
+        @returns Target, its gradient and Hessian at a point
+        """
+        return self.model.log_density_hessian(np.asarray(theta, dtype=float), propto=propto, jacobian=jacobian)
+
+    def log_density_many(self, thetas, propto=True, jacobian=True):
+        """
+        @returns Target at each point
+        """
+        return np.array([self.log_density(t, propto, jacobian) for t in np.atleast_2d(thetas)])
+
+    def log_density_gradient_many(self, thetas, propto=True, jacobian=True):
+        """
+        @returns Target and its gradient at each point
+        """
+        thetas = np.atleast_2d(np.asarray(thetas, dtype=float))
+        lp = np.empty(len(thetas))
+        grad = np.empty(thetas.shape)
+
+        for i, theta in enumerate(thetas):
+            lp[i], _ = self.model.log_density_gradient(theta, propto=propto, jacobian=jacobian, out=grad[i])
+
+        return lp, grad
+
+    def log_density_hessian_many(self, thetas, propto=True, jacobian=True):
+        """
+        @returns Target, its gradient and Hessian at each point
+        """
+        thetas = np.atleast_2d(np.asarray(thetas, dtype=float))
+        lp = np.empty(len(thetas))
+        grad = np.empty(thetas.shape)
+        hess = np.empty(thetas.shape + thetas.shape[1:])
+
+        for i, theta in enumerate(thetas):
+            lp[i], _, _ = self.model.log_density_hessian(
+                theta, propto=propto, jacobian=jacobian, out_grad=grad[i], out_hess=hess[i])
+
+        return lp, grad, hess
+
+
+def run_stanhf_model_in_process(draws, stan_file_name, data_file_name):
+    """
+    Run stanhf model on many points in process
+
+    @param draws Points as dictionaries of constrained parameters
+    @returns Target at each point
+    """
+    model = InProcessModel(os.fspath(stan_file_name), data_file_name)
+    return model.log_density_many(model.unconstrain_many(draws), jacobian=False)
@@ -0,0 +1,363 @@
+"""
+Build Stan programs
+===================
+
+Build Stan programs away from the working directory, or build many Stan
+programs concurrently, under named profiles of compiler options. Executables
+may be shared through a cache keyed by the content of the program.
+"""
+
+import contextlib
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from cmdstanpy import compile_stan_file
+
+from .cache import hash_file, hash_json, hash_str
+from .run import log_prob_throughput
+
+
+BUILD_DIR = os.environ.get(
+    "STANHF_BUILD_DIR", os.path.join(tempfile.gettempdir(), "stanhf"))
+MEMORY_PER_JOB = 2 * 2**30
+PROFILES = {
+    "default": {},
+    "fast-compile": {"cpp_options": {"O": "0"}},
+    "max-performance": {"stanc_options": {"O1": True},
+                        "cpp_options": {"O": "3",
+                                        "CXXFLAGS_OPTIM": "-march=native -mtune=native",
+                                        "PRECOMPILED_HEADERS": "true"}},
+}
+
+
+def profile_options(profile=None, ccache=False):
+    """
+    @param profile Name of build profile, by default cmdstan's defaults
+    @param ccache Whether to cache compiled objects with ccache
+    @returns Options for compiling Stan programs
+    """
+    if profile is None:
+        profile = "default"
+
+    if profile not in PROFILES:
+        raise ValueError(f"unknown build profile {profile}; choose from {', '.join(PROFILES)}")
+
+    options = copy.deepcopy(PROFILES[profile])
+
+    if ccache:
+        launcher = shutil.which("ccache")
+        if launcher is None:
+            warnings.warn("ccache not found; building without it")
+        else:
+            cxx = os.environ.get("CXX", "clang++" if sys.platform == "darwin" else "g++")
+            options.setdefault("cpp_options", {})["CXX"] = f"{launcher} {cxx}"
+
+    return options
+
+
+def write_atomic(file_name, text):
+    """
+    Write text to a file such that it never appears partially written
+    """
+    directory = os.path.dirname(file_name)
+    fd, tmp_file_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+        tmp_file.write(text)
+    os.replace(tmp_file_name, file_name)
+
+
+def copy_atomic(src, dst):
+    """
+    Copy a file such that it never appears partially written
+    """
+    fd, tmp_file_name = tempfile.mkstemp(dir=os.path.dirname(dst) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copy2(src, tmp_file_name)
+        os.replace(tmp_file_name, dst)
+    except OSError:
+        os.remove(tmp_file_name)
+        raise
+    return dst
+
+
+def compile_cached(stan_file_name, exe_cache=None, **kwargs):
+    """
+    Compile Stan program, reusing executables of identical programs from a cache
+
+    @param stan_file_name File name of Stan program
+    @param exe_cache Cache of executables or None to compile as usual
+    @param kwargs Options for compiling Stan program
+    @returns File name of executable Stan model
+    """
+    if exe_cache is None:
+        exe = compile_stan_file(stan_file_name, force=is_outdated(stan_file_name, kwargs), **kwargs)
+        record_options(stan_file_name, kwargs)
+        return exe
+
+    with open(stan_file_name, encoding="utf-8") as stan_file:
+        key = exe_cache.key(stan_file.read(), kwargs)
+
+    cached = exe_cache.load(key)
+
+    if cached is not None:
+        exe = copy_atomic(cached, exe_file_name(stan_file_name))
+    else:
+        # an executable present may have been built under other options, so must not be stored under this key
+        exe = compile_stan_file(stan_file_name, force=True, **kwargs)
+        exe_cache.store(key, exe)
+
+    record_options(stan_file_name, kwargs)
+    return exe
+
+
+def write_program(program, directory=None, **kwargs):
+    """
+    Write Stan program in a directory named by its content and options
+
+    @param program Stan program
+    @param directory Directory in which to build, by default a temporary one
+    @param kwargs Options for compiling Stan program
+    @returns File name of Stan program
+    """
+    if directory is None:
+        directory = BUILD_DIR
+
+    root = os.path.join(directory, hash_str(program, hash_json(kwargs)))
+    os.makedirs(root, exist_ok=True)
+
+    stan_file_name = os.path.join(root, "model.stan")
+
+    if not os.path.isfile(stan_file_name):
+        write_atomic(stan_file_name, program)
+
+    return stan_file_name
+
+
+def build_program(program, directory=None, exe_cache=None, **kwargs):
+    """
+    Build Stan program in a directory named by its content
+
+    Identical programs are written and compiled once for each set of options.
+
+    @param program Stan program
+    @param directory Directory in which to build, by default a temporary one
+    @param exe_cache Cache of executables shared across directories
+    @param kwargs Options for compiling Stan program
+    @returns File name of executable Stan model
+    """
+    return compile_cached(write_program(program, directory, **kwargs), exe_cache, **kwargs)
+
+
+def available_memory():
+    """
+    @returns Available memory in bytes, or None if unknown
+    """
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def max_jobs(jobs=None, memory_per_job=MEMORY_PER_JOB):
+    """
+    @param jobs Requested number of concurrent jobs, by default number of CPUs
+    @param memory_per_job Memory required by each job in bytes
+    @returns Number of concurrent jobs limited by available memory
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    memory = available_memory()
+
+    if memory is None or not memory_per_job:
+        return jobs
+
+    return max(1, min(jobs, memory // memory_per_job))
+
+
+def exe_file_name(stan_file_name):
+    """
+    @returns File name of executable built from a Stan program
+    """
+    root = os.path.splitext(stan_file_name)[0]
+    return f"{root}.exe" if os.name == "nt" else root
+
+
+def is_stale(stan_file_name):
+    """
+    @returns Whether executable built from a Stan program is absent or older than it
+    """
+    exe = exe_file_name(stan_file_name)
+    return not os.path.isfile(exe) or os.path.getmtime(exe) < os.path.getmtime(stan_file_name)
+
+
+def options_file_name(stan_file_name):
+    """
+    @returns File name of record of options under which executable was built
+    """
+    return f"{exe_file_name(stan_file_name)}.options"
+
+
+def record_options(stan_file_name, options):
+    """
+    Record options under which executable built from a Stan program was built
+    """
+    write_atomic(options_file_name(stan_file_name), hash_json(options))
+
+
+def is_outdated(stan_file_name, options):
+    """
+    @returns Whether executable built from a Stan program is stale or was built under other options
+    """
+    if is_stale(stan_file_name):
+        return True
+
+    try:
+        with open(options_file_name(stan_file_name), encoding="utf-8") as options_file:
+            return options_file.read() != hash_json(options)
+    except OSError:
+        return True
+
+
+class BuildScheduler:
+    """
+    Build many Stan programs concurrently
+
+    Identical programs are built once and the executable copied. The first
+    build runs alone, such that objects shared by all builds in cmdstan are
+    built once.
+    """
+
+    def __init__(self, jobs=None, memory_per_job=MEMORY_PER_JOB, exe_cache=None, **kwargs):
+        """
+        @param jobs Maximum number of concurrent builds, by default number of CPUs
+        @param memory_per_job Memory required by each build in bytes
+        @param exe_cache Cache of executables shared across directories
+        @param kwargs Options for compiling Stan programs
+        """
+        self.jobs = max_jobs(jobs, memory_per_job)
+        self.exe_cache = exe_cache
+        self.kwargs = kwargs
+
+    def _build(self, stan_file_name):
+        """
+        @returns Report of building one Stan program
+        """
+        start = time.perf_counter()
+
+        try:
+            exe = compile_cached(stan_file_name, self.exe_cache, **self.kwargs)
+            error = None
+        except (ValueError, RuntimeError, OSError) as err:
+            exe = None
+            error = str(err)
+
+        return {"stan": stan_file_name, "exe": exe, "time": time.perf_counter() - start,
+                "error": error, "duplicate_of": None}
+
+    def _copy(self, report, stan_file_name):
+        """
+        @returns Report of copying executable of an identical Stan program
+        """
+        duplicate = dict(report, stan=stan_file_name, exe=None, time=0., duplicate_of=report["stan"])
+
+        if report["exe"] is None:
+            return duplicate
+
+        try:
+            duplicate["exe"] = copy_atomic(report["exe"], exe_file_name(stan_file_name))
+            record_options(stan_file_name, self.kwargs)
+        except OSError as err:
+            duplicate["error"] = str(err)
+
+        return duplicate
+
+    def build(self, stan_file_names):
+        """
+        @param stan_file_names File names of Stan programs
+        @returns Report of building each Stan program, in the same order
+        """
+        stan_file_names = list(dict.fromkeys(stan_file_names))
+        unique = {}
+        for f in stan_file_names:
+            unique.setdefault(hash_file(f), []).append(f)
+
+        first = [f[0] for f in unique.values()]
+        reports = {}
+
+        if first:
+            reports[first[0]] = self._build(first[0])
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            for report in pool.map(self._build, first[1:]):
+                reports[report["stan"]] = report
+
+        for duplicates in unique.values():
+            report = reports[duplicates[0]]
+            for f in duplicates[1:]:
+                reports[f] = self._copy(report, f)
+
+        return [reports[f] for f in stan_file_names]
+
+
+def build_many(stan_file_names, jobs=None, memory_per_job=MEMORY_PER_JOB, exe_cache=None, **kwargs):
+    """
+    Build many Stan programs concurrently
+
+    @returns Report of building each Stan program
+    """
+    return BuildScheduler(jobs, memory_per_job, exe_cache, **kwargs).build(stan_file_names)
+
+
+def compare_profiles(stan_file_name, data_file_name, draws_file_name, profiles=None, directory=None, ccache=False):
+    """
+    Build one Stan program under several profiles and time gradient evaluations
+
+    @param stan_file_name File name of Stan program
+    @param data_file_name File name of data
+    @param draws_file_name File name of Stan csv of points at which to evaluate gradient
+    @param profiles Names of build profiles, by default all of them
+    @param directory Directory in which to build and keep executables, by default a temporary one removed afterwards
+    @param ccache Whether to cache compiled objects with ccache
+    @returns Report of compile time and gradient evaluations per second for each profile
+    """
+    if profiles is None:
+        profiles = list(PROFILES)
+
+    reports = []
+
+    with contextlib.ExitStack() as stack:
+        if directory is None:
+            build_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="stanhf_"))
+        else:
+            build_dir = directory
+
+        for profile in profiles:
+            root = os.path.join(build_dir, profile)
+            os.makedirs(root, exist_ok=True)
+            profile_stan_file_name = shutil.copy(stan_file_name, os.path.join(root, "model.stan"))
+
+            start = time.perf_counter()
+            exe = compile_stan_file(profile_stan_file_name, force=True, **profile_options(profile, ccache))
+            compile_time = time.perf_counter() - start
+
+            reports.append({"profile": profile, "exe": exe if directory is not None else None,
+                            "compile_time": compile_time,
+                            "gradients_per_second": log_prob_throughput(exe, data_file_name, draws_file_name)})
+
+    return reports
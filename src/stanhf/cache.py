@@ -0,0 +1,276 @@
+"""
+Persistent caches on disk
+=========================
+
+Entries are directories named by a content hash and evicted in least-recently
+used order once the cache exceeds a size limit.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from cmdstanpy import cmdstan_version
+
+from .stanstr import normalize_stan
+
+
+CACHE_DIR = os.environ.get(
+    "STANHF_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "stanhf"))
+MAX_SIZE = 2**30
+MAX_EXE_SIZE = 4 * 2**30
+
+
+def hash_str(*data):
+    """
+    @returns Hash of strings
+    """
+    sha = hashlib.sha256()
+    for d in data:
+        sha.update(str(d).encode("utf-8"))
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def hash_file(file_name, chunk_size=2**20):
+    """
+    @returns Hash of content of a file, read in chunks
+    """
+    sha = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_json(data):
+    """
+    @returns Hash of json-like data independent of key order
+    """
+    return hash_str(json.dumps(data, sort_keys=True, default=str))
+
+
+def dir_size(directory):
+    """
+    @returns Total size of files in a directory
+    """
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, _, files in os.walk(directory) for f in files)
+
+
+class DirectoryCache:
+    """
+    Least-recently used cache of directories on disk
+    """
+
+    def __init__(self, directory, max_size=MAX_SIZE):
+        """
+        @param directory Directory holding cache entries
+        @param max_size Maximum total size of entries in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+    def path(self, key):
+        """
+        @returns Directory of entry
+        """
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """
+        @returns Directory of entry, marked as recently used, or None if absent
+        """
+        path = self.path(key)
+
+        if not os.path.isdir(path):
+            return None
+
+        os.utime(path)
+        return path
+
+    def put(self, key, files=None, copies=None):
+        """
+        Add an entry atomically and evict old entries if necessary
+
+        @param files Dictionary of file names and contents
+        @param copies Dictionary of file names and names of files to copy
+        @returns Directory of entry
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix=".tmp")
+
+        for file_name, text in (files or {}).items():
+            with open(os.path.join(tmp, file_name), "w", encoding="utf-8") as f:
+                f.write(text)
+
+        for file_name, src in (copies or {}).items():
+            shutil.copy2(src, os.path.join(tmp, file_name))
+
+        try:
+            os.rename(tmp, self.path(key))
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.evict(keep=key)
+        return self.get(key)
+
+    def entries(self):
+        """
+        @returns Keys of entries, least-recently used first
+        """
+        if not os.path.isdir(self.directory):
+            return []
+
+        keys = [k for k in os.listdir(self.directory)
+                if not k.startswith(".") and os.path.isdir(self.path(k))]
+        return sorted(keys, key=lambda k: os.path.getmtime(self.path(k)))
+
+    def evict(self, keep=None):
+        """
+        Remove least-recently used entries until cache is within size limit
+
+        @param keep Key of entry that should not be removed
+        """
+        sizes = {k: dir_size(self.path(k)) for k in self.entries()}
+        total = sum(sizes.values())
+
+        for key, size in sizes.items():
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        for key in self.entries():
+            shutil.rmtree(self.path(key), ignore_errors=True)
+
+
+class ModelCache(DirectoryCache):
+    """
+    Cache of converted models
+    """
+
+    FILES = {"program": "model.stan", "data": "data.json",
+             "init": "init.json", "summary": "summary.json"}
+
+    def __init__(self, directory=None, max_size=MAX_SIZE):
+        if directory is None:
+            directory = os.path.join(CACHE_DIR, "models")
+        super().__init__(directory, max_size)
+
+    def load(self, key):
+        """
+        @returns Converted model or None if absent
+        """
+        path = self.get(key)
+
+        if path is None:
+            return None
+
+        entry = {}
+
+        for k, file_name in self.FILES.items():
+            with open(os.path.join(path, file_name), encoding="utf-8") as f:
+                entry[k] = f.read() if k == "program" else json.load(f)
+
+        return entry
+
+    def store(self, key, entry):
+        """
+        Store a converted model
+
+        @param entry Program text and json serializable data, initial values and summary
+        """
+        files = {file_name: entry[k] if k == "program" else json.dumps(entry[k])
+                 for k, file_name in self.FILES.items()}
+        self.put(key, files)
+
+
+class ExecutableCache(DirectoryCache):
+    """
+    Cache of Stan executables shared by identical programs in any directory
+    """
+
+    EXE = "model.exe" if os.name == "nt" else "model"
+
+    def __init__(self, directory=None, max_size=MAX_EXE_SIZE):
+        if directory is None:
+            directory = os.path.join(CACHE_DIR, "executables")
+        super().__init__(directory, max_size)
+
+    @staticmethod
+    def key(program, options=None):
+        """
+        @param program Stan program
+        @param options Options for compiling Stan program
+        @returns Key from normalized program, cmdstan version and options
+        """
+        return hash_str(normalize_stan(program), cmdstan_version(), hash_json(options or {}))
+
+    def load(self, key):
+        """
+        @returns File name of cached executable or None if absent
+        """
+        path = self.get(key)
+
+        if path is None:
+            return None
+
+        return os.path.join(path, self.EXE)
+
+    def store(self, key, exe_file_name):
+        """
+        Store a copy of an executable
+
+        @returns File name of cached executable, or of executable if not cached
+        """
+        path = self.put(key, copies={self.EXE: exe_file_name})
+        return exe_file_name if path is None else os.path.join(path, self.EXE)
+
+
+class ValidationCache(DirectoryCache):
+    """
+    Cache of outcomes of validation and reference pyhf targets at seeded points
+    """
+
+    RESULT = "result.json"
+
+    def __init__(self, directory=None, max_size=MAX_SIZE):
+        if directory is None:
+            directory = os.path.join(CACHE_DIR, "validations")
+        super().__init__(directory, max_size)
+
+    @staticmethod
+    def key(*data):
+        """
+        @returns Key from hashes of everything on which validation depends
+        """
+        return hash_str(*data)
+
+    def load(self, key):
+        """
+        @returns Outcome of validation or None if absent
+        """
+        path = self.get(key)
+
+        if path is None:
+            return None
+
+        with open(os.path.join(path, self.RESULT), encoding="utf-8") as f:
+            return json.load(f)
+
+    def store(self, key, result):
+        """
+        Store outcome of validation
+
+        @param result json serializable outcome
+        """
+        self.put(key, {self.RESULT: json.dumps(result)})
@@ -3,6 +3,8 @@ Parse a channel from a hf model
 ===============================
 """
 
+from functools import cached_property
+
 from .stanabc import Stan
 from .sample import Sample
 from .stanstr import join, add_to_target, flatten
@@ -26,14 +28,14 @@ class Channel(Stan):
         self.expected_name = join("expected", self.name)
         self.observed_name = join("observed", self.name)
 
-    @property
+    @cached_property
     def samples(self):
         """
         @returns Samples associated with this channel
         """
         return [Sample(s, self) for s in self.channel.get("samples", [])]
 
-    @property
+    @cached_property
     def modifiers(self):
         """
         @returns Modifiers associated with this channel
@@ -3,21 +3,66 @@ CLI for stanhf
 ==============
 """
 
+import contextlib
 import importlib.metadata
+import json
 import os
+import time
 import warnings
 
 import click
-from click_help_colors import HelpColorsCommand, version_option
+from click_help_colors import HelpColorsCommand, HelpColorsGroup, version_option
 
 from cmdstanpy import cmdstan_path
 
 from .run import install
-from .convert import Convert
+from .convert import Convert, VALIDATE_POINTS
+from .cache import ModelCache, ExecutableCache, ValidationCache, CACHE_DIR, MAX_SIZE, MAX_EXE_SIZE
+from .batch import convert_patchset, write_manifest, find_hf_files, process_models, write_summary
+from .build import build_many, compare_profiles, max_jobs, profile_options, MEMORY_PER_JOB, PROFILES
+from .instrument import profiling, stage
+from .pars import get_stan_par_names
+from .run import perturb_param_file, write_draws_file
+from .patchset import PatchSetIndex, select_patches
+from .contrib.benchmark import (compare_results, format_comparison, read_results, run_benchmarks, write_results,
+                                SIZES, STAGES, THRESHOLD)
+from .contrib.corpus import Corpus, format_table, run_corpus
+from .contrib.generate import generate_patchset, generate_workspace
 
 
 VERSION = importlib.metadata.version(__package__)
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+SUBSET_KINDS = {"channel": "channels", "sample": "samples",
+                "modifier": "modifiers", "modifier-type": "modifier_types"}
+
+
+def read_subset(selection):
+    """
+    @returns Patterns of names for each kind of component of a model
+    """
+    subset = {}
+    for kind, pattern in selection:
+        subset.setdefault(SUBSET_KINDS[kind], []).append(pattern)
+    return subset or None
+
+
+@contextlib.contextmanager
+def profile_cli(file_name, name):
+    """
+    Profile stages within context and write report and Chrome trace, if a file name is given
+    """
+    if file_name is None:
+        yield
+        return
+
+    with profiling() as profiler:
+        try:
+            with stage(name):
+                yield
+        finally:
+            report = profiler.write_report(file_name)
+            trace = profiler.write_trace(f"{os.path.splitext(file_name)[0]}_trace.json")
+            click.echo(f"- Profile written to {report} and Chrome trace to {trace}")
 
 
 def print_cmdstan_path(ctx, _, value):
@@ -30,12 +75,23 @@ def print_cmdstan_path(ctx, _, value):
     ctx.exit()
 
 
+def print_patches(ctx, _, value):
+    """
+    Print patches in a patchset
+    """
+    if not value or ctx.resilient_parsing:
+        return
+    for number, metadata in enumerate(p["metadata"] for p in PatchSetIndex(value).index["patches"]):
+        click.echo(f"{number}: {metadata['name']} {metadata.get('values')}")
+    ctx.exit()
+
+
 @click.command(cls=HelpColorsCommand,
                help_headers_color='yellow',
                help_options_color='green',
                context_settings=CONTEXT_SETTINGS,
                epilog="Check out https://github.com/xhep-lab/stanhf for more details or to report issues")
-@click.argument('hf_file_name', type=click.Path(exists=True))
+@click.argument('hf_file_names', nargs=-1, required=True)
 @version_option(VERSION,
                 prog_name="stanhf",
                 message="%(prog)s version %(version)s",
@@ -46,25 +102,351 @@ def print_cmdstan_path(ctx, _, value):
               help="Validate Stan program parameter names.")
 @click.option('--validate-target/--no-validate-target', default=True,
               help="Validate Stan program target.")
+@click.option('--validate-points', type=click.IntRange(2), default=VALIDATE_POINTS, show_default=True,
+              help="Number of points at which to validate Stan program target.")
 @click.option('--cmdstan-path', is_flag=True, callback=print_cmdstan_path,
               expose_value=False, is_eager=True, help="Show path to cmdstan.")
-@click.option('--patch', type=(click.Path(exists=True), click.IntRange(0)),
-              default=None, nargs=2, help="Apply a patch to the model.",  metavar='<path to patchset> <number>')
-def cli(hf_file_name, build, validate_par_names, validate_target, patch):
+@click.option('--patch', type=(click.Path(exists=True), str),
+              default=None, nargs=2, help="Apply a patch, or e.g., 'all', '1,4,7' or '0-9' patches, to the model.",
+              metavar='<path to patchset> <numbers>')
+@click.option('--list-patches', type=click.Path(exists=True), callback=print_patches,
+              expose_value=False, is_eager=True, metavar='<path to patchset>',
+              help="Show patches in a patchset.")
+@click.option('--workers', type=click.IntRange(1), default=1, show_default=True,
+              help="Number of processes for converting many patches or models.")
+@click.option('--summary', type=click.Path(dir_okay=False), default="stanhf_summary.json",
+              show_default=True, help="Json summary of converting many models.")
+@click.option('--cache/--no-cache', default=False,
+              help="Cache converted models and executables on disk.")
+@click.option('--cache-dir', type=click.Path(file_okay=False), default=CACHE_DIR,
+              show_default=True, help="Directory for cache.")
+@click.option('--validation-cache/--no-validation-cache', default=False,
+              help="Cache outcomes of validation on disk and skip validation if nothing changed.")
+@click.option('--force-validate', is_flag=True, default=False,
+              help="Validate even if outcome of validation is cached.")
+@click.option('--cache-size', type=click.IntRange(0), default=MAX_SIZE // 2**20,
+              show_default=True, help="Maximum size of cache of converted models in MB.")
+@click.option('--exe-cache-size', type=click.IntRange(0), default=MAX_EXE_SIZE // 2**20,
+              show_default=True, help="Maximum size of cache of executables in MB.")
+@click.option('--build-profile', type=click.Choice(list(PROFILES)), default="default",
+              show_default=True, help="Profile of compiler options for building.")
+@click.option('--ccache/--no-ccache', default=False,
+              help="Cache compiled objects with ccache.")
+@click.option('--measurement', type=str, default=None,
+              help="Name of measurement for data and initial values.  [default: first measurement]")
+@click.option('--include', type=(click.Choice(list(SUBSET_KINDS)), str), multiple=True,
+              metavar='<kind> <pattern>', help="Include only channels, samples, modifiers or modifier types "
+              "matching a pattern, e.g., 'channel SR*'.")
+@click.option('--exclude', type=(click.Choice(list(SUBSET_KINDS)), str), multiple=True,
+              metavar='<kind> <pattern>', help="Exclude channels, samples, modifiers or modifier types "
+              "matching a pattern, e.g., 'modifier-type shapesys'.")
+@click.option('--profile', type=click.Path(dir_okay=False), default=None, metavar='<path to report>',
+              help="Record time and memory of each stage in a json report and a Chrome trace "
+              "with suffix _trace.")
+@click.pass_context
+def cli(ctx, hf_file_names, build, validate_par_names, validate_target, validate_points, patch, workers, summary,
+        cache, cache_dir, validation_cache, force_validate, cache_size, exe_cache_size, build_profile, ccache,
+        measurement, include, exclude, profile):
     """
-    Convert, build and validate a histfactory json file HF_FILE_NAME as a Stan model.
+    Convert, build and validate histfactory json files HF_FILE_NAMES as Stan models.
+
+    HF_FILE_NAMES may be one file, or many files, directories or glob patterns.
     """
-    if validate_target and not build:
-        warnings.warn("Cannot validate target as not building")
-        validate_target = False
+    with profile_cli(profile, "stanhf"):
+        if validate_target and not build:
+            warnings.warn("Cannot validate target as not building")
+            validate_target = False
+
+        exe_cache = ExecutableCache(os.path.join(cache_dir, "executables"), exe_cache_size * 2**20) if cache else None
+        model_cache = ModelCache(os.path.join(cache_dir, "models"), cache_size * 2**20) if cache else None
+        validate_kwargs = {"validation_cache": ValidationCache(os.path.join(cache_dir, "validations"))
+                           if validation_cache else None, "force": force_validate}
+        include = read_subset(include)
+        exclude = read_subset(exclude)
+
+        if len(hf_file_names) != 1 or not os.path.isfile(hf_file_names[0]):
+            if patch is not None:
+                raise click.UsageError("cannot apply a patch to many models")
+
+            failed = cli_many(find_hf_files(hf_file_names), workers, summary, build, validate_par_names,
+                              validate_target, {"profile": build_profile, "ccache": ccache, "exe_cache": exe_cache},
+                              validate_points=validate_points, validate_kwargs=validate_kwargs, cache=model_cache,
+                              measurement=measurement, include=include, exclude=exclude)
+            ctx.exit(1 if failed else 0)
+
+        hf_file_name = hf_file_names[0]
+
+        if patch is not None:
+            patch_file_name, selection = patch
+            if selection.isdigit():
+                patch = (patch_file_name, int(selection))
+            else:
+                patch_numbers = select_patches(selection, len(PatchSetIndex(patch_file_name)))
+                cli_patchset(hf_file_name, patch_file_name, patch_numbers, workers,
+                             build, validate_par_names, validate_target, build_profile, ccache, exe_cache,
+                             measurement, include, exclude, validate_points, validate_kwargs)
+                return
+
+        convert = Convert(hf_file_name, patch, model_cache, measurement=measurement, include=include, exclude=exclude)
+        click.echo(convert)
+
+        stan_path = install()
+        click.echo(f"- Stan installed at {stan_path}")
+
+        stan_file_name, data_file_name, init_file_name = convert.write_to_disk()
+        click.echo(
+            f"- Stan files created at {stan_file_name}, {data_file_name} and {init_file_name}")
+
+        if validate_par_names:
+            convert.validate_par_names(stan_file_name, **validate_kwargs)
+            click.echo("- Validated parameter names")
+
+        if build:
+            local = os.path.join(stan_path, "build", "local")
+            click.echo(f"- Build settings controlled at {local} and by profile {build_profile}")
+
+            exe_file_name = convert.build(stan_file_name, profile=build_profile, ccache=ccache, exe_cache=exe_cache)
+            click.echo(f"- Stan executable created at {exe_file_name}")
+
+            cmd = f"{exe_file_name} sample num_chains=4 data file={data_file_name} init={init_file_name}"
+            click.echo(f"- Try e.g., {cmd}")
+
+            if validate_target:
+                discrepancy = convert.validate_target(
+                    exe_file_name, stan_file_name, data_file_name, init_file_name, points=validate_points,
+                    **validate_kwargs)
+                click.echo(f"- Validated target at {discrepancy['points']} points; "
+                           f"maximum discrepancy {discrepancy['max']:.2e}")
+
+
+def cli_many(hf_file_names, workers, summary, build, validate_par_names, validate_target, build_kwargs, **kwargs):
+    """
+    Convert, build and validate many models on a process pool, isolating failures
+
+    @returns Number of models that failed
+    """
+    if not hf_file_names:
+        raise click.UsageError("no histfactory json files found")
+
+    click.echo(f"- Found {len(hf_file_names)} histfactory json files")
+
+    if build:
+        stan_path = install()
+        click.echo(f"- Stan installed at {stan_path}")
+        workers = max_jobs(workers)
+
+    start = time.perf_counter()
+    reports = []
+
+    for r in process_models(hf_file_names, workers, build=build, validate_par_names=validate_par_names,
+                            validate_target=validate_target, build_kwargs=build_kwargs, **kwargs):
+        reports.append(r)
+        total = sum(r["time"].values())
+        if r["status"] == "failed":
+            click.echo(f"- Failed {r['hf']} at stage {r['stage']} after {total:.1f}s:\n{r['error']}")
+        elif r["status"] == "skipped":
+            click.echo(f"- Skipped {r['hf']}: {r['error']}")
+        else:
+            click.echo(f"- Processed {r['hf']} in {total:.1f}s")
+
+    write_summary(summary, reports, time.perf_counter() - start)
+    ok = sum(r["status"] == "ok" for r in reports)
+    failed = sum(r["status"] == "failed" for r in reports)
+    click.echo(f"- {ok} of {len(reports)} models succeeded and {failed} failed; summary written to {summary}")
+    return failed
+
+
+def cli_patchset(hf_file_name, patch_file_name, patch_numbers, workers, build, validate_par_names, validate_target,
+                 build_profile="default", ccache=False, exe_cache=None, measurement=None, include=None, exclude=None,
+                 validate_points=VALIDATE_POINTS, validate_kwargs=None):
+    """
+    Convert, build and validate many patches, building and validating each distinct program once
+    """
+    manifest, programs = convert_patchset(
+        hf_file_name, patch_file_name, patch_numbers, workers, measurement, include, exclude)
+    click.echo(f"- Converted {len(manifest)} patches with {len(programs)} distinct Stan programs")
+
+    manifest_file_name = f"{os.path.splitext(hf_file_name)[0]}_manifest.json"
+
+    # files for every patch exist already, so write manifest even if building or validating fails
+    try:
+        stan_path = install()
+        click.echo(f"- Stan installed at {stan_path}")
+
+        for structure_hash, (convert, stan_file_name) in programs.items():
+
+            patch_names = [k for k, v in manifest.items() if v["structure_hash"] == structure_hash]
+            click.echo(f"- Stan program {stan_file_name} for patches {', '.join(patch_names)}")
+
+            if validate_par_names:
+                convert.validate_par_names(stan_file_name, **(validate_kwargs or {}))
+                click.echo("- Validated parameter names")
+
+            if build:
+                exe_file_name = convert.build(stan_file_name, profile=build_profile, ccache=ccache, exe_cache=exe_cache)
+                click.echo(f"- Stan executable created at {exe_file_name}")
+
+                for name in patch_names:
+                    manifest[name]["exe"] = exe_file_name
+
+                if validate_target:
+                    files = manifest[patch_names[0]]
+                    discrepancy = convert.validate_target(
+                        exe_file_name, stan_file_name, files["data"], files["init"], points=validate_points,
+                        **(validate_kwargs or {}))
+                    click.echo(f"- Validated target at {discrepancy['points']} points; "
+                               f"maximum discrepancy {discrepancy['max']:.2e}")
+    finally:
+        write_manifest(manifest_file_name, manifest)
+        click.echo(f"- Manifest of files for each patch written to {manifest_file_name}")
+
+
+@click.command(cls=HelpColorsCommand,
+               help_headers_color='yellow',
+               help_options_color='green',
+               context_settings=CONTEXT_SETTINGS,
+               epilog="Check out https://github.com/xhep-lab/stanhf for more details or to report issues")
+@click.argument('stan_file_names', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@version_option(VERSION,
+                prog_name="stanhf-build",
+                message="%(prog)s version %(version)s",
+                version_color='green')
+@click.option('--jobs', '-j', type=click.IntRange(1), default=None,
+              help="Maximum number of concurrent builds.  [default: number of CPUs]")
+@click.option('--memory-per-job', type=click.FloatRange(0), default=MEMORY_PER_JOB / 2**30,
+              show_default=True, help="Memory required by each build in GB.")
+@click.option('--report', type=click.Path(dir_okay=False), default=None,
+              help="Write a json report of builds.")
+@click.option('--build-profile', type=click.Choice(list(PROFILES)), default="default",
+              show_default=True, help="Profile of compiler options for building.")
+@click.option('--ccache/--no-ccache', default=False,
+              help="Cache compiled objects with ccache.")
+@click.option('--cache/--no-cache', default=False,
+              help="Cache executables on disk.")
+@click.option('--cache-dir', type=click.Path(file_okay=False), default=CACHE_DIR,
+              show_default=True, help="Directory for cache.")
+@click.option('--exe-cache-size', type=click.IntRange(0), default=MAX_EXE_SIZE // 2**20,
+              show_default=True, help="Maximum size of cache of executables in MB.")
+@click.pass_context
+def build_cli(ctx, stan_file_names, jobs, memory_per_job, report, build_profile, ccache,
+              cache, cache_dir, exe_cache_size):
+    """
+    Build many Stan programs STAN_FILE_NAMES concurrently.
+    """
+    stan_path = install()
+    click.echo(f"- Stan installed at {stan_path}")
 
-    convert = Convert(hf_file_name, patch)
+    exe_cache = ExecutableCache(os.path.join(cache_dir, "executables"), exe_cache_size * 2**20) if cache else None
+    reports = build_many(stan_file_names, jobs, memory_per_job * 2**30, exe_cache,
+                         **profile_options(build_profile, ccache))
+
+    for r in reports:
+        if r["error"] is not None:
+            click.echo(f"- Failed to build {r['stan']}:\n{r['error']}")
+        elif r["duplicate_of"] is not None:
+            click.echo(f"- Stan executable {r['exe']} copied as {r['stan']} identical to {r['duplicate_of']}")
+        else:
+            click.echo(f"- Stan executable {r['exe']} built in {r['time']:.1f}s")
+
+    if report is not None:
+        with open(report, "w", encoding="utf-8") as report_file:
+            json.dump(reports, report_file, indent=4)
+        click.echo(f"- Report written to {report}")
+
+    if any(r["error"] is not None for r in reports):
+        ctx.exit(1)
+
+
+@click.command(cls=HelpColorsCommand,
+               help_headers_color='yellow',
+               help_options_color='green',
+               context_settings=CONTEXT_SETTINGS,
+               epilog="Check out https://github.com/xhep-lab/stanhf for more details or to report issues")
+@click.argument('hf_file_name', type=click.Path(exists=True))
+@version_option(VERSION,
+                prog_name="stanhf-profiles",
+                message="%(prog)s version %(version)s",
+                version_color='green')
+@click.option('--build-profile', 'build_profiles', type=click.Choice(list(PROFILES)), multiple=True,
+              help="Profile of compiler options to compare.  [default: all profiles]")
+@click.option('--points', type=click.IntRange(1), default=1000, show_default=True,
+              help="Number of points at which to evaluate gradient.")
+@click.option('--ccache/--no-ccache', default=False,
+              help="Cache compiled objects with ccache.")
+@click.option('--report', type=click.Path(dir_okay=False), default=None,
+              help="Write a json report of profiles.")
+def profiles_cli(hf_file_name, build_profiles, points, ccache, report):
+    """
+    Compare compile time and gradient evaluations per second of a histfactory json file HF_FILE_NAME
+    built under several profiles.
+    """
+    convert = Convert(hf_file_name)
     click.echo(convert)
 
     stan_path = install()
     click.echo(f"- Stan installed at {stan_path}")
 
     stan_file_name, data_file_name, init_file_name = convert.write_to_disk()
+    draws = [perturb_param_file(init_file_name) for _ in range(points)]
+    draws_file_name = write_draws_file(f"{os.path.splitext(stan_file_name)[0]}_draws.csv",
+                                       draws, get_stan_par_names(stan_file_name))
+    click.echo(f"- {points} points written to {draws_file_name}")
+
+    reports = compare_profiles(stan_file_name, data_file_name, draws_file_name,
+                               build_profiles or None, ccache=ccache)
+
+    for r in reports:
+        click.echo(f"- Profile {r['profile']}: compiled in {r['compile_time']:.1f}s, "
+                   f"{r['gradients_per_second']:.0f} gradient evaluations per second")
+
+    if report is not None:
+        with open(report, "w", encoding="utf-8") as report_file:
+            json.dump(reports, report_file, indent=4)
+        click.echo(f"- Report written to {report}")
+
+
+@click.command(cls=HelpColorsCommand,
+               help_headers_color='yellow',
+               help_options_color='green',
+               context_settings=CONTEXT_SETTINGS,
+               epilog="Check out https://github.com/xhep-lab/stanhf for more details or to report issues")
+@click.argument('hf_file_names', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@version_option(VERSION,
+                prog_name="stanhf-combine",
+                message="%(prog)s version %(version)s",
+                version_color='green')
+@click.option('--correlations', type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Json file of dictionaries of names of parameters and names in combined model, "
+                   "for each histfactory json file or keyed by its file name.")
+@click.option('--name', type=str, default="combined", show_default=True,
+              help="Name of combined model, used for its files.")
+@click.option('--build/--no-build', default=True,
+              help="Build Stan program.")
+@click.option('--validate-par-names/--no-validate-par-names', default=True,
+              help="Validate Stan program parameter names.")
+@click.option('--validate-target/--no-validate-target', default=True,
+              help="Validate Stan program target.")
+@click.option('--validate-points', type=click.IntRange(2), default=VALIDATE_POINTS, show_default=True,
+              help="Number of points at which to validate Stan program target.")
+def combine_cli(hf_file_names, correlations, name, build, validate_par_names, validate_target, validate_points):
+    """
+    Combine histfactory json files HF_FILE_NAMES into one Stan model with shared parameters.
+    """
+    if correlations is not None:
+        with open(correlations, encoding="utf-8") as correlations_file:
+            correlations = json.load(correlations_file)
+        if isinstance(correlations, dict):
+            correlations = [correlations.get(f) for f in hf_file_names]
+
+    convert = Convert.combine(hf_file_names, correlations, name=name)
+    click.echo(convert)
+
+    stan_path = install()
+    click.echo(f"- Stan installed at {stan_path}")
+
+    stan_file_name = convert.write_stan_file(f"{name}.stan")
+    data_file_name = convert.write_stan_data_file(f"{name}_data.json")
+    init_file_name = convert.write_stan_init_file(f"{name}_init.json")
     click.echo(
         f"- Stan files created at {stan_file_name}, {data_file_name} and {init_file_name}")
 
@@ -73,16 +455,257 @@ def cli(hf_file_name, build, validate_par_names, validate_target, patch):
         click.echo("- Validated parameter names")
 
     if build:
-        local = os.path.join(stan_path, "build", "local")
-        click.echo(f"- Build settings controlled at {local}")
-
         exe_file_name = convert.build(stan_file_name)
         click.echo(f"- Stan executable created at {exe_file_name}")
 
-        cmd = f"{exe_file_name} sample num_chains=4 data file={data_file_name} init={init_file_name}"
-        click.echo(f"- Try e.g., {cmd}")
-
         if validate_target:
-            convert.validate_target(
-                exe_file_name, stan_file_name, data_file_name, init_file_name)
-            click.echo("- Validated target")
+            discrepancy = convert.validate_target(
+                exe_file_name, stan_file_name, data_file_name, init_file_name, points=validate_points)
+            click.echo(f"- Validated target at {discrepancy['points']} points; "
+                       f"maximum discrepancy {discrepancy['max']:.2e}")
+
+
+@click.group(cls=HelpColorsGroup,
+             help_headers_color='yellow',
+             help_options_color='green',
+             context_settings=CONTEXT_SETTINGS,
+             epilog="Check out https://github.com/xhep-lab/stanhf for more details or to report issues")
+@version_option(VERSION,
+                prog_name="stanhf-corpus",
+                message="%(prog)s version %(version)s",
+                version_color='green')
+def corpus_cli():
+    """
+    Manage and run a local corpus of histfactory json files with a manifest of their hashes.
+    """
+
+
+@corpus_cli.command("add", context_settings=CONTEXT_SETTINGS)
+@click.argument('corpus_dir', type=click.Path(file_okay=False))
+@click.argument('name')
+@click.argument('workspace')
+@click.option('--patchset', default=None, help="Patchset for the workspace.")
+@click.option('--patch', type=click.IntRange(0), default=None, help="Number of patch in patchset to apply.")
+@click.option('--doi', default=None, help="DOI of HEPData record.")
+@click.option('--download', is_flag=True, default=False,
+              help="Download HEPData record by DOI; WORKSPACE and patchset are paths within the record.")
+def corpus_add_cli(corpus_dir, name, workspace, patchset, patch, doi, download):
+    """
+    Add WORKSPACE to corpus in CORPUS_DIR as NAME.
+    """
+    corpus = Corpus(corpus_dir)
+
+    if download:
+        if doi is None:
+            raise click.UsageError("require --doi to download")
+        entry = corpus.fetch(name, doi, workspace, patchset, patch)
+    else:
+        entry = corpus.add(name, workspace, patchset, patch, doi)
+
+    click.echo(f"- Added {name} with {', '.join(entry['files'])} to {corpus.manifest_file_name}")
+
+
+@corpus_cli.command("verify", context_settings=CONTEXT_SETTINGS)
+@click.argument('corpus_dir', type=click.Path(exists=True, file_okay=False))
+@click.pass_context
+def corpus_verify_cli(ctx, corpus_dir):
+    """
+    Verify hashes of files in corpus in CORPUS_DIR.
+    """
+    corpus = Corpus(corpus_dir)
+    problems = {n: corpus.verify(n) for n in corpus.entries}
+
+    for name, p in problems.items():
+        click.echo(f"- {name}: {'; '.join(p) if p else 'ok'}")
+
+    ctx.exit(1 if any(problems.values()) else 0)
+
+
+@corpus_cli.command("run", context_settings=CONTEXT_SETTINGS)
+@click.argument('corpus_dir', type=click.Path(exists=True, file_okay=False))
+@click.argument('names', nargs=-1)
+@click.option('--workers', type=click.IntRange(1), default=None,
+              help="Number of processes.  [default: number of CPUs]")
+@click.option('--build/--no-build', default=True,
+              help="Build Stan programs.")
+@click.option('--validate-par-names/--no-validate-par-names', default=True,
+              help="Validate Stan program parameter names.")
+@click.option('--validate-target/--no-validate-target', default=True,
+              help="Validate Stan program target.")
+@click.option('--validate-points', type=click.IntRange(2), default=VALIDATE_POINTS, show_default=True,
+              help="Number of points at which to validate Stan program target.")
+@click.option('--build-profile', type=click.Choice(list(PROFILES)), default="default",
+              show_default=True, help="Profile of compiler options for building.")
+@click.option('--summary', type=click.Path(dir_okay=False), default="stanhf_corpus.json",
+              show_default=True, help="Json summary of running corpus.")
+@click.option('--table', type=click.Path(dir_okay=False), default=None,
+              help="Write table of timings and sizes.")
+@click.pass_context
+def corpus_run_cli(ctx, corpus_dir, names, workers, build, validate_par_names, validate_target, validate_points,
+                   build_profile, summary, table):
+    """
+    Convert, build and validate entries NAMES, by default all entries, in corpus in CORPUS_DIR from local files only.
+    """
+    if validate_target and not build:
+        warnings.warn("Cannot validate target as not building")
+        validate_target = False
+
+    corpus = Corpus(corpus_dir)
+    click.echo(f"- Found {len(corpus)} entries in {corpus.manifest_file_name}")
+
+    if build:
+        stan_path = install()
+        click.echo(f"- Stan installed at {stan_path}")
+
+    start = time.perf_counter()
+    reports = []
+
+    for r in run_corpus(corpus, names or None, max_jobs(workers), build=build, validate_par_names=validate_par_names,
+                        validate_target=validate_target, validate_points=validate_points,
+                        build_kwargs={"profile": build_profile}):
+        reports.append(r)
+        click.echo(f"- {r['status'].capitalize()} {r['name']} in {sum(r['time'].values()):.1f}s"
+                   + (f" at stage {r['stage']}:\n{r['error']}" if r["status"] == "failed" else ""))
+
+    write_summary(summary, reports, time.perf_counter() - start)
+    click.echo(format_table(reports))
+
+    if table is not None:
+        with open(table, "w", encoding="utf-8") as table_file:
+            table_file.write(format_table(reports) + "\n")
+        click.echo(f"- Table written to {table}")
+
+    failed = sum(r["status"] == "failed" for r in reports)
+    click.echo(f"- {len(reports) - failed} of {len(reports)} entries succeeded; summary written to {summary}")
+    ctx.exit(1 if failed else 0)
+
+
+@click.command(cls=HelpColorsCommand,
+               help_headers_color='yellow',
+               help_options_color='green',
+               context_settings=CONTEXT_SETTINGS,
+               epilog="Check out https://github.com/xhep-lab/stanhf for more details or to report issues")
+@click.argument('hf_file_name', type=click.Path(dir_okay=False))
+@version_option(VERSION,
+                prog_name="stanhf-generate",
+                message="%(prog)s version %(version)s",
+                version_color='green')
+@click.option('--channels', type=click.IntRange(1), default=1, show_default=True,
+              help="Number of channels.")
+@click.option('--bins', type=click.IntRange(1), default=1, show_default=True,
+              help="Number of bins in each channel.")
+@click.option('--samples', type=click.IntRange(0), default=1, show_default=True,
+              help="Number of background samples in each channel.")
+@click.option('--normsys', type=click.IntRange(0), default=0, show_default=True,
+              help="Number of normsys modifiers on each background sample.")
+@click.option('--histosys', type=click.IntRange(0), default=0, show_default=True,
+              help="Number of histosys modifiers on each background sample.")
+@click.option('--shapesys', type=click.IntRange(0), default=0, show_default=True,
+              help="Number of shapesys modifiers on each background sample.")
+@click.option('--staterror/--no-staterror', default=False,
+              help="Statistical errors on background samples.")
+@click.option('--shapefactor', type=click.IntRange(0), default=0, show_default=True,
+              help="Number of shapefactor modifiers on backgrounds in each channel.")
+@click.option('--normfactor', type=click.IntRange(0), default=0, show_default=True,
+              help="Number of normfactor modifiers, besides the POI, on each background sample.")
+@click.option('--lumi/--no-lumi', default=False,
+              help="Luminosity modifier on every sample.")
+@click.option('--shared', type=click.FloatRange(0, 1), default=0.5, show_default=True,
+              help="Probability that normsys, histosys and normfactor parameters are shared.")
+@click.option('--null', type=click.FloatRange(0, 1), default=0., show_default=True,
+              help="Fraction of normsys and histosys modifiers without effect.")
+@click.option('--fixed', type=click.IntRange(0), default=0, show_default=True,
+              help="Number of normsys parameters fixed.")
+@click.option('--patches', type=click.IntRange(0), default=0, show_default=True,
+              help="Number of patches of signals in a patchset.")
+@click.option('--patchset', type=click.Path(dir_okay=False), default=None,
+              help="File name of patchset.  [default: HF_FILE_NAME with suffix _patchset]")
+@click.option('--seed', type=int, default=None,
+              help="Seed for random numbers.")
+def generate_cli(hf_file_name, patches, patchset, seed, **kwargs):
+    """
+    Generate a synthetic histfactory json file HF_FILE_NAME of controlled size.
+    """
+    spec = generate_workspace(seed=seed, **kwargs)
+
+    with open(hf_file_name, "w", encoding="utf-8") as hf_file:
+        json.dump(spec, hf_file, indent=4)
+
+    click.echo(f"- Workspace written to {hf_file_name}")
+
+    if patches:
+        patchset = patchset or f"{os.path.splitext(hf_file_name)[0]}_patchset.json"
+        with open(patchset, "w", encoding="utf-8") as patchset_file:
+            json.dump(generate_patchset(spec, patches, seed), patchset_file, indent=4)
+        click.echo(f"- Patchset of {patches} patches written to {patchset}")
+
+
+@click.group(cls=HelpColorsGroup,
+             help_headers_color='yellow',
+             help_options_color='green',
+             context_settings=CONTEXT_SETTINGS,
+             epilog="Check out https://github.com/xhep-lab/stanhf for more details or to report issues")
+@version_option(VERSION,
+                prog_name="stanhf-benchmark",
+                message="%(prog)s version %(version)s",
+                version_color='green')
+def benchmark_cli():
+    """
+    Benchmark synthetic models of several sizes and compare results of two revisions.
+    """
+
+
+@benchmark_cli.command("run", context_settings=CONTEXT_SETTINGS)
+@click.argument('results_file_name', type=click.Path(dir_okay=False))
+@click.option('--size', 'sizes', type=click.Choice(list(SIZES)), multiple=True,
+              help="Size of model to benchmark.  [default: all sizes]")
+@click.option('--stage', 'stages', type=click.Choice(STAGES), multiple=True,
+              help="Stage to benchmark.  [default: all stages]")
+@click.option('--label', type=str, default=None,
+              help="Label of results, e.g., name of revision.")
+@click.option('--points', type=click.IntRange(1), default=1000, show_default=True,
+              help="Number of points at which to evaluate target and gradient.")
+@click.option('--chains', type=click.IntRange(1), default=4, show_default=True,
+              help="Number of chains of HMC.")
+@click.option('--iter-warmup', type=click.IntRange(1), default=200, show_default=True,
+              help="Number of warmup iterations in each chain.")
+@click.option('--iter-sampling', type=click.IntRange(1), default=200, show_default=True,
+              help="Number of sampling iterations in each chain.")
+@click.option('--repeat', type=click.IntRange(1), default=3, show_default=True,
+              help="Number of repeats of conversion.")
+def benchmark_run_cli(results_file_name, sizes, stages, label, points, chains, iter_warmup, iter_sampling, repeat):
+    """
+    Benchmark synthetic models and write json results to RESULTS_FILE_NAME.
+    """
+    stages = stages or STAGES
+
+    if set(stages) - {"convert"}:
+        stan_path = install()
+        click.echo(f"- Stan installed at {stan_path}")
+
+    results = run_benchmarks(sizes or None, label, stages=stages, points=points, chains=chains,
+                             iter_warmup=iter_warmup, iter_sampling=iter_sampling, repeat=repeat)
+
+    for size, result in results["results"].items():
+        click.echo(f"- Benchmarked {size} model with {result['par_size'][0]} parameters")
+
+    write_results(results_file_name, results)
+    click.echo(f"- Results written to {results_file_name}")
+
+
+@benchmark_cli.command("compare", context_settings=CONTEXT_SETTINGS)
+@click.argument('base_file_name', type=click.Path(exists=True, dir_okay=False))
+@click.argument('head_file_name', type=click.Path(exists=True, dir_okay=False))
+@click.option('--threshold', type=click.FloatRange(0), default=THRESHOLD, show_default=True,
+              help="Fractional change beyond which a worse measurement is a regression.")
+@click.pass_context
+def benchmark_compare_cli(ctx, base_file_name, head_file_name, threshold):
+    """
+    Compare results in HEAD_FILE_NAME to those in BASE_FILE_NAME, failing if any regressed.
+    """
+    comparison = compare_results(read_results(base_file_name), read_results(head_file_name), threshold)
+    click.echo(format_comparison(comparison))
+
+    regressions = sum(c["regression"] for c in comparison)
+    click.echo(f"- {regressions} of {len(comparison)} measurements regressed by more than {threshold:.0%}")
+    ctx.exit(1 if regressions else 0)
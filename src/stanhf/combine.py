@@ -0,0 +1,125 @@
+"""
+Combine workspaces
+==================
+
+Workspaces are combined into one model. Parameters with the same name after
+applying a correlation map are shared, and identical channels are kept once.
+The POI of the combined model is that of the first workspace.
+"""
+
+import copy
+import json
+import warnings
+from functools import reduce
+
+import pyhf
+
+
+MEASUREMENT = "combined"
+PER_CHANNEL = ["staterror", "shapesys"]
+
+
+def read_workspace(hf_file_name):
+    """
+    @returns Workspace read from disk
+    """
+    with open(hf_file_name, encoding="utf-8") as hf_file:
+        return pyhf.Workspace(json.load(hf_file))
+
+
+def is_same_channel(a, b, name):
+    """
+    @returns Whether a channel is identical in two workspaces
+    """
+    def find(workspace, key):
+        return next(c for c in workspace[key] if c["name"] == name)
+
+    return find(a, "channels") == find(b, "channels") and find(a, "observations") == find(b, "observations")
+
+
+def per_channel_modifiers(workspace, name):
+    """
+    @returns Names of modifiers scoped to a channel, e.g., staterror, in a channel
+    """
+    channel = next(c for c in workspace["channels"] if c["name"] == name)
+    return {m["name"] for s in channel["samples"] for m in s["modifiers"] if m["type"] in PER_CHANNEL}
+
+
+def prepare(workspace, combined, correlations=None, measurement=None, number=0):
+    """
+    Prepare workspace to be combined
+
+    @param workspace Workspace to be combined
+    @param combined Workspace combined so far, or None
+    @param correlations Dictionary of names of parameters and names in combined model
+    @param measurement Name of measurement, by default the first one
+    @param number Number of workspace, used to rename channels that clash
+    @returns Workspace with single measurement, renamed parameters and without duplicate channels,
+             or None if every channel is a duplicate
+    """
+    if measurement is None:
+        measurement = workspace.measurement_names[0]
+
+    prune_measurements = [m for m in workspace.measurement_names if m != measurement]
+    prune_channels = []
+    rename_channels = {}
+    rename_modifiers = {}
+
+    if correlations:
+        workspace = workspace.rename(modifiers=correlations)
+
+    for name in workspace.channels if combined is not None else []:
+        if name not in combined.channels:
+            continue
+        if is_same_channel(workspace, combined, name):
+            prune_channels.append(name)
+        else:
+            rename_channels[name] = f"{name}_{number}"
+            rename_modifiers.update({m: f"{m}_{number}" for m in per_channel_modifiers(workspace, name)})
+            warnings.warn(f"channel {name} differs between workspaces; renamed to {rename_channels[name]}")
+
+    if len(prune_channels) == len(workspace.channels):
+        warnings.warn(f"every channel in workspace {number} is a duplicate; ignoring it")
+        return None
+
+    if prune_measurements or prune_channels:
+        workspace = workspace.prune(measurements=prune_measurements or None, channels=prune_channels or None)
+
+    workspace = workspace.rename(modifiers=rename_modifiers or None,
+                                 channels=rename_channels or None,
+                                 measurements={measurement: MEASUREMENT})
+
+    if combined is None:
+        return workspace
+
+    spec = copy.deepcopy(dict(workspace))
+    spec["measurements"][0]["config"]["poi"] = combined.get_measurement(MEASUREMENT)["config"]["poi"]
+    return pyhf.Workspace(spec)
+
+
+def combine_workspaces(workspaces, correlations=None, measurements=None):
+    """
+    Combine workspaces into one
+
+    @param workspaces Workspaces to be combined
+    @param correlations Dictionary of names of parameters and names in combined model for each workspace
+    @param measurements Name of measurement for each workspace, by default the first ones
+    @returns Combined workspace
+    """
+    if correlations is None:
+        correlations = [None] * len(workspaces)
+
+    if measurements is None:
+        measurements = [None] * len(workspaces)
+
+    if not len(workspaces) == len(correlations) == len(measurements):
+        raise ValueError("require correlations and measurements for each workspace")
+
+    def join(combined, item):
+        number, (workspace, correlation, measurement) = item
+        prepared = prepare(workspace, combined, correlation, measurement, number)
+        if combined is None or prepared is None:
+            return prepared or combined
+        return pyhf.Workspace.combine(combined, prepared, join="outer")
+
+    return reduce(join, enumerate(zip(workspaces, correlations, measurements)), None)
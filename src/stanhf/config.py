@@ -12,95 +12,66 @@ from .stanstr import join, add_to_target, read_par_bound, read_par_init
 from .metadata import add_metadata_comment, add_metadata_entry
 
 
+POI_NAME = "_poi"
+
+
 class Measured(Stan):
     """
     Normal measurement of a modifier parameter
     """
 
-    def __init__(self, config):
+    def __init__(self, par_name, config, optional=False):
         """
-        @param config hf configuration data
+        @param par_name Name of parameter
+        @param config hf configuration data for parameter in selected measurement
+        @param optional Whether measurement may be switched off by data
         """
-        self.par_name = config["name"]
+        self.par_name = par_name
         self.normal_data_name = join("normal", self.par_name)
-        self.normal_data = tuple(config[k][0] for k in ["auxdata", "sigmas"])
+        self.measure_flag = join("measure", self.par_name)
+        self.optional = optional
+        self.measured = {"auxdata", "sigmas"} <= config.keys()
+        self.normal_data = tuple(config[k][0] for k in ["auxdata", "sigmas"]) if self.measured else (0., 1.)
 
     @add_metadata_comment
     def stan_data(self):
         """
         @returns Declare data for normal log-likelihood
         """
-        return f"tuple(real, real) {self.normal_data_name};"
+        if not self.optional:
+            return f"tuple(real, real) {self.normal_data_name};"
+        return f"""
+                int<lower=0, upper=1> {self.measure_flag};
+                tuple(real, real) {self.normal_data_name};
+                """
 
     @add_metadata_comment
     def stan_model(self):
         """
         @returns Normal log-likelihood for modifier
         """
-        return add_to_target("normal", self.par_name,
-                             f"{self.normal_data_name}.1", f"{self.normal_data_name}.2")
+        target = add_to_target("normal", self.par_name,
+                               f"{self.normal_data_name}.1", f"{self.normal_data_name}.2")
+        if not self.optional:
+            return target
+        return f"if ({self.measure_flag}) {target}"
 
     @add_metadata_entry
     def stan_data_card(self):
         """
         @returns Data for normal log-likelihood
         """
-        return {self.normal_data_name: self.normal_data}
+        if not self.optional:
+            return {self.normal_data_name: self.normal_data}
+        return {self.normal_data_name: self.normal_data, self.measure_flag: self.measured}
 
 
-class FreeParameter(Stan):
+class Parameter(Stan):
     """
-    Declare a parameter that is sampled
+    Declare a parameter that is sampled or fixed by data
     """
 
-    def __init__(self, par_name, par_size, par_init, par_bound):
-        """
-        @param par_name Name of parameter
-        """
-        self.par_name = par_name
-        self.par_size = par_size
-        self.par_init = par_init
-        self.par_bound = par_bound
-        self.par_bound_name = join("lu", self.par_name)
-
-    @add_metadata_comment
-    def stan_pars(self):
-        """
-        @returns Declare parameter
-        """
-        bound = f"<lower={self.par_bound_name}.1, upper={self.par_bound_name}.2>"
-        if self.par_size == 0:
-            return f"real{bound} {self.par_name};"
-        return f"vector{bound}[{self.par_size}] {self.par_name};"
-
-    @add_metadata_entry
-    def stan_init_card(self):
-        """
-        @returns Initialization or default for parameter
-        """
-        return {self.par_name: self.par_init}
-
-    @add_metadata_comment
-    def stan_data(self):
-        """
-        @returns Declare lower and upper bound for parameter
-        """
-        if self.par_size == 0:
-            return f"tuple(real, real) {self.par_bound_name};"
-        return f"tuple(vector[{self.par_size}], vector[{self.par_size}]) {self.par_bound_name};"
-
-    @add_metadata_entry
-    def stan_data_card(self):
-        """
-        @returns Data for bounds for parameter
-        """
-        return {self.par_bound_name: self.par_bound}
-
-
-class POI(Stan):
-    """
-    Declare a parameter that is the parameter of interest
-    """
+    fixed = False
 
     def __init__(self, par_name, par_size, par_init, par_bound):
         """
@@ -108,10 +79,6 @@ class POI(Stan):
         """
         self.par_name = par_name
         self.par_size = par_size
-
-        if self.par_size != 0:
-            raise RuntimeError("POI must be a scalar")
-
         self.par_init = par_init
         self.par_bound = par_bound
         self.par_bound_name = join("lu", self.par_name)
@@ -119,75 +86,93 @@ class POI(Stan):
         self.fixed_par_name = join("fixed", self.par_name)
         self.fix_flag = join("fix", self.par_name)
 
+    @property
+    def par_type(self):
+        """
+        @returns Stan type of parameter
+        """
+        if self.par_size == 0:
+            return "real"
+        return f"vector[{self.par_size}]"
+
     @add_metadata_comment
     def stan_pars(self):
         """
         @returns Declare parameter
         """
         bound = f"<lower={self.par_bound_name}.1, upper={self.par_bound_name}.2>"
-        return f"array[1 - {self.fix_flag}] real{bound} {self.free_par_name};"
+        if self.par_size == 0:
+            return f"array[1 - {self.fix_flag}] real{bound} {self.free_par_name};"
+        return f"array[1 - {self.fix_flag}] vector{bound}[{self.par_size}] {self.free_par_name};"
 
     @add_metadata_comment
     def stan_trans_pars(self):
         """
         @returns Declare parameter
         """
-        return f"real {self.par_name} = {self.fix_flag} ? {self.fixed_par_name} : {self.free_par_name}[1];"
+        return f"{self.par_type} {self.par_name} = {self.fix_flag} ? {self.fixed_par_name} : {self.free_par_name}[1];"
 
     @add_metadata_entry
     def stan_init_card(self):
         """
         @returns Initialization or default for parameter
         """
-        return {self.free_par_name: [self.par_init]}
+        return {self.free_par_name: [] if self.fixed else [self.par_init]}
 
     @add_metadata_comment
     def stan_data(self):
         """
-        @returns Declare lower and upper bound for parameter
+        @returns Declare whether parameter is fixed, its fixed value and its lower and upper bound
         """
         return f"""
                 int<lower=0, upper=1> {self.fix_flag};
-                real {self.fixed_par_name};
-                tuple(real, real) {self.par_bound_name};
+                {self.par_type} {self.fixed_par_name};
+                tuple({self.par_type}, {self.par_type}) {self.par_bound_name};
                 """
 
     @add_metadata_entry
     def stan_data_card(self):
         """
-        @returns Data for bounds for parameter
+        @returns Data for whether parameter is fixed, its fixed value and its bounds
         """
-        return {self.par_bound_name: self.par_bound, self.fix_flag: False, self.fixed_par_name: self.par_init}
+        return {self.par_bound_name: self.par_bound, self.fix_flag: self.fixed, self.fixed_par_name: self.par_init}
+
 
+class FreeParameter(Parameter):
+    """
+    Declare a parameter that is sampled
+    """
 
-class FixedParameter(Stan):
+
+class FixedParameter(Parameter):
     """
     Declare a fixed parameter
     """
 
-    def __init__(self, par_name, par_size, par_init):
+    fixed = True
+
+
+class POI(Parameter):
+    """
+    Declare a parameter that is the parameter of interest
+    """
+
+    def __init__(self, par_name, par_size, par_init, par_bound):
         """
         @param par_name Name of parameter
         """
-        self.par_name = par_name
-        self.par_size = par_size
-        self.par_init = par_init
+        if par_size != 0:
+            raise RuntimeError("POI must be a scalar")
 
-    @add_metadata_comment
-    def stan_data(self):
-        """
-        @returns Declare lower and upper bound for parameter
-        """
-        if self.par_size == 0:
-            return f"real {self.par_name};"
-        return f"vector[{self.par_size}] {self.par_name};"
+        super().__init__(par_name, par_size, par_init, par_bound)
 
-    @add_metadata_entry
     def stan_data_card(self):
         """
-        @returns Fixed value for parameter
+        @returns Data for whether parameter is fixed, its fixed value and its bounds, and name of POI
         """
-        return {self.par_name: self.par_init}
+        data = super().stan_data_card()
+        data[POI_NAME] = self.par_name
+        return data
 
 
 class NullParameter(Stan):
@@ -210,12 +195,24 @@ def is_measured(config, par_name):
     return {"auxdata", "sigmas"} <= config.get(par_name, {}).keys()
 
 
-def find_measureds(config, modifiers):
+def find_measureds(config, modifiers, configs=None):
     """
-    @returns Measurement objects
+    @param config Configuration of selected measurement
+    @param configs Configurations of all measurements, by default only the selected one
+    @returns Measurement objects for parameters measured in any measurement
     """
-    unique = {m.par_name for m in modifiers if not m.is_null}
-    return [Measured(config.get(p, {})) for p in unique if is_measured(config, p)]
+    if configs is None:
+        configs = [config]
+
+    unique = dict.fromkeys(m.par_name for m in modifiers if not m.is_null)
+    measureds = []
+
+    for p in unique:
+        measured = [is_measured(c, p) for c in configs]
+        if any(measured):
+            measureds.append(Measured(p, config.get(p, {}), optional=not all(measured)))
+
+    return measureds
 
 
 def find_par_prop(modifiers, prop):
@@ -245,7 +242,7 @@ def find_param(poi, par_name, par_config, modifiers):
         return NullParameter(par_name, par_size)
 
     if par_config.get("fixed"):
-        return FixedParameter(par_name, par_size, par_init)
+        return FixedParameter(par_name, par_size, par_init, par_bound)
 
     if par_name == poi:
         return POI(par_name, par_size, par_init, par_bound)
@@ -257,6 +254,7 @@ def find_params(poi, config, modifiers):
     """
     @returns Parameters from data in configuration and hf model
     """
-    groups = {m.par_name: [
-        l for l in modifiers if l.par_name == m.par_name] for m in modifiers}
+    groups = {}
+    for m in modifiers:
+        groups.setdefault(m.par_name, []).append(m)
     return [find_param(poi, p, config.get(p, {}), m) for p, m in groups.items()]
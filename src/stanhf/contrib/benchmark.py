@@ -0,0 +1,225 @@
+"""
+Benchmarks of stanhf models
+===========================
+
+Synthetic models of several sizes are converted, built, evaluated and
+sampled, recording the time and memory taken by conversion, the time taken to
+compile, evaluations of the target and its gradient per second and effective
+samples per second in short runs of HMC. Results are stored as json, such that
+results for two revisions may be compared to flag regressions.
+"""
+
+import importlib.metadata
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+from cmdstanpy import CmdStanModel
+
+from ..convert import Convert
+from ..pars import get_stan_par_names
+from ..run import log_prob_throughput, perturb_param_file, write_draws_file
+from .generate import generate_workspace
+
+
+SIZES = {
+    "small": {"channels": 2, "bins": 5, "samples": 2, "normsys": 2, "histosys": 1, "staterror": True, "lumi": True},
+    "medium": {"channels": 10, "bins": 10, "samples": 4, "normsys": 4, "histosys": 2, "shapesys": 1,
+               "staterror": True, "normfactor": 1, "lumi": True, "null": 0.1, "fixed": 1},
+    "large": {"channels": 40, "bins": 20, "samples": 6, "normsys": 6, "histosys": 3, "shapesys": 1,
+              "staterror": True, "shapefactor": 1, "normfactor": 1, "lumi": True, "null": 0.1, "fixed": 2},
+}
+STAGES = ["convert", "compile", "log_prob", "sample"]
+METRICS = ["convert_time", "convert_peak_memory", "compile_time", "log_prob_per_second", "sample_time",
+           "ess_per_second"]
+HIGHER_IS_BETTER = ["log_prob_per_second", "ess_per_second"]
+THRESHOLD = 0.2
+
+
+def revision():
+    """
+    @returns Git revision of stanhf source, or None if not a git checkout
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(__file__), capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def min_ess(fit):
+    """
+    @returns Smallest bulk effective sample size of any parameter
+    """
+    summary = fit.summary()
+    column = "ESS_bulk" if "ESS_bulk" in summary else "N_Eff"
+    return float(summary[column][[not n.endswith("__") for n in summary.index]].min())
+
+
+def benchmark_convert(spec, repeat=3):
+    """
+    Time conversion of a model to Stan program, data and initial values
+
+    @returns Median time and peak memory of Python allocations
+    """
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        Convert.from_dict(spec).to_memory()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        Convert.from_dict(spec).to_memory()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"convert_time": float(np.median(times)), "convert_peak_memory": peak}
+
+
+def benchmark_model(spec, stages=None, points=1000, chains=4, iter_warmup=200, iter_sampling=200, repeat=3,
+                    directory=None, seed=1):
+    """
+    Benchmark stages of converting, building, evaluating and sampling a model
+
+    @param spec Specification of workspace
+    @param stages Stages to benchmark, by default all of them
+    @param points Number of points at which to evaluate target and gradient
+    @param chains Number of chains of HMC
+    @param iter_warmup Number of warmup iterations in each chain
+    @param iter_sampling Number of sampling iterations in each chain
+    @param repeat Number of repeats of conversion
+    @param directory Directory in which to build, by default a temporary one
+    @param seed Seed for random numbers
+    @returns Measurements for each stage
+    """
+    if stages is None:
+        stages = STAGES
+
+    unknown = set(stages) - set(STAGES)
+
+    if unknown:
+        raise ValueError(f"unknown stages {', '.join(sorted(unknown))}; choose from {', '.join(STAGES)}")
+
+    convert = Convert.from_dict(spec)
+    result = {"par_size": convert.par_size, "model_size": convert.model_size}
+
+    if "convert" in stages:
+        result.update(benchmark_convert(spec, repeat))
+
+    if not {"compile", "log_prob", "sample"} & set(stages):
+        return result
+
+    if directory is None:
+        directory = tempfile.mkdtemp()
+
+    start = time.perf_counter()
+    exe_file_name = convert.build(directory=directory)
+    # building is needed by later stages but timed only when asked for
+    result["compile_time"] = time.perf_counter() - start if "compile" in stages else None
+
+    stan_file_name = f"{os.path.splitext(exe_file_name)[0]}.stan"
+    data_file_name = convert.write_stan_data_file(os.path.join(directory, "data.json"), metadata=False)
+    init_file_name = convert.write_stan_init_file(os.path.join(directory, "init.json"), metadata=False)
+
+    if "log_prob" in stages:
+        rng = np.random.default_rng(seed)
+        draws = [perturb_param_file(init_file_name, rng) for _ in range(points)]
+        draws_file_name = write_draws_file(os.path.join(directory, "draws.csv"), draws,
+                                           get_stan_par_names(stan_file_name))
+        result["log_prob_per_second"] = log_prob_throughput(exe_file_name, data_file_name, draws_file_name)
+
+    if "sample" in stages:
+        model = CmdStanModel(exe_file=exe_file_name)
+        start = time.perf_counter()
+        fit = model.sample(data=data_file_name, inits=init_file_name, chains=chains, iter_warmup=iter_warmup,
+                           iter_sampling=iter_sampling, seed=seed, output_dir=directory, show_progress=False)
+        sample_time = time.perf_counter() - start
+        result["sample_time"] = sample_time
+        result["ess_per_second"] = min_ess(fit) / sample_time
+
+    return result
+
+
+def run_benchmarks(sizes=None, label=None, **kwargs):
+    """
+    Benchmark synthetic models of several sizes
+
+    @param sizes Names of sizes, by default all of them
+    @param label Label of results, e.g., name of revision
+    @param kwargs Options for benchmarking each model
+    @returns Results for each size and metadata about environment
+    """
+    if sizes is None:
+        sizes = list(SIZES)
+
+    metadata = {"label": label,
+                "version": importlib.metadata.version("stanhf"),
+                "revision": revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "date": datetime.now(timezone.utc).isoformat()}
+
+    results = {s: benchmark_model(generate_workspace(seed=0, **SIZES[s]), **kwargs) for s in sizes}
+    return {"metadata": metadata, "results": results}
+
+
+def write_results(file_name, results):
+    """
+    Write results of benchmarks
+    """
+    with open(file_name, "w", encoding="utf-8") as results_file:
+        json.dump(results, results_file, indent=4)
+
+
+def read_results(file_name):
+    """
+    @returns Results of benchmarks
+    """
+    with open(file_name, encoding="utf-8") as results_file:
+        return json.load(results_file)
+
+
+def compare_results(base, head, threshold=THRESHOLD):
+    """
+    Compare performance measurements common to two sets of results
+
+    @param base Results of reference revision
+    @param head Results of revision under test
+    @param threshold Fractional change beyond which a worse measurement is a regression
+    @returns Comparison of each measurement, i.e., values, ratio and whether a regression
+    """
+    comparison = []
+
+    for size, measurements in head["results"].items():
+        reference = base["results"].get(size, {})
+        for metric in METRICS:
+            if not measurements.get(metric) or not reference.get(metric):
+                continue
+            value = measurements[metric]
+            ratio = value / reference[metric]
+            worse = 1. / ratio if metric in HIGHER_IS_BETTER else ratio
+            comparison.append({"size": size, "metric": metric, "base": reference[metric], "head": value,
+                               "ratio": ratio, "regression": worse > 1. + threshold})
+
+    return comparison
+
+
+def format_comparison(comparison):
+    """
+    @returns Table of measurements of two revisions, flagging regressions
+    """
+    header = ["size", "metric", "base", "head", "ratio", ""]
+    rows = [[c["size"], c["metric"], f"{c['base']:.4g}", f"{c['head']:.4g}", f"{c['ratio']:.2f}",
+             "REGRESSION" if c["regression"] else ""] for c in comparison]
+    widths = [max(len(str(c)) for c in column) for column in zip(header, *rows)]
+    return "\n".join("  ".join(str(c).ljust(w) for c, w in zip(row, widths)).rstrip()
+                     for row in [header] + rows)
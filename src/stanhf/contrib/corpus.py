@@ -0,0 +1,197 @@
+"""
+Corpus of histfactory models
+============================
+
+A corpus is a local directory of workspaces and patchsets, e.g., from HEPData,
+with a manifest of their content hashes. Every model in a corpus is converted,
+built and validated concurrently from local files only, such that it may be run
+without network access, and timings and sizes reveal scaling regressions.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ..batch import process_model
+from ..cache import hash_file
+
+
+MANIFEST = "manifest.json"
+KINDS = ["workspace", "patchset"]
+STAGES = ["convert", "emit", "validate_par_names", "build", "validate_target"]
+
+
+def download(doi, directory):
+    """
+    Download a HEPData record; requires network access
+
+    @returns Directory of record
+    """
+    import pyhf.contrib.utils  # pylint: disable=import-outside-toplevel
+    pyhf.contrib.utils.download(f"https://doi.org/{doi}", directory)
+    return directory
+
+
+class Corpus:
+    """
+    Local directory of workspaces and patchsets with a manifest of content hashes
+    """
+
+    def __init__(self, directory):
+        """
+        @param directory Directory of corpus
+        """
+        self.directory = directory
+        self.manifest_file_name = os.path.join(directory, MANIFEST)
+        self.entries = {}
+
+        if os.path.isfile(self.manifest_file_name):
+            with open(self.manifest_file_name, encoding="utf-8") as manifest_file:
+                self.entries = json.load(manifest_file)["entries"]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def path(self, name, kind="workspace"):
+        """
+        @returns File name of workspace or patchset of an entry, or None
+        """
+        record = self.entries[name]["files"].get(kind)
+        return None if record is None else os.path.join(self.directory, record["file"])
+
+    def write(self):
+        """
+        Write manifest of corpus
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.manifest_file_name, "w", encoding="utf-8") as manifest_file:
+            json.dump({"entries": self.entries}, manifest_file, indent=4, sort_keys=True)
+
+    def add(self, name, workspace, patchset=None, patch=None, doi=None):
+        """
+        Copy a workspace and patchset into corpus and record their hashes
+
+        @param name Name of entry
+        @param workspace File name of workspace
+        @param patchset File name of patchset, or None
+        @param patch Number of patch in patchset to apply, or None
+        @param doi DOI of HEPData record, or None
+        @returns Entry in manifest
+        """
+        if patch is not None and patchset is None:
+            raise ValueError("require patchset to apply a patch")
+
+        entry = {"doi": doi, "patch": patch, "files": {}}
+
+        for kind, src in zip(KINDS, [workspace, patchset]):
+            if src is None:
+                continue
+            file_name = os.path.join(name, f"{kind}.json")
+            dst = os.path.join(self.directory, file_name)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if os.path.abspath(src) != os.path.abspath(dst):
+                shutil.copyfile(src, dst)
+            entry["files"][kind] = {"file": file_name, "sha256": hash_file(dst)}
+
+        self.entries[name] = entry
+        self.write()
+        return entry
+
+    def fetch(self, name, doi, workspace, patchset=None, patch=None):
+        """
+        Download a HEPData record and add a workspace and patchset from it; requires network access
+
+        @param workspace File name of workspace in record
+        @param patchset File name of patchset in record, or None
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            record = download(doi, os.path.join(tmp, "record"))
+            return self.add(name, os.path.join(record, workspace),
+                            None if patchset is None else os.path.join(record, patchset), patch, doi)
+
+    def verify(self, name):
+        """
+        @returns Problems with files of an entry, i.e., missing or changed files
+        """
+        problems = []
+
+        for kind, record in self.entries[name]["files"].items():
+            file_name = os.path.join(self.directory, record["file"])
+            if not os.path.isfile(file_name):
+                problems.append(f"{kind} {record['file']} is missing")
+            elif hash_file(file_name) != record["sha256"]:
+                problems.append(f"{kind} {record['file']} does not match its hash")
+
+        return problems
+
+
+def process_entry(corpus, name, **kwargs):
+    """
+    Verify, convert, build and validate one entry in a corpus
+
+    @returns Report of status, timing of each stage, sizes and validation
+    """
+    entry = corpus.entries[name]
+    workspace = corpus.path(name)
+    problems = corpus.verify(name)
+
+    if problems:
+        return {"name": name, "hf": workspace, "status": "failed", "error": "; ".join(problems),
+                "stage": "verify", "time": {}, "validation": {"par_names": None, "target": None}}
+
+    patch = None if entry["patch"] is None else (corpus.path(name, "patchset"), entry["patch"])
+    report = process_model(workspace, patch=patch, **kwargs)
+    report.update(name=name, doi=entry["doi"], bytes=os.path.getsize(workspace))
+    return report
+
+
+def run_corpus(corpus, names=None, workers=1, **kwargs):
+    """
+    Verify, convert, build and validate entries in a corpus on a process pool
+
+    @param corpus Corpus
+    @param names Names of entries, by default all of them
+    @param workers Number of processes
+    @param kwargs Options for processing each model
+    @returns Report for each entry, as they complete
+    """
+    if names is None:
+        names = list(corpus.entries)
+
+    unknown = set(names) - set(corpus.entries)
+
+    if unknown:
+        raise ValueError(f"no entries {', '.join(sorted(unknown))} in corpus")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_entry, corpus, n, **kwargs): n for n in names}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                # e.g., worker killed by a crash in Stan or by running out of memory
+                name = futures[future]
+                yield {"name": name, "hf": corpus.path(name), "status": "failed",
+                       "error": f"{type(err).__name__}: {err}", "stage": "worker", "time": {},
+                       "validation": {"par_names": None, "target": None}}
+
+
+def format_table(reports):
+    """
+    @returns Table of status, sizes and timing of each stage for each entry
+    """
+    header = ["name", "status", "MB", "channels", "samples", "modifiers", "null", "pars"] + STAGES + ["total"]
+    rows = []
+
+    for r in sorted(reports, key=lambda r: r["name"]):
+        sizes = r.get("model_size", [""] * 4)
+        pars = r.get("par_size", [""])[0]
+        times = [f"{r['time'][s]:.2f}" if s in r["time"] else "" for s in STAGES]
+        rows.append([r["name"], r["status"], f"{r.get('bytes', 0) / 2**20:.1f}", *sizes, pars,
+                     *times, f"{sum(r['time'].values()):.2f}"])
+
+    widths = [max(len(str(c)) for c in column) for column in zip(header, *rows)]
+    return "\n".join("  ".join(str(c).ljust(w) for c, w in zip(row, widths)).rstrip()
+                     for row in [header] + rows)
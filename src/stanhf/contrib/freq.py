@@ -12,6 +12,8 @@ import numpy as np
 import pyhf
 import cmdstanpy
 
+from ..config import POI_NAME
+
 
 def run(pdf, data, bounds, inits, fixed_vals):
     """
@@ -122,11 +124,10 @@ class MockPyhfConfig:
         """
         @returns Name of POI from Stan model
         """
-        for k in self.data:
-            if k.startswith("fix_"):
-                return k[len("fix_"):]
-
-        raise RuntimeError("Could not find a POI; did you declare one?")
+        try:
+            return self.data[POI_NAME]
+        except KeyError as error:
+            raise RuntimeError("Could not find a POI; did you declare one?") from error
 
 
 class MockPyhfModel:
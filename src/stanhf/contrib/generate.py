@@ -0,0 +1,159 @@
+"""
+Synthetic histfactory models
+============================
+
+Workspaces and patchsets of controlled size are generated from a seed, such
+that the cost of converting, compiling and sampling may be studied as a
+function of the number of channels, bins, samples and modifiers.
+
+Each channel holds background samples and a signal sample scaled by the POI.
+Parameters of normsys, histosys and normfactor modifiers are shared across
+samples with a given probability, a fraction of normsys and histosys
+modifiers have no effect and some normsys parameters are fixed.
+"""
+
+import numpy as np
+import pyhf
+
+
+POI = "mu"
+MEASUREMENT = "Measurement"
+SIGNAL = "signal"
+
+
+def choose_name(rng, names, taken, prefix, shared):
+    """
+    @param names Names of parameters so far, to which a new name is added
+    @param taken Names already used by a sample, which are not reused
+    @param shared Probability of reusing a name
+    @returns Name of parameter, reused or new
+    """
+    free = [n for n in names if n not in taken]
+    if free and rng.uniform() < shared:
+        name = free[rng.integers(len(free))]
+    else:
+        name = f"{prefix}_{len(names)}"
+        names.append(name)
+    taken.add(name)
+    return name
+
+
+def generate_sample(rng, name, bins, pools, channel, normsys=0, histosys=0, shapesys=0, staterror=False,
+                    normfactor=0, lumi=False, shared=0.5, null=0.):
+    """
+    @returns Background sample with modifiers
+    """
+    nominal = rng.uniform(1., 100., bins)
+    modifiers = []
+    taken = set()
+
+    for _ in range(normsys):
+        is_null = rng.uniform() < null
+        lo, hi = (1., 1.) if is_null else (1. - rng.uniform(0.01, 0.3), 1. + rng.uniform(0.01, 0.3))
+        modifiers.append({"name": choose_name(rng, pools["normsys"], taken, "normsys", shared),
+                          "type": "normsys", "data": {"lo": lo, "hi": hi}})
+
+    for _ in range(histosys):
+        is_null = rng.uniform() < null
+        shift = np.zeros(bins) if is_null else nominal * rng.uniform(0.01, 0.3, bins)
+        modifiers.append({"name": choose_name(rng, pools["histosys"], taken, "histosys", shared),
+                          "type": "histosys", "data": {"lo_data": (nominal - shift).tolist(),
+                                                       "hi_data": (nominal + shift).tolist()}})
+
+    for i in range(shapesys):
+        modifiers.append({"name": f"shapesys_{channel}_{name}_{i}", "type": "shapesys",
+                          "data": (nominal * rng.uniform(0.01, 0.2, bins)).tolist()})
+
+    if staterror:
+        modifiers.append({"name": f"staterror_{channel}", "type": "staterror",
+                          "data": np.sqrt(nominal).tolist()})
+
+    for _ in range(normfactor):
+        modifiers.append({"name": choose_name(rng, pools["normfactor"], taken, "normfactor", shared),
+                          "type": "normfactor", "data": None})
+
+    if lumi:
+        modifiers.append({"name": "lumi", "type": "lumi", "data": None})
+
+    return {"name": name, "data": nominal.tolist(), "modifiers": modifiers}
+
+
+def generate_workspace(channels=1, bins=1, samples=1, normsys=0, histosys=0, shapesys=0, staterror=False,
+                       shapefactor=0, normfactor=0, lumi=False, shared=0.5, null=0., fixed=0, seed=None):
+    """
+    Generate a histfactory workspace
+
+    @param channels Number of channels
+    @param bins Number of bins in each channel
+    @param samples Number of background samples in each channel
+    @param normsys Number of normsys modifiers on each background sample
+    @param histosys Number of histosys modifiers on each background sample
+    @param shapesys Number of shapesys modifiers on each background sample
+    @param staterror Whether background samples have statistical errors
+    @param shapefactor Number of shapefactor modifiers on backgrounds in each channel
+    @param normfactor Number of normfactor modifiers, besides the POI, on each background sample
+    @param lumi Whether every sample has a luminosity modifier
+    @param shared Probability that normsys, histosys and normfactor parameters are shared
+    @param null Fraction of normsys and histosys modifiers without effect
+    @param fixed Number of normsys parameters fixed
+    @param seed Seed for random numbers
+    @returns Specification of workspace
+    """
+    rng = np.random.default_rng(seed)
+    pools = {"normsys": [], "histosys": [], "normfactor": []}
+    spec = {"channels": [], "observations": [], "version": "1.0.0"}
+
+    for c in range(channels):
+        channel = f"channel_{c}"
+        backgrounds = [generate_sample(rng, f"background_{s}", bins, pools, channel, normsys, histosys, shapesys,
+                                       staterror, normfactor, lumi, shared, null) for s in range(samples)]
+
+        for i in range(shapefactor):
+            for b in backgrounds:
+                b["modifiers"].append({"name": f"shapefactor_{channel}_{i}", "type": "shapefactor", "data": None})
+
+        signal = {"name": SIGNAL, "data": rng.uniform(0., 10., bins).tolist(),
+                  "modifiers": [{"name": POI, "type": "normfactor", "data": None}]}
+
+        if lumi:
+            signal["modifiers"].append({"name": "lumi", "type": "lumi", "data": None})
+
+        expected = np.sum([b["data"] for b in backgrounds], axis=0) if backgrounds else np.zeros(bins)
+        spec["channels"].append({"name": channel, "samples": backgrounds + [signal]})
+        spec["observations"].append({"name": channel, "data": rng.poisson(expected).astype(float).tolist()})
+
+    parameters = [{"name": POI, "bounds": [[0., 10.]], "inits": [1.]}]
+
+    if lumi:
+        parameters.append({"name": "lumi", "auxdata": [1.], "sigmas": [0.02], "bounds": [[0.5, 1.5]], "inits": [1.]})
+
+    parameters += [{"name": p, "fixed": True} for p in pools["normsys"][:fixed]]
+
+    spec["measurements"] = [{"name": MEASUREMENT, "config": {"poi": POI, "parameters": parameters}}]
+    return spec
+
+
+def generate_patchset(spec, patches=1, seed=None):
+    """
+    Generate a patchset of signals for a workspace
+
+    @param spec Specification of workspace
+    @param patches Number of patches
+    @param seed Seed for random numbers
+    @returns Specification of patchset
+    """
+    rng = np.random.default_rng(seed)
+    entries = []
+
+    for n in range(patches):
+        operations = []
+        for c, channel in enumerate(spec["channels"]):
+            s = next(i for i, sample in enumerate(channel["samples"]) if sample["name"] == SIGNAL)
+            bins = len(channel["samples"][s]["data"])
+            operations.append({"op": "replace", "path": f"/channels/{c}/samples/{s}/data",
+                               "value": rng.uniform(0., 10., bins).tolist()})
+        entries.append({"metadata": {"name": f"signal_{n}", "values": [n]}, "patch": operations})
+
+    metadata = {"description": "synthetic signals", "digests": {"sha256": pyhf.utils.digest(spec)},
+                "labels": ["signal"], "references": {"hepdata": "ins0000000"}, "analysis_id": "synthetic"}
+    return {"metadata": metadata, "patches": entries, "version": "1.0.0"}
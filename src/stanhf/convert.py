@@ -3,54 +3,152 @@ Convert a histfactory json model to Stan!
 =========================================
 """
 
+import asyncio
+import copy
 import importlib.metadata
 import json
 import os
+import tempfile
 import warnings
 from subprocess import CalledProcessError
 from functools import cached_property
 
 import numpy as np
 import pyhf
-from cmdstanpy import format_stan_file, write_stan_json, compile_stan_file
+from cmdstanpy import format_stan_file
 
 from .channel import Channel
 from .config import find_measureds, find_params, FreeParameter, FixedParameter, NullParameter, POI
 from .modifier import find_constraints, find_staterror, check_per_channel
-from .stanstr import block, flatten, format_json_file, read_observed, remove_prefix
+from .stanstr import block, flatten, normalize_stan, read_observed, remove_prefix, to_stan_json, write_json_file
 from .pars import get_stan_par_names, get_pyhf_par_data
-from .metadata import merge_metadata
-from .run import perturb_param_file, run_pyhf_model, run_stanhf_model
+from .metadata import merge_entries, METADATA
+from .run import perturb_param_file, run_pyhf_model_batch, run_stanhf_model_batch, summarize_discrepancies
+from .build import build_program, compile_cached, profile_options, write_program
+from .aio import abuild_stan_file
+from .evaluate import NumpyModel
+from .bridge import compile_library, run_stanhf_model_in_process, InProcessModel
+from .emit import emit_channels, merge_channels
+from .patchset import apply_patch, PatchSetIndex
+from .subset import prune
+from .combine import combine_workspaces, read_workspace
+from .cache import hash_file, hash_json, hash_str, ValidationCache
+from .instrument import profiled, stage
 
 
 VERSION = importlib.metadata.version(__package__)
 CWD = os.path.dirname(os.path.realpath(__file__))
 STAN_FUNCTIONS = os.path.join(CWD, "stanhf.stanfunctions")
+STRUCTURE = "// structure "
+VALIDATE_POINTS = 100
+BACKENDS = ["cmdstan", "bridgestan"]
+MEASUREMENT_PROPERTIES = ["_measurement", "_config", "_poi", "_measureds", "_pars", "_filter_pars",
+                          "_data", "_fragments", "_content_key", "_cache_key", "_cached", "par_names", "par_size"]
 
 
 def is_newer(a, b):
     """
     @returns Whether file a or code is newer than file b
     """
-    if not os.path.isfile(b):
+    if a is None or not os.path.isfile(b):
         return True
     return max(os.path.getmtime(__file__), os.path.getmtime(a)) > os.path.getmtime(b)
 
 
+def read_structure_hash(stan_file_name, max_lines=20):
+    """
+    @returns Hash of structure recorded in header of a Stan program, if present
+    """
+    if not os.path.isfile(stan_file_name):
+        return None
+
+    with open(stan_file_name, encoding="utf-8") as stan_file:
+        for _, line in zip(range(max_lines), stan_file):
+            line = line.strip()
+            if line.startswith(STRUCTURE):
+                return line[len(STRUCTURE):]
+
+    return None
+
+
 class Convert:
     """
     Convert histfactory into Stan code
     """
 
-    def __init__(self, hf_file_name, patch=None):
+    def __init__(self, hf_file_name, patch=None, cache=None, measurement=None, include=None, exclude=None):
         """
         @param hf_file_name JSON file name
-        @param patch file name and number of a patchset
+        @param patch file name and number of a patchset, or a pyhf patch
+        @param cache Cache of converted models or None
+        @param measurement Name of measurement, by default the first one
+        @param include Patterns of names of channels, samples, modifiers or modifier types to include
+        @param exclude Patterns of names of channels, samples, modifiers or modifier types to exclude
         """
         self.hf_file_name = hf_file_name
         self.patch = patch
+        self.cache = cache
+        self.measurement = measurement
+        self.include = include
+        self.exclude = exclude
+        self.name = None
+        self.directory = None
+        self._base = None
+        self._reuse = {}
+
+    @classmethod
+    def from_dict(cls, hf, patch=None, name="model", cache=None, measurement=None, include=None, exclude=None,
+                  directory=None):
+        """
+        @param hf histfactory model as a dictionary
+        @param patch file name and number of a patchset, or a pyhf patch
+        @param name Name of model, used for its files
+        @param cache Cache of converted models or None
+        @param measurement Name of measurement, by default the first one
+        @param include Patterns of names of channels, samples, modifiers or modifier types to include
+        @param exclude Patterns of names of channels, samples, modifiers or modifier types to exclude
+        @param directory Directory for files, by default a temporary one removed with the converter
+        @returns Converter that does not read the model from disk
+        """
+        convert = cls(None, patch, cache, measurement, include, exclude)
+        convert.name = name
+        convert.directory = directory
+        convert._hf = hf
+        return convert
+
+    @classmethod
+    def from_workspace(cls, workspace, patch=None, name="model", cache=None, measurement=None, include=None,
+                       exclude=None, directory=None):
+        """
+        @param workspace pyhf workspace
+        @param patch file name and number of a patchset, or a pyhf patch
+        @param name Name of model, used for its files
+        @param cache Cache of converted models or None
+        @param measurement Name of measurement, by default the first one
+        @param include Patterns of names of channels, samples, modifiers or modifier types to include
+        @param exclude Patterns of names of channels, samples, modifiers or modifier types to exclude
+        @param directory Directory for files, by default a temporary one removed with the converter
+        @returns Converter that does not read the model from disk
+        """
+        return cls.from_dict(workspace, patch, name, cache, measurement, include, exclude, directory)
+
+    @classmethod
+    def combine(cls, hf_file_names, correlations=None, measurements=None, name="combined", cache=None):
+        """
+        @param hf_file_names JSON file names of models to combine
+        @param correlations Dictionary of names of parameters and names in combined model for each model;
+                            parameters with the same name in the combined model are shared
+        @param measurements Name of measurement for each model, by default the first ones
+        @param name Name of combined model, used for files in a temporary directory
+        @param cache Cache of converted models or None
+        @returns Converter for combined model
+        """
+        workspaces = [read_workspace(f) for f in hf_file_names]
+        combined = combine_workspaces(workspaces, correlations, measurements)
+        return cls.from_workspace(combined, name=name, cache=cache)
 
     @cached_property
+    @profiled()
     def _patch(self):
         """
         @returns Patch with added metadata, if present
@@ -58,58 +156,183 @@ class Convert:
         if self.patch is None:
             return None
 
-        patch_file_name, patch_number = self.patch
-
-        with open(patch_file_name, encoding="utf-8") as patch_file:
-            patch_set = pyhf.PatchSet(json.load(patch_file))
+        if isinstance(self.patch, pyhf.patchset.Patch):
+            return self.patch
 
-        patch = patch_set.patches[patch_number]
+        _, patch_number = self.patch
+        return self._patch_set_index.patch(patch_number)
 
-        patch._metadata = patch.metadata | patch_set.metadata
-        patch._metadata["version"] = patch_set.version
-
-        return patch
+    @cached_property
+    def _patch_set_index(self):
+        """
+        @returns Index of patchset
+        """
+        return PatchSetIndex(self.patch[0])
 
     @cached_property
-    def _workspace(self):
+    @profiled()
+    def _hf(self):
         """
-        @returns Workspace, patched if necessary
+        @returns histfactory model read from disk
         """
         with open(self.hf_file_name, encoding="utf-8") as hf_file:
             try:
-                hf = json.load(hf_file)
+                return json.load(hf_file)
             except json.decoder.JSONDecodeError as e:
                 raise IOError(
                     f"could not read {self.hf_file_name} - is it a valid json file?") from e
 
-        workspace = pyhf.Workspace(hf)
+    @property
+    def _subset(self):
+        """
+        @returns Whether a subset of the model is selected
+        """
+        return bool(self.include or self.exclude)
+
+    @cached_property
+    @profiled()
+    def _workspace(self):
+        """
+        @returns Workspace, patched and pruned to a subset if necessary
+        """
+        if self._base is not None:
+            workspace = self._base._workspace
+            with stage("patch"):
+                return self._patch.apply(workspace)
 
-        if self._patch is None:
-            return workspace
+        if isinstance(self._hf, pyhf.Workspace):
+            workspace = self._hf
+        else:
+            with stage("pyhf.Workspace"):
+                workspace = pyhf.Workspace(self._hf)
+
+        if self._patch is not None:
+            with stage("patch"):
+                workspace = self._patch.apply(workspace)
+
+        if self._subset:
+            workspace = prune(workspace, self.include, self.exclude)
+
+        return workspace
+
+    @cached_property
+    def _spec(self):
+        """
+        @returns Specification of model, patched if necessary
+        """
+        return self._workspace
 
-        return self._patch.apply(workspace)
+    @cached_property
+    def _content_key(self):
+        """
+        @returns Hash of content of model, patch, measurement and subset
+        """
+        if self.hf_file_name is None:
+            hf = hash_json(self._hf)
+        else:
+            hf = hash_file(self.hf_file_name)
+
+        if self.patch is None:
+            patch = None
+        elif isinstance(self.patch, pyhf.patchset.Patch):
+            patch = hash_json(self.patch.patch)
+        else:
+            index = self._patch_set_index
+            patch = (hash_str(index.read(self.patch[1])), hash_json(index.metadata))
+
+        subset = hash_json([self.include, self.exclude]) if self._subset else None
+        return hash_str(hf, patch, self.measurement, subset)
+
+    @cached_property
+    def _cache_key(self):
+        """
+        @returns Hash of content of model, patch and version of stanhf
+        """
+        return hash_str(self._content_key, VERSION)
+
+    def _validation_key(self, kind, *data):
+        """
+        @returns Key of validation from content of model, version of pyhf and anything else on which it depends
+        """
+        return ValidationCache.key(kind, self._content_key, pyhf.__version__, *data)
+
+    @cached_property
+    def _cached(self):
+        """
+        @returns Converted model, read from cache if present, otherwise stored in cache
+        """
+        entry = self.cache.load(self._cache_key)
+
+        if entry is None:
+            entry = {"program": "\n\n".join(self._iter_blocks()),
+                     "data": to_stan_json(dict(self._iter_card("stan_data_card"))),
+                     "init": to_stan_json(dict(self._iter_card("stan_init_card"))),
+                     "summary": {"par_names": self._par_names,
+                                 "par_size": self._par_size,
+                                 "model_size": self._model_size,
+                                 "structure_hash": self._structure_hash,
+                                 "patch_name": self._patch.name if self._patch else None}}
+            self.cache.store(self._cache_key, entry)
+
+        return entry
+
+    @cached_property
+    def _directory(self):
+        """
+        @returns Directory for files of models not read from disk, by default a temporary one
+                 removed when no converter refers to it
+        """
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            return self.directory
+
+        self._temporary_directory = tempfile.TemporaryDirectory(prefix="stanhf_")
+        return self._temporary_directory.name
+
+    @property
+    def _label(self):
+        """
+        @returns Label for origin of model
+        """
+        return self.hf_file_name if self.hf_file_name is not None else f"<{self.name}>"
 
     @cached_property
     def _root(self):
         """
         @returns Root for default file names
         """
-        root = os.path.splitext(self.hf_file_name)[0]
+        if self.hf_file_name is None:
+            root = os.path.join(self._directory, self.name)
+        else:
+            root = os.path.splitext(self.hf_file_name)[0]
+
+        if self._subset:
+            root = f"{root}_subset_{hash_json([self.include, self.exclude])[:8]}"
 
         if self._patch is None:
             return root
 
-        return f"{root}_{self._patch.name}"
+        return f"{root}_{self._patch_name}"
+
+    @property
+    def _card_root(self):
+        """
+        @returns Root for default file names of data and initial values
+        """
+        if self.measurement is None:
+            return self._root
+        return f"{self._root}_{self.measurement}"
 
     def _stanhf_metadata(self):
         """
         @returns Metadata for Stan program
         """
-        hf_version = self._workspace.get("version")
+        hf_version = self._spec.get("version")
 
-        return f"""// histfactory json {self.hf_file_name}
+        return f"""// histfactory json {self._label}
                    // histfactory spec version {hf_version}
-                   // converted with stanhf {VERSION}"""
+                   // converted with stanhf {VERSION}
+                   {STRUCTURE}{self._structure_hash}"""
 
     def _patch_metadata(self):
         """
@@ -119,9 +342,9 @@ class Convert:
             return "// no patch applied"
 
         return f"""
-                // description: {self._patch.metadata['description']}
-                // patchset id: {self._patch.metadata['analysis_id']}
-                // version: {self._patch.metadata['version']}
+                // description: {self._patch.metadata.get('description')}
+                // patchset id: {self._patch.metadata.get('analysis_id')}
+                // version: {self._patch.metadata.get('version')}
                 // patch: {self._patch.name}
                 """
 
@@ -143,46 +366,75 @@ class Convert:
         """
         @returns Observed counts for each channel
         """
-        return {k["name"]: read_observed(k["data"]) for k in self._workspace["observations"]}
+        return {k["name"]: read_observed(k["data"]) for k in self._spec["observations"]}
 
     @cached_property
+    @profiled()
     def _channels(self):
         """
         @returns All channels
         """
-        return [Channel(c, self._observed[c["name"]]) for c in self._workspace["channels"]]
+        return [Channel(c, self._observed[c["name"]]) for c in self._spec["channels"]]
 
     @cached_property
-    def _config(self):
+    def _measurement(self):
         """
-        @returns Configuration block from hf program
+        @returns Selected measurement from hf program
         """
-        try:
-            pars = self._workspace["measurements"][0]["config"]["parameters"]
-        except (KeyError, IndexError):
+        measurements = self._spec.get("measurements", [])
+
+        if not measurements:
             warnings.warn("no configuration data found")
             return {}
+
+        if self.measurement is None:
+            return measurements[0]
+
+        for m in measurements:
+            if m["name"] == self.measurement:
+                return m
+
+        raise ValueError(f"no measurement {self.measurement}; choose from "
+                         f"{', '.join(m['name'] for m in measurements)}")
+
+    @staticmethod
+    def _read_config(measurement):
+        """
+        @returns Configuration of parameters in a measurement
+        """
+        pars = measurement.get("config", {}).get("parameters", [])
         return {p["name"]: p for p in pars}
 
+    @cached_property
+    def _config(self):
+        """
+        @returns Configuration block from selected measurement
+        """
+        return self._read_config(self._measurement)
+
+    @cached_property
+    def _configs(self):
+        """
+        @returns Configuration blocks from all measurements
+        """
+        return [self._read_config(m) for m in self._spec.get("measurements", [])] or [{}]
+
     @cached_property
     def _poi(self):
         """
         @returns POI
         """
-        try:
-            return self._workspace["measurements"][0]["config"]["poi"]
-        except (KeyError, IndexError):
-            warnings.warn("no configuration data found")
-            return None
+        return self._measurement.get("config", {}).get("poi")
 
     @cached_property
     def _measureds(self):
         """
         @returns Measurements for Stan program
         """
-        return find_measureds(self._config, self._modifiers)
+        return find_measureds(self._config, self._modifiers, self._configs)
 
     @cached_property
+    @profiled()
     def _pars(self):
         """
         @returns Parameters for Stan program
@@ -229,30 +481,99 @@ class Convert:
         null = [p for p in self._pars if isinstance(p, NullParameter)]
         return par, fixed, null
 
+    @property
+    def _patch_name(self):
+        """
+        @returns Name of patch, if present
+        """
+        if self.cache is not None:
+            return self._cached["summary"]["patch_name"]
+        return self._patch.name if self._patch else None
+
+    @property
+    def _par_names(self):
+        """
+        @returns Names of parameters, fixed parameters and null parameters from model
+        """
+        return [[p.par_name for p in pars] for pars in self._filter_pars]
+
+    @property
+    def _par_size(self):
+        """
+        @returns Number of parameters, fixed parameters and null parameters from model
+        """
+        return [sum(max(p.par_size, 1) for p in pars) for pars in self._filter_pars]
+
+    @property
+    def _model_size(self):
+        """
+        @returns Number of channels, samples, and modifiers from model
+        """
+        channels = len(self._channels)
+        samples = len(self._samples)
+        non_null_modifiers = len(self._non_null_modifiers)
+        null_modifiers = len(self._modifiers) - non_null_modifiers
+        return [channels, samples, non_null_modifiers, null_modifiers]
+
+    @property
+    def _structure(self):
+        """
+        @returns Structure of model that determines Stan program, but not data
+        """
+        channels = [{"name": c.name,
+                     "nbins": c.nbins,
+                     "samples": [{"name": s.name,
+                                  "modifiers": [[m.type, m.par_name, m.is_null] for m in s.modifiers]}
+                                 for s in c.samples]}
+                    for c in self._channels]
+        pars = [[isinstance(p, NullParameter), p.par_name, p.par_size] for p in self._pars]
+        measureds = sorted([m.par_name, m.optional] for m in self._measureds)
+        return {"channels": channels, "pars": pars, "measureds": measureds}
+
+    @property
+    def _structure_hash(self):
+        """
+        @returns Hash of structure of model from model
+        """
+        return hash_json([self._structure, VERSION])
+
+    @cached_property
+    def structure_hash(self):
+        """
+        @returns Hash of structure of model
+
+        Models with the same structure hash differ only in their data and initial values.
+        """
+        if self.cache is not None:
+            return self._cached["summary"]["structure_hash"]
+        return self._structure_hash
+
     @cached_property
     def par_names(self):
         """
         @returns Names of parameters, fixed parameters and null parameters
         """
-        return [[p.par_name for p in pars] for pars in self._filter_pars]
+        if self.cache is not None:
+            return self._cached["summary"]["par_names"]
+        return self._par_names
 
     @cached_property
     def par_size(self):
         """
         @returns Number of parameters, fixed parameters and null parameters
         """
-        return [sum(max(p.par_size, 1) for p in pars) for pars in self._filter_pars]
+        if self.cache is not None:
+            return self._cached["summary"]["par_size"]
+        return self._par_size
 
     @cached_property
     def model_size(self):
         """
         @returns Number of channels, samples, and modifiers
         """
-        channels = len(self._channels)
-        samples = len(self._samples)
-        non_null_modifiers = len(self._non_null_modifiers)
-        null_modifiers = len(self._modifiers) - non_null_modifiers
-        return channels, samples, non_null_modifiers, null_modifiers
+        if self.cache is not None:
+            return self._cached["summary"]["model_size"]
+        return self._model_size
 
     def __str__(self):
         """
@@ -260,14 +581,15 @@ class Convert:
         """
         par, fixed, null = self.par_size
         channels, samples, non_null_modifiers, null_modifiers = self.model_size
-        patch = f"'{self._patch.name}'" if self._patch else "no"
+        patch = f"'{self._patch_name}'" if self.patch is not None else "no"
 
-        return (f"hf file '{self.hf_file_name}' with {patch} patch applied:\n"
+        return (f"hf file '{self._label}' with {patch} patch applied:\n"
                 f"- {par} free parameters, {fixed} fixed parameters and {null} ignored null parameters\n"
                 f"- {channels} channels with {samples} samples\n"
                 f"- {non_null_modifiers} modifiers and {null_modifiers} ignored null modifiers")
 
     @cached_property
+    @profiled()
     def _data(self):
         """
         @returns Representation of all elements in Stan program
@@ -275,6 +597,100 @@ class Convert:
         return self._samples + self._pars + self._measureds + self._non_null_modifiers + \
             self._channels + self._constraints + self._staterror
 
+    @cached_property
+    def _channel_fragments(self):
+        """
+        @returns Fragments for each channel, reusing those from an unpatched model
+        """
+        fragments = emit_channels([c for c in self._channels if c.name not in self._reuse])
+        return {c.name: self._reuse[c.name] if c.name in self._reuse else fragments[c.name]
+                for c in self._channels}
+
+    @cached_property
+    @profiled()
+    def _fragments(self):
+        """
+        @returns Fragments for all blocks and cards
+        """
+        return merge_channels(self._channel_fragments, self._pars,
+                              self._measureds, self._constraints)
+
+    def _emit(self, method):
+        """
+        @returns Fragment from each element in Stan program for a block or card
+
+        Fragments are kept if patched incrementally.
+        """
+        if self._base is not None:
+            return self._fragments[method]
+        return [getattr(e, method)() for e in self._data]
+
+    @profiled()
+    def apply_patch(self, patch):
+        """
+        Apply a patch to this converted model
+
+        Only channels touched by the patch are rebuilt and re-emitted; fragments
+        from other channels are reused. Patches to a subset of a model are applied
+        to the full model, as they refer to its components by position.
+
+        @param patch pyhf patch
+        @returns Converter for patched model
+        """
+        if self._subset:
+            convert = Convert(self.hf_file_name, patch, self.cache, self.measurement, self.include, self.exclude)
+            convert.name = self.name
+            convert.directory = self.directory
+            convert._hf = self._hf
+            return convert
+
+        spec = apply_patch(self._spec, patch.patch)
+
+        channels = {c.name: c for c in self._channels}
+        observations = {o["name"]: o for o in self._spec["observations"]}
+
+        convert = Convert(self.hf_file_name, patch, self.cache, self.measurement)
+        convert.name = self.name
+        convert.directory = self.directory
+        convert._hf = self._hf
+        convert._base = self
+        convert._spec = spec
+        convert._channels = []
+
+        patched_observations = {o["name"]: o for o in spec["observations"]}
+
+        for c in spec["channels"]:
+            name = c["name"]
+            channel = channels.get(name)
+            observation = patched_observations[name]
+
+            if channel is not None and channel.channel is c and observations[name] is observation:
+                convert._channels.append(channel)
+                convert._reuse[name] = self._channel_fragments[name]
+            else:
+                convert._channels.append(Channel(c, read_observed(observation["data"])))
+
+        return convert
+
+    @profiled()
+    def select_measurement(self, measurement):
+        """
+        Select another measurement for this converted model
+
+        The Stan program is shared by all measurements, which differ only in
+        their data and initial values.
+
+        @param measurement Name of measurement
+        @returns Converter for selected measurement
+        """
+        convert = copy.copy(self)
+        convert.measurement = measurement
+
+        for k in MEASUREMENT_PROPERTIES:
+            convert.__dict__.pop(k, None)
+
+        return convert
+
     def functions_block(self):
         """
         @returns Functions block in Stan program
@@ -287,121 +703,182 @@ class Convert:
         """
         @returns Data block in Stan program
         """
-        return block("data", [e.stan_data() for e in self._data])
+        return block("data", self._emit("stan_data"))
 
     def transformed_data_block(self):
         """
         @returns Transformed data block in Stan program
         """
-        return block("transformed data", [
-                     e.stan_trans_data() for e in self._data])
+        return block("transformed data", self._emit("stan_trans_data"))
 
     def pars_block(self):
         """
         @returns Parameters block in Stan program
         """
-        return block("parameters", [e.stan_pars() for e in self._data])
+        return block("parameters", self._emit("stan_pars"))
 
     def transformed_pars_block(self):
         """
         @returns Transformed parameters block in Stan program
         """
-        return block("transformed parameters", [
-                     e.stan_trans_pars() for e in self._data])
+        return block("transformed parameters", self._emit("stan_trans_pars"))
 
     def model_block(self):
         """
         @returns Model block in Stan program
         """
-        return block("model", [e.stan_model() for e in self._data])
+        return block("model", self._emit("stan_model"))
 
     def generated_quantities_block(self):
         """
         @returns Generated quantities block in Stan program
         """
-        return block("generated quantities", [
-                     e.stan_gen_quant() for e in self._data])
+        return block("generated quantities", self._emit("stan_gen_quant"))
 
-    def data_card(self):
+    @profiled()
+    def data_card(self, metadata=True):
         """
+        @param metadata Whether to include metadata
         @returns Data for Stan program
         """
-        return merge_metadata([e.stan_data_card() for e in self._data])
+        return dict(self.iter_data_card(metadata))
 
-    def init_card(self):
+    @profiled()
+    def init_card(self, metadata=True):
         """
+        @param metadata Whether to include metadata
         @returns Initial parameter values for Stan program
         """
-        return merge_metadata([e.stan_init_card() for e in self._data])
+        return dict(self.iter_init_card(metadata))
+
+    def _iter_card(self, card, metadata=True):
+        """
+        @returns Entries in data or initial values, sorted by key
+        """
+        return merge_entries(self._emit(card), metadata)
+
+    def _iter_cached_card(self, card, metadata=True):
+        """
+        @returns Entries in cached data or initial values, sorted by key
+        """
+        return [(k, v) for k, v in sorted(self._cached[card].items()) if metadata or k != METADATA]
+
+    def iter_data_card(self, metadata=True):
+        """
+        @param metadata Whether to include metadata
+        @returns Entries in data for Stan program, sorted by key
+        """
+        if self.cache is not None:
+            return self._iter_cached_card("data", metadata)
+        return self._iter_card("stan_data_card", metadata)
+
+    def iter_init_card(self, metadata=True):
+        """
+        @param metadata Whether to include metadata
+        @returns Entries in initial parameter values for Stan program, sorted by key
+        """
+        if self.cache is not None:
+            return self._iter_cached_card("init", metadata)
+        return self._iter_card("stan_init_card", metadata)
+
+    def _iter_blocks(self):
+        """
+        @returns Blocks for Stan program, generated one at a time
+        """
+        blocks = [self._metadata,
+                  self.functions_block,
+                  self.data_block,
+                  self.transformed_data_block,
+                  self.pars_block,
+                  self.transformed_pars_block,
+                  self.model_block,
+                  self.generated_quantities_block]
+
+        for b in blocks:
+            b = b()
+            if b is not None:
+                yield b
 
+    def iter_stan(self):
+        """
+        @returns Blocks for Stan program, generated one at a time
+        """
+        if self.cache is not None:
+            return iter([self._cached["program"]])
+        return self._iter_blocks()
+
+    @profiled()
     def to_stan(self):
         """
         @returns Blocks for Stan program
         """
-        blocks = [self._metadata(),
-                  self.functions_block(),
-                  self.data_block(),
-                  self.transformed_data_block(),
-                  self.pars_block(),
-                  self.transformed_pars_block(),
-                  self.model_block(),
-                  self.generated_quantities_block()]
-        return "\n\n".join([b for b in blocks if b is not None])
+        return "\n\n".join(self.iter_stan())
 
-    def write_stan_file(self, file_name=None):
+    @profiled()
+    def write_stan_file(self, file_name=None, lint=True):
         """
         Write Stan program to a file
 
+        @param lint Whether to format Stan program with stanc
         @returns File name of Stan program
         """
         if file_name is None:
             file_name = f"{self._root}.stan"
 
-        if is_newer(self.hf_file_name, file_name):
-
-            with open(file_name, "w", encoding="utf-8") as stan_file:
-                stan_file.write(self.to_stan())
-
-            try:
-                format_stan_file(file_name, overwrite_file=True, backup=False)
-            except (CalledProcessError, RuntimeError) as err:
-                warnings.warn(f"did not lint --- {str(err)}")
-        else:
+        if not is_newer(self.hf_file_name, file_name):
             warnings.warn(
                 f"not overwriting {file_name} as newer than {self.hf_file_name}")
+        elif read_structure_hash(file_name) == self.structure_hash:
+            warnings.warn(
+                f"not overwriting {file_name} as structure of model unchanged")
+        else:
+            with open(file_name, "w", encoding="utf-8") as stan_file:
+                for i, b in enumerate(self.iter_stan()):
+                    stan_file.write("\n\n" + b if i else b)
+
+            if lint:
+                try:
+                    with stage("format_stan_file"):
+                        format_stan_file(file_name, overwrite_file=True, backup=False)
+                except (CalledProcessError, RuntimeError) as err:
+                    warnings.warn(f"did not lint --- {str(err)}")
 
         return file_name
 
-    def write_stan_data_file(self, file_name=None):
+    @profiled()
+    def write_stan_data_file(self, file_name=None, indent=4, metadata=True):
         """
         Write Stan data to a file
 
+        @param indent Indentation for pretty-printing or None for compact output
+        @param metadata Whether to include metadata
         @returns File name of Stan data file
         """
         if file_name is None:
-            file_name = f"{self._root}_data.json"
+            file_name = f"{self._card_root}_data.json"
 
         if is_newer(self.hf_file_name, file_name):
-            write_stan_json(file_name, self.data_card())
-            format_json_file(file_name)
+            write_json_file(file_name, self.iter_data_card(metadata), indent)
         else:
             warnings.warn(
                 f"not overwriting {file_name} as newer than {self.hf_file_name}")
 
         return file_name
 
-    def write_stan_init_file(self, file_name=None):
+    @profiled()
+    def write_stan_init_file(self, file_name=None, indent=4, metadata=True):
         """
         Write Stan initial values to a file
 
+        @param indent Indentation for pretty-printing or None for compact output
+        @param metadata Whether to include metadata
         @returns File name of Stan init file
         """
         if file_name is None:
-            file_name = f"{self._root}_init.json"
+            file_name = f"{self._card_root}_init.json"
 
         if is_newer(self.hf_file_name, file_name):
-            write_stan_json(file_name, self.init_card())
-            format_json_file(file_name)
+            write_json_file(file_name, self.iter_init_card(metadata), indent)
         else:
             warnings.warn(
                 f"not overwriting {file_name} as newer than {self.hf_file_name}")
@@ -416,53 +893,208 @@ class Convert:
         """
         return self.write_stan_file(), self.write_stan_data_file(), self.write_stan_init_file()
 
-    def build(self, stan_file_name=None):
+    def to_memory(self, metadata=False):
+        """
+        @param metadata Whether to include metadata
+        @returns Stan program, data and initial values
+        """
+        return self.to_stan(), self.data_card(metadata), self.init_card(metadata)
+
+    @profiled()
+    def build(self, stan_file_name=None, directory=None, profile=None, ccache=False, exe_cache=None):
         """
         Build Stan model
 
+        Models not read from disk are built in a directory named by the content
+        of the Stan program, by default a temporary one.
+
+        @param directory Directory in which to build models not read from disk
+        @param profile Name of build profile, by default cmdstan's defaults
+        @param ccache Whether to cache compiled objects with ccache
+        @param exe_cache Cache of executables shared by identical programs
         @returns File name of executable Stan model
         """
+        options = profile_options(profile, ccache)
+        if stan_file_name is None and (self.hf_file_name is None or directory is not None):
+            return build_program(self.to_stan(), directory, exe_cache, **options)
         if stan_file_name is None:
             stan_file_name = self.write_stan_file()
-        return compile_stan_file(stan_file_name)
+        return compile_cached(stan_file_name, exe_cache, **options)
 
-    def validate_target(self, exe_file_name=None, stan_file_name=None, data_file_name=None, init_file_name=None, rng=None):
+    @profiled()
+    def numpy_model(self):
         """
-        Validates stanhf target against pyhf
+        @returns Evaluator of expected counts, log-likelihood and its gradient for a batch of points
+        """
+        return NumpyModel(self._channels, self._pars, self._measureds, self._constraints, self._staterror)
+
+    @profiled()
+    def in_process(self, stan_file_name=None, directory=None, profile=None):
+        """
+        Build Stan model as a shared library and load it in process
+
+        Requires bridgestan. Models not read from disk are built as for build.
+
+        @param directory Directory in which to build models not read from disk
+        @param profile Name of build profile, by default cmdstan's defaults
+        @returns Model evaluating target, its gradient and Hessian in process
+        """
+        options = profile_options(profile)
+        if stan_file_name is None and (self.hf_file_name is None or directory is not None):
+            stan_file_name = write_program(self.to_stan(), directory, **options)
+        elif stan_file_name is None:
+            stan_file_name = self.write_stan_file()
+        return InProcessModel(compile_library(stan_file_name, **options), self.data_card(metadata=False))
+
+    @profiled()
+    async def abuild(self, stan_file_name=None, directory=None, profile=None, ccache=False, exe_cache=None,
+                     progress=None, limit=None):
         """
-        if data_file_name is None:
-            data_file_name = self.write_stan_data_file()
+        Build Stan model asynchronously, as for build
 
-        if init_file_name is None:
-            init_file_name = self.write_stan_init_file()
+        @param progress Callback for events, or None
+        @param limit Semaphore limiting concurrent jobs, by default number of CPUs
+        @returns File name of executable Stan model
+        """
+        options = profile_options(profile, ccache)
+        loop = asyncio.get_running_loop()
+        if stan_file_name is None and (self.hf_file_name is None or directory is not None):
+            stan_file_name = await loop.run_in_executor(
+                None, lambda: write_program(self.to_stan(), directory, **options))
+        elif stan_file_name is None:
+            stan_file_name = await loop.run_in_executor(None, self.write_stan_file)
+        return await abuild_stan_file(stan_file_name, exe_cache=exe_cache, progress=progress, limit=limit,
+                                      **options)
+
+    def _target_keys(self, stan_file_name, data_file_name, init_file_name, seed, points, backend):
+        """
+        @returns Keys of reference pyhf targets and of outcome of validating target
+        """
+        reference_key = self._validation_key("reference", hash_file(init_file_name), seed, points)
+        with open(stan_file_name, encoding="utf-8") as stan_file:
+            program = hash_str(normalize_stan(stan_file.read()))
+        target_key = self._validation_key("target", reference_key, program, hash_file(data_file_name),
+                                          backend, VERSION)
+        return reference_key, target_key
+
+    def _stanhf_target(self, draws, exe_file_name, stan_file_name, data_file_name, init_file_name, backend):
+        """
+        @returns Stan target at each point, by cmdstan executable or in process
+        """
+        if backend == "bridgestan":
+            return run_stanhf_model_in_process(draws, stan_file_name, data_file_name)
 
         if exe_file_name is None:
             exe_file_name = self.build(stan_file_name)
 
-        a = perturb_param_file(init_file_name, rng)
-        b = perturb_param_file(init_file_name, rng)
+        draws_file_name = f"{os.path.splitext(init_file_name)[0]}_validate.csv"
+        return run_stanhf_model_batch(
+            draws, get_stan_par_names(stan_file_name), data_file_name, exe_file_name, draws_file_name)
+
+    def _pyhf_target(self, draws, cache=None, reference_key=None, force=False):
+        """
+        @param cache Cache of reference pyhf targets or None
+        @param force Whether to evaluate even if reference targets are cached
+        @returns pyhf target at each point, reused from cache or stored in it
+        """
+        reference = None if cache is None or force else cache.load(reference_key)
+
+        if reference is not None:
+            return np.array(reference)
+
+        pyhf_target = run_pyhf_model_batch(draws, self._workspace, self.measurement)
+
+        if cache is not None:
+            cache.store(reference_key, pyhf_target.tolist())
 
-        stanhf_delta = run_stanhf_model(
-            b, data_file_name, exe_file_name) - run_stanhf_model(a, data_file_name, exe_file_name)
-        nhf_delta = run_pyhf_model(
-            b, self._workspace) - run_pyhf_model(a, self._workspace)
+        return pyhf_target
+
+    @profiled()
+    def validate_target(self, exe_file_name=None, stan_file_name=None, data_file_name=None, init_file_name=None, rng=None,
+                        points=VALIDATE_POINTS, backend="cmdstan", seed=None, validation_cache=None, force=False):
+        """
+        Validates stanhf target against pyhf
+
+        The target is evaluated at random points around the initial values in
+        one launch of Stan, or in process, and one batched evaluation of pyhf.
+
+        Outcomes and reference pyhf targets may be cached. They are reused if
+        the model, patch, program, data, versions of stanhf and pyhf and seed
+        are unchanged. Points are seeded by 0 if a cache but no seed is given.
+
+        @param points Number of points at which to compare targets
+        @param backend Evaluate Stan target by cmdstan executable or in process by bridgestan
+        @param seed Seed for points, used instead of rng
+        @param validation_cache Cache of outcomes of validation or None
+        @param force Whether to validate even if outcome is cached
+        @returns Summary of discrepancies between targets
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown backend {backend}; choose from {', '.join(BACKENDS)}")
 
-        if not np.isclose(stanhf_delta, nhf_delta):
+        if validation_cache is not None and seed is None and rng is None:
+            seed = 0
+
+        if seed is not None:
+            rng = np.random.default_rng(seed)
+
+        stan_file_name = stan_file_name or self.write_stan_file()
+        data_file_name = data_file_name or self.write_stan_data_file()
+        init_file_name = init_file_name or self.write_stan_init_file()
+
+        cache = validation_cache if seed is not None else None
+        reference_key = target_key = None
+
+        if cache is not None:
+            reference_key, target_key = self._target_keys(
+                stan_file_name, data_file_name, init_file_name, seed, points, backend)
+            cached = None if force else cache.load(target_key)
+            if cached is not None:
+                return cached
+
+        draws = [perturb_param_file(init_file_name, rng) for _ in range(max(2, points))]
+        stanhf_target = self._stanhf_target(draws, exe_file_name, stan_file_name, data_file_name, init_file_name,
+                                            backend)
+        pyhf_target = self._pyhf_target(draws, cache, reference_key, force)
+
+        discrepancy, summary = summarize_discrepancies(stanhf_target, pyhf_target)
+
+        if not np.allclose(stanhf_target - stanhf_target[0], pyhf_target - pyhf_target[0]):
+            worst = int(np.argmax(np.abs(discrepancy)))
             raise RuntimeError(
                 f"no agreement in delta log-like:\n"
-                f"Stan = {stanhf_delta}\n"
-                f"pyhf = {nhf_delta}\n"
-                f"difference = {stanhf_delta - nhf_delta}\n"
-                f"for a = {a} and b = {b}")
+                f"Stan = {stanhf_target[worst] - stanhf_target[0]}\n"
+                f"pyhf = {pyhf_target[worst] - pyhf_target[0]}\n"
+                f"difference = {discrepancy[worst]}\n"
+                f"for a = {draws[0]} and b = {draws[worst]}\n"
+                f"summary = {summary}")
 
-    def validate_par_names(self, stan_file_name=None):
+        if cache is not None:
+            cache.store(target_key, summary)
+
+        return summary
+
+    @profiled()
+    def validate_par_names(self, stan_file_name=None, validation_cache=None, force=False):
         """
         Validates stanhf parameter names and sizes against pyhf
+
+        @param validation_cache Cache of outcomes of validation or None
+        @param force Whether to validate even if outcome is cached
         """
         if stan_file_name is None:
             stan_file_name = self.write_stan_file()
 
-        pyhf_par_data = get_pyhf_par_data(self._workspace)
+        key = None
+
+        if validation_cache is not None:
+            with open(stan_file_name, encoding="utf-8") as stan_file:
+                program = hash_str(normalize_stan(stan_file.read()))
+            key = self._validation_key("par_names", program, VERSION)
+            if not force and validation_cache.load(key) is not None:
+                return
+
+        pyhf_par_data = get_pyhf_par_data(self._workspace, self.measurement)
         stanhf_par_data = {remove_prefix(m.par_name, "free_"): max(
             1, m.par_size) for m in self._pars}
 
@@ -473,7 +1105,7 @@ class Convert:
                 f"pyhf = {pyhf_par_data}\n"
                 f"difference = {set(stanhf_par_data) ^ set(pyhf_par_data)}")
 
-        stanhf_par_names = sorted(self.par_names[0])
+        stanhf_par_names = sorted(self.par_names[0] + self.par_names[1])
         stan_par_names = sorted([remove_prefix(p, "free_")
                                 for p in get_stan_par_names(stan_file_name)])
 
@@ -483,3 +1115,6 @@ class Convert:
                 f"Stanhf = {stanhf_par_names}\n"
                 f"Stan = {stan_par_names}",
                 f"difference = {stanhf_par_names ^ stan_par_names}")
+
+        if validation_cache is not None:
+            validation_cache.store(key, {"par_names": stanhf_par_names})
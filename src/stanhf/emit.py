@@ -0,0 +1,61 @@
+"""
+Emit fragments of Stan program, data and initial values
+=======================================================
+
+Fragments for each channel are independent, such that those of channels
+untouched by a patch may be reused.
+"""
+
+from .modifier import find_staterror
+from .stanstr import flatten
+
+
+METHODS = ["stan_data", "stan_trans_data", "stan_pars", "stan_trans_pars",
+           "stan_model", "stan_gen_quant", "stan_data_card", "stan_init_card"]
+
+
+def emit(elements):
+    """
+    @returns Fragments from elements for every block and card
+    """
+    return {m: [getattr(e, m)() for e in elements] for m in METHODS}
+
+
+def emit_channel(channel):
+    """
+    @returns Fragments from samples, non-null modifiers, the channel and combined
+    statistical errors in a channel
+    """
+    samples = channel.samples
+    modifiers = [m for m in flatten([s.modifiers for s in samples]) if not m.is_null]
+    return [emit(samples), emit(modifiers), emit([channel]), emit(find_staterror(channel))]
+
+
+def merge(fragments):
+    """
+    @returns Fragments for every block and card concatenated in order
+    """
+    return {m: flatten([f[m] for f in fragments]) for m in METHODS}
+
+
+def emit_channels(channels):
+    """
+    @returns Fragments for each channel by name
+    """
+    return {c.name: emit_channel(c) for c in channels}
+
+
+def merge_channels(channel_fragments, pars, measureds, constraints):
+    """
+    Merge fragments in the same order as a sequential walk over samples,
+    parameters, measurements, modifiers, channels, constraints and statistical
+    errors
+
+    @param channel_fragments Fragments for each channel
+    @returns Fragments for every block and card
+    """
+    per_channel = list(channel_fragments.values())
+    samples, modifiers, channels, staterror = zip(*per_channel) if per_channel else [[]] * 4
+
+    return merge([*samples, emit(pars), emit(measureds), *modifiers,
+                  *channels, emit(constraints), *staterror])
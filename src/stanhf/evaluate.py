@@ -0,0 +1,295 @@
+"""
+Evaluate models with NumPy
+==========================
+
+The expected counts, log-likelihood and its gradient are computed from the same
+channels, samples, modifiers and parameters from which the Stan program is
+written, for a batch of points at once and without compiling anything.
+
+The interpolations follow the Stan functions term_interp and factor_interp.
+The log-likelihood is a function of constrained parameters without any
+Jacobian, as in log_prob with jacobian=False. It matches pyhf up to an additive
+constant, as parameters of only null modifiers are ignored, together with the
+constant terms of their constraints.
+"""
+
+from functools import reduce
+
+import numpy as np
+from scipy.special import gammaln
+
+from .config import FixedParameter, FreeParameter, POI
+from .modifier import ShapeSys
+from .pars import flatten_par, strip_free_pars
+
+
+FACTOR_INTERP = np.array([[0.9375, -0.9375, -0.4375, -0.4375, 0.0625, -0.0625],
+                          [1.5, 1.5, -0.5625, 0.5625, 0.0625, 0.0625],
+                          [-0.625, 0.625, 0.625, 0.625, -0.125, 0.125],
+                          [-1.5, -1.5, 0.875, -0.875, -0.125, -0.125],
+                          [0.1875, -0.1875, -0.1875, -0.1875, 0.0625, -0.0625],
+                          [0.5, 0.5, -0.3125, 0.3125, 0.0625, 0.0625]])
+LOG_SQRT_TWO_PI = 0.5 * np.log(2. * np.pi)
+
+
+def term_interp(alpha, x, lu):
+    """
+    @param alpha Interpolation parameter at each point
+    @param x Nominal counts
+    @param lu One-sigma lower and upper counts
+    @returns Additive correction and its derivative at each point
+    """
+    alpha = alpha[:, np.newaxis]
+    x = np.asarray(x, dtype=float)
+    lower, upper = (np.asarray(v, dtype=float) for v in lu)
+
+    s = 0.5 * (upper - lower)
+    a = 0.0625 * (upper + lower - 2. * x)
+    alpha_square = alpha**2
+    r = alpha_square * (alpha_square * (alpha_square * 3. - 10.) + 15.)
+    dr = alpha * (alpha_square * (alpha_square * 18. - 40.) + 30.)
+
+    term = np.where(alpha > 1., alpha * (upper - x), np.where(alpha < -1., alpha * (x - lower), r * a + alpha * s))
+    dterm = np.where(alpha > 1., upper - x, np.where(alpha < -1., x - lower, dr * a + s))
+    return term, dterm
+
+
+def factor_interp(alpha, lu):
+    """
+    @param alpha Interpolation parameter at each point
+    @param lu One-sigma lower and upper factors
+    @returns Multiplicative correction and its derivative at each point
+    """
+    lower, upper = lu
+
+    with np.errstate(all="ignore"):
+        log_l = np.log(lower)
+        log_u = np.log(upper)
+        b = np.array([upper - 1., lower - 1., log_u * upper, -log_l * lower,
+                      log_u**2 * upper, log_l**2 * lower])
+        c = FACTOR_INTERP @ b
+
+        powers = alpha[:, np.newaxis] ** np.arange(7)
+        poly = 1. + powers[:, 1:] @ c
+        dpoly = powers[:, :-1] @ (np.arange(1, 7) * c)
+
+        factor = np.where(alpha > 1., upper**alpha, np.where(alpha < -1., lower**-alpha, poly))
+        dfactor = np.where(alpha > 1., upper**alpha * log_u, np.where(alpha < -1., -lower**-alpha * log_l, dpoly))
+
+    return factor[:, np.newaxis], dfactor[:, np.newaxis]
+
+
+def normal(x, mu, sigma):
+    """
+    @returns Normal log-density and its derivative
+    """
+    z = (x - mu) / sigma
+    return -0.5 * z**2 - np.log(sigma) - LOG_SQRT_TWO_PI, -z / sigma
+
+
+def poisson(k, rate):
+    """
+    @returns Poisson log-probability, continuous in counts, and its derivative by rate
+    """
+    k = np.asarray(k, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return k * np.log(rate) - rate - gammaln(k + 1.), k / rate - 1.
+
+
+class NumpyModel:
+    """
+    Log-likelihood of a model for a batch of points
+
+    Points are rows of constrained parameters, in the order of par_names.
+    Fixed parameters take their initial values.
+    """
+
+    def __init__(self, channels, pars, measureds, constraints, staterror):
+        """
+        @param channels Channels of model
+        @param pars Parameters of model
+        @param measureds Measurements of parameters
+        @param constraints Constraints on modifiers
+        @param staterror Combined statistical errors
+        """
+        self.channels = channels
+        self.measureds = [m for m in measureds if m.measured]
+        self.constraints = constraints
+        self.staterror = staterror
+        self.shapesys = [m for c in channels for m in c.modifiers if isinstance(m, ShapeSys) and not m.is_null]
+
+        self.fixed = {p.par_name: np.asarray(p.par_init, dtype=float)
+                      for p in pars if isinstance(p, FixedParameter)}
+        self.slices = {}
+        self.par_names = []
+
+        for p in pars:
+            if isinstance(p, (POI, FreeParameter)):
+                names = flatten_par(p.par_name, p.par_init)[0]
+                self.slices[p.par_name] = slice(len(self.par_names), len(self.par_names) + len(names)) \
+                    if p.par_size else len(self.par_names)
+                self.par_names += names
+
+    @property
+    def par_size(self):
+        """
+        @returns Number of parameters
+        """
+        return len(self.par_names)
+
+    def to_theta(self, draws):
+        """
+        @param draws Points as dictionaries of parameters, with or without free prefix
+        @returns Points as rows of parameters
+        """
+        theta = np.empty((len(draws), self.par_size))
+
+        for i, d in enumerate(draws):
+            d = strip_free_pars(d)
+            for name, index in self.slices.items():
+                theta[i, index] = d[name]
+
+        return theta
+
+    def _values(self, theta):
+        """
+        @returns Value of each parameter at each point
+        """
+        values = {k: theta[:, v] for k, v in self.slices.items()}
+        values.update({k: np.broadcast_to(v, (len(theta),) + v.shape) for k, v in self.fixed.items()})
+        return values
+
+    def _add_grad(self, grad, par_name, dlogl):
+        """
+        Add derivative of log-likelihood with respect to a parameter
+        """
+        index = self.slices.get(par_name)
+
+        if index is None:
+            return
+
+        if isinstance(index, slice):
+            grad[:, index] += dlogl
+        else:
+            grad[:, index] += dlogl if dlogl.ndim == 1 else dlogl.sum(axis=1)
+
+    @staticmethod
+    def _sample(sample, values):
+        """
+        @returns Sum of nominal and additive corrections, and multiplicative factors and their derivatives
+        """
+        total = np.asarray(sample.nominal, dtype=float)[np.newaxis, :]
+        terms = []
+        factors = []
+
+        for m in sample.modifiers:
+            if m.is_null:
+                continue
+
+            value = values[m.par_name]
+
+            if m.type == "histosys":
+                term, dterm = term_interp(value, sample.nominal, m.lu_data)
+                total = total + term
+                terms.append((m, dterm))
+            elif m.type == "normsys":
+                factors.append((m, *factor_interp(value, m.lu_data)))
+            elif np.ndim(value) == 1:
+                factors.append((m, value[:, np.newaxis], np.ones((len(value), 1))))
+            else:
+                factors.append((m, value, np.ones_like(value)))
+
+        return total, terms, factors
+
+    def _add_sample_grad(self, grad, dlog_poisson, total, terms, factors, product):
+        """
+        Add derivatives of Poisson log-likelihood through corrections to a sample
+        """
+        for m, dterm in terms:
+            self._add_grad(grad, m.par_name, dlog_poisson * product * dterm)
+
+        for i, (m, _, dfactor) in enumerate(factors):
+            others = reduce(np.multiply, [f for j, (_, f, _) in enumerate(factors) if j != i], 1.)
+            self._add_grad(grad, m.par_name, dlog_poisson * total * others * dfactor)
+
+    def _channel(self, channel, values, size, grad=None):
+        """
+        @param size Number of points
+        @param grad Gradient to which derivatives are added, or None
+        @returns Expected counts in a channel and its Poisson log-likelihood at each point
+        """
+        samples = []
+        rate = np.zeros((size, channel.nbins))
+
+        for sample in channel.samples:
+            total, terms, factors = self._sample(sample, values)
+            product = reduce(np.multiply, [f for _, f, _ in factors], np.ones(1))
+            rate = rate + total * product
+            samples.append((total, terms, factors, product))
+
+        log_poisson, dlog_poisson = poisson(channel.observed, rate)
+
+        if grad is not None:
+            for total, terms, factors, product in samples:
+                self._add_sample_grad(grad, dlog_poisson, total, terms, factors, product)
+
+        return rate, log_poisson.sum(axis=1)
+
+    def _auxiliary(self, values):
+        """
+        @returns Name of parameter, log-density of its auxiliary measurement and its derivative, for each one
+        """
+        for c in self.constraints:
+            yield (c.par_name, *normal(values[c.par_name], 0., 1.))
+
+        for m in self.measureds:
+            yield (m.par_name, *normal(values[m.par_name], *m.normal_data))
+
+        for s in self.staterror:
+            nominal = sum(np.asarray(m.sample.nominal, dtype=float) for m in s.modifiers)
+            stdev = np.sqrt(sum(np.asarray(m.stdev, dtype=float)**2 for m in s.modifiers)) / nominal
+            yield (s.par_name, *normal(values[s.par_name], 1., stdev))
+
+        for m in self.shapesys:
+            observed = (np.asarray(m.sample.nominal, dtype=float) / np.asarray(m.rel_error, dtype=float))**2
+            log_poisson, dlog_poisson = poisson(observed, values[m.par_name] * observed)
+            yield m.par_name, log_poisson, dlog_poisson * observed
+
+    def _evaluate(self, theta, gradient=True):
+        """
+        @returns Expected counts in each channel, log-likelihood and its gradient at each point
+        """
+        theta = np.atleast_2d(np.asarray(theta, dtype=float))
+        values = self._values(theta)
+        logl = np.zeros(len(theta))
+        grad = np.zeros(theta.shape) if gradient else None
+        expected = {}
+
+        for channel in self.channels:
+            expected[channel.name], log_poisson = self._channel(channel, values, len(theta), grad)
+            logl += log_poisson
+
+        for par_name, log_density, dlog_density in self._auxiliary(values):
+            logl += log_density if log_density.ndim == 1 else log_density.sum(axis=1)
+            if gradient:
+                self._add_grad(grad, par_name, dlog_density)
+
+        return expected, logl, grad
+
+    def expected(self, theta):
+        """
+        @returns Expected counts in each channel at each point
+        """
+        return self._evaluate(theta, gradient=False)[0]
+
+    def log_likelihood(self, theta):
+        """
+        @returns Log-likelihood at each point
+        """
+        return self._evaluate(theta, gradient=False)[1]
+
+    def log_likelihood_gradient(self, theta):
+        """
+        @returns Log-likelihood and its gradient at each point
+        """
+        return self._evaluate(theta)[1:]
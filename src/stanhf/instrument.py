@@ -0,0 +1,240 @@
+"""
+Instrument stages of converting, building and validating
+========================================================
+
+Wall time, CPU time of this process and of its children, e.g., compilers, and
+peak memory are recorded for each stage while profiling, and written as a json
+report and as a Chrome trace, e.g., for chrome://tracing or Perfetto. Stages
+nest, such that the time taken by e.g., reading json is seen within the
+conversion that needed it. When not profiling, instrumented functions are
+called directly and stages are a shared no-op context.
+"""
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+_PROFILER = None
+_NO_STAGE = contextlib.nullcontext()
+
+
+def max_rss():
+    """
+    @returns Peak resident set size of this process in bytes, or None if unknown
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def child_cpu_time():
+    """
+    @returns CPU time of finished child processes
+    """
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class Profiler:
+    """
+    Record of wall time, CPU time and peak memory of each stage
+    """
+
+    def __init__(self, memory=True, callback=None):
+        """
+        @param memory Whether to trace memory allocated by Python, at a cost in speed
+        @param callback Function called with record of each stage as it ends, or None
+        """
+        self.memory = memory
+        self.callback = callback
+        self.records = []
+        self.origin = time.perf_counter()
+        # stages enclosing the current one, separate for each thread and asyncio task
+        self._stack = contextvars.ContextVar(f"stanhf_stages_{id(self)}", default=())
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        """
+        Record a stage
+
+        @param name Name of stage
+        @param args Details of stage for report and trace
+        """
+        stack = self._stack.get()
+        tracing = self.memory and tracemalloc.is_tracing()
+
+        if tracing:
+            # tracemalloc keeps one peak, so keep the peak of the enclosing stage so far
+            if stack:
+                stack[-1]["peak_before"] = max(stack[-1].get("peak_before", 0), tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        record = {"name": name, "parent": stack[-1]["name"] if stack else None, "depth": len(stack),
+                  "thread": threading.get_ident(), "args": args}
+        token = self._stack.set(stack + (record,))
+
+        start = time.perf_counter()
+        cpu = time.process_time()
+        child_cpu = child_cpu_time()
+
+        try:
+            yield record
+        finally:
+            record["start"] = start - self.origin
+            record["wall"] = time.perf_counter() - start
+            record["cpu"] = time.process_time() - cpu
+            record["child_cpu"] = child_cpu_time() - child_cpu
+            record["max_rss"] = max_rss()
+            record["peak_memory"] = None
+
+            if tracing:
+                record["peak_memory"] = max(tracemalloc.get_traced_memory()[1], record.pop("peak_before", 0))
+
+            self._stack.reset(token)
+
+            with self._lock:
+                self.records.append(record)
+
+            if self.callback is not None:
+                self.callback(record)
+
+    def summary(self):
+        """
+        @returns Number of calls, total wall and CPU time and peak memory of each stage by name
+        """
+        summary = {}
+
+        for r in self.records:
+            s = summary.setdefault(r["name"], {"calls": 0, "wall": 0., "cpu": 0., "child_cpu": 0.,
+                                               "peak_memory": None})
+            s["calls"] += 1
+            s["wall"] += r["wall"]
+            s["cpu"] += r["cpu"]
+            s["child_cpu"] += r["child_cpu"]
+            if r["peak_memory"] is not None:
+                s["peak_memory"] = max(s["peak_memory"] or 0, r["peak_memory"])
+
+        return summary
+
+    def report(self):
+        """
+        @returns Report of each stage in order of start and summary by name
+        """
+        stages = sorted(self.records, key=lambda r: r["start"])
+        return {"stages": stages,
+                "summary": self.summary(),
+                "max_rss": max_rss()}
+
+    def trace(self):
+        """
+        @returns Chrome trace of stages as complete events
+        """
+        pid = os.getpid()
+        events = [{"name": r["name"], "cat": "stanhf", "ph": "X", "pid": pid, "tid": r["thread"],
+                   "ts": r["start"] * 1e6, "dur": r["wall"] * 1e6,
+                   "args": {"cpu": r["cpu"], "child_cpu": r["child_cpu"], "peak_memory": r["peak_memory"],
+                            "max_rss": r["max_rss"], **{k: str(v) for k, v in r["args"].items()}}}
+                  for r in sorted(self.records, key=lambda r: r["start"])]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_report(self, file_name):
+        """
+        Write json report of stages
+
+        @returns File name of report
+        """
+        with open(file_name, "w", encoding="utf-8") as report_file:
+            json.dump(self.report(), report_file, indent=4, default=str)
+        return file_name
+
+    def write_trace(self, file_name):
+        """
+        Write Chrome trace of stages
+
+        @returns File name of trace
+        """
+        with open(file_name, "w", encoding="utf-8") as trace_file:
+            json.dump(self.trace(), trace_file)
+        return file_name
+
+
+@contextlib.contextmanager
+def profiling(memory=True, callback=None):
+    """
+    Profile stages within context
+
+    @param memory Whether to trace memory allocated by Python, at a cost in speed
+    @param callback Function called with record of each stage as it ends, or None
+    @returns Profiler recording stages
+    """
+    global _PROFILER  # pylint: disable=global-statement
+    previous = _PROFILER
+    profiler = Profiler(memory, callback)
+    started = memory and not tracemalloc.is_tracing()
+
+    if started:
+        tracemalloc.start()
+
+    _PROFILER = profiler
+
+    try:
+        yield profiler
+    finally:
+        _PROFILER = previous
+        if started:
+            tracemalloc.stop()
+
+
+def stage(name, **args):
+    """
+    @param name Name of stage
+    @param args Details of stage for report and trace
+    @returns Context recording a stage while profiling, or a no-op context
+    """
+    if _PROFILER is None:
+        return _NO_STAGE
+    return _PROFILER.stage(name, **args)
+
+
+def profiled(name=None):
+    """
+    Record calls of a function as a stage while profiling
+
+    @param name Name of stage, by default qualified name of function
+    """
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _PROFILER is None:
+                    return await func(*args, **kwargs)
+                with _PROFILER.stage(stage_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _PROFILER is None:
+                return func(*args, **kwargs)
+            with _PROFILER.stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
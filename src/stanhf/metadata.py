@@ -52,17 +52,23 @@ def add_metadata_comment(func):
     return wrapped
 
 
-def shallow_merge(list_):
+def merge_entries(list_, metadata=True):
     """
-    @returns Shallow-merge a list of dictionaries
+    @param list_ Iterable of dictionaries, possibly with metadata
+    @param metadata Whether to include merged metadata as an entry
+    @returns Shallow-merged entries sorted by key
     """
-    return {k: v for d in list_ if d for k, v in d.items()}
+    merged = {}
+    log = {}
 
+    for d in list_:
+        if d:
+            log.update(d.get(METADATA, {}))
+            merged.update(d)
 
-def merge_metadata(list_):
-    """
-    @returns Shallow-merged list of dictionaries with shallow-merged metadata
-    """
-    merged = shallow_merge(list_)
-    merged[METADATA] = shallow_merge([d.pop(METADATA, {}) for d in list_ if d])
-    return merged
+    merged.pop(METADATA, None)
+
+    if metadata:
+        merged[METADATA] = log
+
+    return sorted(merged.items())
@@ -3,18 +3,111 @@ Deal with parameter naming conventions across Stan and pyhf
 ===========================================================
 """
 
+import numpy as np
 from cmdstanpy import compilation
 
 from .stanstr import flatten, remove_prefix
 
 
+def strip_free_pars(pars):
+    """
+    @returns Parameters without free prefix, ignoring fixed parameters
+
+    Parameters that may be fixed are declared as arrays of size zero if fixed
+    or one if free.
+    """
+    stripped = {}
+
+    for k, v in pars.items():
+        if not k.startswith("free_"):
+            stripped[k] = v
+        elif len(v):
+            stripped[remove_prefix(k, "free_")] = v[0]
+
+    return stripped
+
+
+def flatten_par(name, value):
+    """
+    @returns Stan csv column names and values of a parameter, in column-major order
+    """
+    value = np.asarray(value, dtype=float)
+    shape = value.shape[::-1]
+    names = [".".join([name] + [str(i + 1) for i in reversed(index)])
+             for index in np.ndindex(*shape)] if shape else [name]
+    return names, value.ravel(order="F").tolist()
+
+
+class ParMap:
+    """
+    Map between columns of Stan csv output and pyhf parameters
+
+    Each element of a pyhf parameter is read from the Stan column of the same
+    name or, failing that, from the free parameter. Elements of parameters not
+    in the columns, e.g., null parameters, take their suggested initial values.
+    Whole sets of draws are mapped at once by indexing.
+    """
+
+    def __init__(self, columns, model):
+        """
+        @param columns Names of Stan csv columns, e.g., free_mu.1 or gamma.2
+        @param model pyhf model
+        """
+        self.columns = list(columns)
+        self.init = np.asarray(model.config.suggested_init(), dtype=float)
+
+        lookup = {c: i for i, c in enumerate(self.columns)}
+        pyhf_index = []
+        stan_index = []
+        self.found = []
+
+        for p in model.config.par_order:
+            par_slice = model.config.par_slice(p)
+            size = par_slice.stop - par_slice.start
+
+            for i, j in enumerate(range(par_slice.start, par_slice.stop), 1):
+                candidates = [f"{p}.{i}", f"free_{p}.1.{i}"]
+                if size == 1:
+                    candidates = [p, f"free_{p}.1"] + candidates
+                found = [lookup[c] for c in candidates if c in lookup]
+                if found:
+                    pyhf_index.append(j)
+                    stan_index.append(found[0])
+                self.found += [(j, f) for f in found]
+
+        self.pyhf_index = np.array(pyhf_index, dtype=int)
+        self.stan_index = np.array(stan_index, dtype=int)
+
+    def to_pyhf(self, draws):
+        """
+        @param draws Stan draws, one point per row with values in order of columns
+        @returns pyhf parameters, one point per row
+        """
+        draws = np.atleast_2d(np.asarray(draws, dtype=float))
+        pars = np.tile(self.init, (len(draws), 1))
+        pars[:, self.pyhf_index] = draws[:, self.stan_index]
+        return pars
+
+    def to_stan(self, pars):
+        """
+        @param pars pyhf parameters, one point per row
+        @returns Stan draws, one point per row in order of columns, with nan
+                 in columns without a pyhf parameter
+        """
+        pars = np.atleast_2d(np.asarray(pars, dtype=float))
+        draws = np.full((len(pars), len(self.columns)), np.nan)
+        pyhf_index, stan_index = zip(*self.found) if self.found else ([], [])
+        draws[:, list(stan_index)] = pars[:, list(pyhf_index)]
+        return draws
+
+
 def get_pyhf_pars(pars, model):
     """
     @returns pyhf parameters for calling target
     """
     init = get_pyhf_init(model)
-    strip_free_pars = {remove_prefix(k, "free_"): v for k, v in pars.items()}
-    pars = {k: strip_free_pars.get(k, v) for k, v in init.items()}
+    stripped = strip_free_pars(pars)
+    pars = {k: stripped.get(k, v) for k, v in init.items()}
     return flatten(pars[k] for k in model.config.par_order)
 
 
@@ -26,11 +119,11 @@ def get_pyhf_init(model):
     return {p: init[model.config.par_slice(p)] for p in model.config.par_order}
 
 
-def get_pyhf_par_data(workspace):
+def get_pyhf_par_data(workspace, measurement=None):
     """
     @returns Names and sizes of pyhf parameters
     """
-    model = workspace.model(poi_name=None)
+    model = workspace.model(measurement_name=measurement, poi_name=None)
     init = get_pyhf_init(model)
     return {k: len(v) for k, v in init.items()}
 
@@ -0,0 +1,251 @@
+"""
+Read and select patches from a patchset
+=======================================
+
+Large patchsets are indexed in a single scan, recording the name, metadata and
+byte span of each patch, such that a patch can be read without parsing others.
+"""
+
+import copy
+import json
+import mmap
+import os
+import re
+import warnings
+
+import jsonpatch
+import pyhf
+
+
+TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"(\s*:)?|[\[\]{}]')
+
+
+def scan_patchset(data):
+    """
+    Scan patchset for spans of top-level entries and of patches
+
+    Only strings and brackets are tokenized, such that numbers are skipped.
+
+    @param data Content of patchset json file
+    @returns Spans of top-level entries and spans of patches and their metadata
+    """
+    stack = []
+    key = None
+    top = {}
+    patches = []
+    patch_metadata = None
+
+    for match in TOKEN.finditer(data):
+        char = match.group(0)[:1]
+
+        if match.group(1) is not None:
+            key = json.loads(data[match.start():match.start(1)])
+            continue
+
+        if char == b'"':
+            if len(stack) == 1 and key is not None:
+                top[key] = (match.start(), match.end())
+            key = None
+            continue
+
+        if char in b"{[":
+            stack.append((match.start(), key))
+            key = None
+            continue
+
+        start, closed = stack.pop()
+        span = (start, match.end())
+        depth = len(stack)
+        in_patches = depth >= 2 and stack[1][1] == "patches"
+
+        if depth == 1 and closed is not None:
+            top[closed] = span
+        elif depth == 2 and in_patches:
+            patches.append({"span": span, "metadata": patch_metadata})
+            patch_metadata = None
+        elif depth == 3 and in_patches and closed == "metadata":
+            patch_metadata = span
+
+    return top, patches
+
+
+class PatchSetIndex:
+    """
+    Index of patches in a patchset file, cached next to the file
+    """
+
+    def __init__(self, patch_file_name):
+        """
+        @param patch_file_name JSON file name of patchset
+        """
+        self.patch_file_name = patch_file_name
+        self.index_file_name = f"{os.path.splitext(patch_file_name)[0]}_index.json"
+        self.index = self._read_index() or self._write_index()
+
+    def _stat(self):
+        """
+        @returns Size and modification time of patchset file
+        """
+        stat = os.stat(self.patch_file_name)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _read_index(self):
+        """
+        @returns Cached index, if present and up to date
+        """
+        try:
+            with open(self.index_file_name, encoding="utf-8") as index_file:
+                index = json.load(index_file)
+        except (OSError, json.decoder.JSONDecodeError):
+            return None
+
+        if index.get("stat") != self._stat():
+            return None
+
+        return index
+
+    def _write_index(self):
+        """
+        @returns Index from scanning patchset, cached if possible
+        """
+        with open(self.patch_file_name, "rb") as patch_file:
+            with mmap.mmap(patch_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                top, spans = scan_patchset(data)
+
+                try:
+                    metadata = json.loads(data[slice(*top["metadata"])])
+                    version = json.loads(data[slice(*top["version"])])
+                except KeyError as e:
+                    raise IOError(f"{self.patch_file_name} is not a patchset") from e
+
+                patches = []
+                for p in spans:
+                    patch_metadata = json.loads(data[slice(*p["metadata"])])
+                    patches.append({"name": patch_metadata["name"],
+                                    "metadata": patch_metadata,
+                                    "span": list(p["span"])})
+
+        index = {"stat": self._stat(), "metadata": metadata,
+                 "version": version, "patches": patches}
+
+        try:
+            with open(self.index_file_name, "w", encoding="utf-8") as index_file:
+                json.dump(index, index_file)
+        except OSError as err:
+            warnings.warn(f"could not cache index of {self.patch_file_name} --- {err}")
+
+        return index
+
+    def __len__(self):
+        """
+        @returns Number of patches
+        """
+        return len(self.index["patches"])
+
+    @property
+    def names(self):
+        """
+        @returns Names of patches
+        """
+        return [p["name"] for p in self.index["patches"]]
+
+    @property
+    def metadata(self):
+        """
+        @returns Metadata of patchset
+        """
+        return self.index["metadata"]
+
+    def read(self, patch_number):
+        """
+        @returns Content of patch without parsing other patches
+        """
+        start, end = self.index["patches"][patch_number]["span"]
+        with open(self.patch_file_name, "rb") as patch_file:
+            patch_file.seek(start)
+            return patch_file.read(end - start)
+
+    def patch(self, patch_number):
+        """
+        @param patch_number Number or name of patch
+        @returns Patch with added metadata from patchset
+        """
+        if isinstance(patch_number, str):
+            patch_number = self.names.index(patch_number)
+
+        patch = pyhf.patchset.Patch(json.loads(self.read(patch_number)))
+        patch._metadata = patch.metadata | self.metadata
+        patch._metadata["version"] = self.index["version"]
+        return patch
+
+
+def select_patches(selection, size):
+    """
+    @param selection Patch numbers e.g., 'all', '3', '1,4,7', '0-9' or '0-9,12'
+    @param size Number of patches in patchset
+    @returns Selected patch numbers
+    """
+    if selection.strip() == "all":
+        return list(range(size))
+
+    numbers = []
+
+    for part in selection.split(","):
+        first, _, last = part.partition("-")
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError as e:
+            raise ValueError(f"could not read patch numbers from '{selection}'") from e
+        numbers += range(first, last + 1)
+
+    out_of_range = [n for n in numbers if not 0 <= n < size]
+
+    if out_of_range:
+        raise ValueError(f"patch numbers {out_of_range} not in patchset of {size} patches")
+
+    return list(dict.fromkeys(numbers))
+
+
+def copy_on_write(spec, path, fresh):
+    """
+    Shallow copy containers along a json pointer such that it may be modified
+
+    @param spec Specification to be modified
+    @param path JSON pointer
+    @param fresh Containers already copied, by id
+    """
+    parent = spec
+
+    for part in jsonpatch.JsonPointer(path).parts[:-1]:
+        key = int(part) if isinstance(parent, list) else part
+        child = parent[key]
+
+        if id(child) not in fresh:
+            child = copy.copy(child)
+            fresh[id(child)] = child
+            parent[key] = child
+
+        parent = child
+
+
+def apply_patch(spec, patch):
+    """
+    Apply a patch, copying only parts of the specification that are modified
+
+    Unmodified parts of the specification are shared with the result.
+
+    @param spec Specification of model
+    @param patch List of json patch operations
+    @returns Patched specification
+    """
+    spec = dict(spec)
+    fresh = {id(spec): spec}
+
+    for operation in patch:
+        for path in [operation.get("from"), operation["path"]]:
+            if path is not None:
+                copy_on_write(spec, path, fresh)
+        spec = jsonpatch.JsonPatch([operation]).apply(spec, in_place=True)
+
+    return spec
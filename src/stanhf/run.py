@@ -4,15 +4,18 @@ Running pyhf and stanhf models
 """
 
 import json
+import time
 import warnings
 
 import numpy as np
 from cmdstanpy import CmdStanModel, install_cmdstan, cmdstan_path
 
-from .pars import get_pyhf_pars
+from .pars import flatten_par, get_pyhf_pars, ParMap
 from .metadata import METADATA
+from .instrument import profiled
 
 
+@profiled()
 def install(progress=True, **kwargs):
     """
     Install Stan if it doesn't exist already
@@ -36,15 +39,73 @@ def run_stanhf_model(pars, data_file_name, exe_file_name):
     return data_frame["lp__"].values[0]
 
 
-def run_pyhf_model(pars, workspace):
+def run_stanhf_model_batch(draws, par_names, data_file_name, exe_file_name, draws_file_name):
+    """
+    Run stanhf model on many points in one launch of Stan
+
+    @param draws Points as dictionaries of parameters
+    @param par_names Names of parameters in order of declaration in Stan program
+    @param draws_file_name File name for Stan csv of points
+    @returns Target at each point
+    """
+    write_draws_file(draws_file_name, draws, par_names)
+    model = CmdStanModel(exe_file=exe_file_name)
+    data_frame = model.log_prob(draws_file_name,
+                                data=data_file_name,
+                                jacobian=False, sig_figs=18)
+    return data_frame["lp__"].values
+
+
+def log_prob_throughput(exe_file_name, data_file_name, draws_file_name):
+    """
+    @returns Number of evaluations of target and its gradient per second,
+             including launching Stan
+    """
+    model = CmdStanModel(exe_file=exe_file_name)
+    start = time.perf_counter()
+    data_frame = model.log_prob(draws_file_name, data=data_file_name)
+    return len(data_frame) / (time.perf_counter() - start)
+
+
+def run_pyhf_model(pars, workspace, measurement=None):
     """
     Run pyhf model on a particular point
     """
-    model = workspace.model(poi_name=None)
+    model = workspace.model(measurement_name=measurement, poi_name=None)
     data = workspace.data(model)
     return model.logpdf(get_pyhf_pars(pars, model), data)[0]
 
 
+def run_pyhf_model_batch(draws, workspace, measurement=None):
+    """
+    Run pyhf model on many points, building model once
+
+    @param draws Points as dictionaries of parameters
+    @returns Target at each point
+    """
+    model = workspace.model(measurement_name=measurement, poi_name=None, batch_size=len(draws))
+    data = workspace.data(model)
+    columns = [c for p in draws[0] for c in flatten_par(p, draws[0][p])[0]]
+    rows = [[v for p in draws[0] for v in flatten_par(p, d[p])[1]] for d in draws]
+    pars = ParMap(columns, model).to_pyhf(rows)
+    return np.asarray(model.logpdf(pars, data))
+
+
+def summarize_discrepancies(stanhf_target, pyhf_target):
+    """
+    Compare targets up to a constant, taking the first point as reference
+
+    @returns Discrepancy at each point and summary of their magnitudes
+    """
+    discrepancy = (stanhf_target - stanhf_target[0]) - (pyhf_target - pyhf_target[0])
+    magnitude = np.abs(discrepancy)
+    summary = {"points": len(discrepancy),
+               "max": float(magnitude.max()),
+               "mean": float(magnitude.mean()),
+               "quantiles": {str(q): float(np.quantile(magnitude, q)) for q in (0.5, 0.9, 0.99)}}
+    return discrepancy, summary
+
+
 def perturb(param, scale=0.01, rng=None):
     """
     @param param Parameter to be perturbed
@@ -64,3 +125,20 @@ def perturb_param_file(param_file_name, rng=None):
     with open(param_file_name, encoding="utf-8") as param_file:
         pars = json.load(param_file)
     return {k: perturb(pars[k], rng=rng) for k in pars if k != METADATA}
+
+
+def write_draws_file(file_name, draws, par_names):
+    """
+    Write points as Stan csv of constrained draws
+
+    @param draws Points as dictionaries of parameters
+    @param par_names Names of parameters in order of declaration in Stan program
+    @returns File name of Stan csv
+    """
+    with open(file_name, "w", encoding="utf-8") as draws_file:
+        header = [c for p in par_names for c in flatten_par(p, draws[0][p])[0]]
+        draws_file.write(",".join(header) + "\n")
+        for d in draws:
+            row = [v for p in par_names for v in flatten_par(p, d[p])[1]]
+            draws_file.write(",".join(repr(v) for v in row) + "\n")
+    return file_name
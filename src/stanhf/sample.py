@@ -47,7 +47,7 @@ class Sample(Stan):
                 "modifiers", [])]
 
         names = [m.name for m in modifiers]
-        repeated = set(n for n in names if names.count(n) > 1)
+        repeated = list(dict.fromkeys(n for n in names if names.count(n) > 1))
 
         if repeated:
             warnings.warn(
@@ -4,9 +4,13 @@ Manipulate and parse strings and data
 """
 
 import json
+import re
 import warnings
 
 
+COMMENT = re.compile(r'("(?:[^"\\]|\\.)*")|//[^\n]*|/\*.*?\*/', re.DOTALL)
+
+
 def join(*name):
     """
     @returns Snake-case convention for Stan variables
@@ -47,6 +51,15 @@ def block(name, data):
     return f"{name}" + "{\n" + data + "\n}"
 
 
+def normalize_stan(program):
+    """
+    @returns Stan program without comments, blank lines or redundant whitespace
+    """
+    program = COMMENT.sub(lambda m: m.group(1) or "", program)
+    lines = (" ".join(line.split()) for line in program.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
 def flatten(list_):
     """
     @returns Flattened list
@@ -62,14 +75,56 @@ def flatten(list_):
     return flat
 
 
-def format_json_file(file_name):
+def to_stan_json(value):
+    """
+    @returns Value converted to the json conventions of cmdstan
+    """
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, tuple):
+        return {str(i): to_stan_json(v) for i, v in enumerate(value, 1)}
+    if isinstance(value, dict):
+        return {k: to_stan_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [to_stan_json(v) for v in value]
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return value
+
+
+def iter_json(entries, indent=None):
+    """
+    @param entries Iterable of key and value pairs
+    @param indent Indentation for pretty-printing or None for compact output
+    @returns Chunks of json object written one entry at a time
     """
-    @param file_name JSON file to be formatted by indenting and sorting keys
+    if indent is None:
+        sep, start, end, nested = ", ", "{", "}", ""
+    else:
+        pad = " " * indent
+        sep, start, end, nested = ",\n" + pad, "{\n" + pad, "\n}", "\n" + pad
+
+    first = True
+
+    for key, value in entries:
+        value = json.dumps(to_stan_json(value), indent=indent, sort_keys=True)
+        yield (start if first else sep) + json.dumps(key) + ": " + value.replace("\n", nested)
+        first = False
+
+    yield "{}" if first else end
+
+
+def write_json_file(file_name, entries, indent=None):
+    """
+    Write json object to a file in a single pass
+
+    @param file_name JSON file to be written
+    @param entries Iterable of key and value pairs
+    @param indent Indentation for pretty-printing or None for compact output
     """
-    with open(file_name, encoding="utf-8") as json_file:
-        data = json.load(json_file)
     with open(file_name, "w", encoding="utf-8") as json_file:
-        json.dump(data, json_file, indent=4, sort_keys=True)
+        for chunk in iter_json(entries, indent):
+            json_file.write(chunk)
 
 
 def read_par_bound(bound, size):
@@ -0,0 +1,63 @@
+"""
+Extract a subset of a model
+===========================
+
+Channels, samples, modifiers and modifier types are included or excluded by
+name or shell-style pattern. The rest of the model is pruned before it is
+converted, such that parameters that become unused are not declared.
+"""
+
+from fnmatch import fnmatchcase
+
+
+KINDS = ["channels", "samples", "modifiers", "modifier_types"]
+
+
+def is_selected(name, include=None, exclude=None):
+    """
+    @param include Patterns of names to include, or None to include all
+    @param exclude Patterns of names to exclude
+    @returns Whether name is included and not excluded
+    """
+    if include and not any(fnmatchcase(name, p) for p in include):
+        return False
+    return not any(fnmatchcase(name, p) for p in exclude or [])
+
+
+def find_pruned(workspace, include=None, exclude=None):
+    """
+    @param workspace pyhf workspace
+    @param include Dictionary of kinds of component and patterns of names to include
+    @param exclude Dictionary of kinds of component and patterns of names to exclude
+    @returns Dictionary of kinds of component and names to prune
+    """
+    include = include or {}
+    exclude = exclude or {}
+
+    names = {"channels": workspace.channels,
+             "samples": workspace.samples,
+             "modifiers": list(dict.fromkeys(n for n, _ in workspace.modifiers)),
+             "modifier_types": list(dict.fromkeys(t for _, t in workspace.modifiers))}
+
+    unknown = (include.keys() | exclude.keys()) - set(KINDS)
+
+    if unknown:
+        raise ValueError(f"cannot select {', '.join(unknown)}; choose from {', '.join(KINDS)}")
+
+    return {k: [n for n in names[k] if not is_selected(n, include.get(k), exclude.get(k))]
+            for k in KINDS}
+
+
+def prune(workspace, include=None, exclude=None):
+    """
+    @returns Workspace with components not selected removed
+    """
+    pruned = find_pruned(workspace, include, exclude)
+
+    if not any(pruned.values()):
+        return workspace
+
+    if len(pruned["channels"]) == len(workspace.channels):
+        raise ValueError("no channels selected")
+
+    return workspace.prune(**{k: v or None for k, v in pruned.items()})
@@ -0,0 +1,137 @@
+"""
+Test asynchronous jobs
+======================
+"""
+
+import asyncio
+import os
+import shutil
+import sys
+
+import pytest
+
+from stanhf import Convert
+from stanhf.aio import AsyncModel, abuild_stan_file, run_process
+from stanhf.build import exe_file_name, is_outdated, record_options
+from stanhf.cache import ExecutableCache
+
+
+CWD = os.path.dirname(os.path.realpath(__file__))
+EXAMPLE = os.path.normpath(os.path.join(CWD, "..", "examples", "normfactor.json"))
+ITERATIONS = "for i in range(1, 3): print(f'Iteration: {i} / 2')"
+
+
+def test_run_process():
+    """
+    Stream progress and limit concurrent jobs
+    """
+    events = []
+    running = []
+
+    def progress(event):
+        if event["event"] == "start":
+            running.append(sum(e["event"] == "start" for e in events) - sum(e["event"] == "done" for e in events))
+        events.append(event)
+
+    async def main():
+        limit = asyncio.Semaphore(2)
+        cmd = [sys.executable, "-c", ITERATIONS]
+        return await asyncio.gather(*[run_process(cmd, f"job {n}", progress, limit) for n in range(4)])
+
+    outputs = asyncio.run(main())
+
+    assert all(o.splitlines()[-1] == "Iteration: 2 / 2" for o in outputs)
+    assert max(running) < 2
+    assert [e["done"] for e in events if e["event"] == "progress" and e["job"] == "job 0"] == [1, 2]
+
+
+def test_run_process_error():
+    """
+    Failed jobs raise
+    """
+    with pytest.raises(RuntimeError, match="return code 3"):
+        asyncio.run(run_process([sys.executable, "-c", "exit(3)"], "fail"))
+
+
+def test_run_process_cancel():
+    """
+    Cancelled jobs terminate their subprocess
+    """
+    events = []
+
+    async def main():
+        cmd = [sys.executable, "-c", "import time; print('started', flush=True); time.sleep(60)"]
+        task = asyncio.create_task(run_process(cmd, "sleep", events.append))
+        while not any(e["event"] == "output" for e in events):
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(asyncio.wait_for(main(), 30))
+
+    assert events[-1]["event"] == "cancelled"
+
+
+def test_abuild(tmp_path):
+    """
+    Build and run model asynchronously
+    """
+    convert = Convert(shutil.copy(EXAMPLE, tmp_path))
+
+    async def main():
+        exe = await convert.abuild()
+        model = AsyncModel(exe)
+        data = convert.data_card(metadata=False)
+        return await asyncio.gather(model.asample(data, chains=2, seed=1, num_samples=10, num_warmup=10),
+                                    model.alog_prob(convert.init_card(metadata=False), data))
+
+    fit, log_prob = asyncio.run(main())
+
+    assert fit.chains == 2
+    assert len(log_prob) == 1
+
+
+def test_temporary_output(tmp_path, monkeypatch):
+    """
+    Temporary directories of evaluations and of failed runs are removed
+    """
+    exe = tmp_path / "model"
+    exe.write_text(f"#!{sys.executable}\n"
+                   "import sys\n"
+                   "if sys.argv[1] != 'log_prob': sys.exit(1)\n"
+                   "open(sys.argv[-1][len('file='):], 'w').write('lp__,g\\n0,1\\n')\n")
+    exe.chmod(0o755)
+    os.makedirs(tmp_path / "tmp")
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path / "tmp"))
+    model = AsyncModel(exe)
+
+    log_prob = asyncio.run(model.alog_prob({"x": 1.}))
+    assert len(log_prob) == 1
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(model.asample({"n": 1}))
+
+    assert not os.listdir(tmp_path / "tmp")
+
+
+def test_abuild_cached(tmp_path):
+    """
+    Executables are reused as for compile_cached, recording options of copies from cache
+    """
+    stan_file_name = tmp_path / "model.stan"
+    stan_file_name.write_text("")
+    exe = exe_file_name(stan_file_name)
+    with open(exe, "w", encoding="utf-8") as f:
+        f.write("")
+    os.utime(stan_file_name, (0, 0))
+    record_options(stan_file_name, {})
+
+    assert asyncio.run(abuild_stan_file(stan_file_name)) == exe
+
+    options = {"cpp_options": {"O": "0"}}
+    exe_cache = ExecutableCache(tmp_path / "cache")
+    exe_cache.store(exe_cache.key("", options), exe)
+    assert is_outdated(stan_file_name, options)
+    asyncio.run(abuild_stan_file(stan_file_name, exe_cache=exe_cache, **options))
+    assert not is_outdated(stan_file_name, options)
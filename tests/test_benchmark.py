@@ -0,0 +1,80 @@
+"""
+Test benchmarks
+===============
+"""
+
+from click.testing import CliRunner
+
+from stanhf.cli import benchmark_cli
+from stanhf.contrib.benchmark import compare_results, format_comparison, read_results, run_benchmarks, write_results
+
+
+def results(convert_time, ess_per_second):
+    """
+    @returns Results of benchmarks with given measurements
+    """
+    return {"metadata": {}, "results": {"small": {"par_size": [10, 0, 0], "convert_time": convert_time,
+                                                  "ess_per_second": ess_per_second}}}
+
+
+def test_run(tmp_path):
+    """
+    Benchmark conversion and write results
+    """
+    benchmarks = run_benchmarks(["small"], label="test", stages=["convert"], repeat=1)
+    result = benchmarks["results"]["small"]
+
+    assert benchmarks["metadata"]["label"] == "test"
+    assert result["convert_time"] > 0
+    assert result["convert_peak_memory"] > 0
+    assert "compile_time" not in result
+
+    write_results(tmp_path / "results.json", benchmarks)
+    assert read_results(tmp_path / "results.json") == benchmarks
+
+
+def test_compare():
+    """
+    Slower conversion and fewer effective samples per second are regressions
+    """
+    base = results(1., 100.)
+
+    comparison = compare_results(base, results(1.1, 95.))
+    assert len(comparison) == 2
+    assert not any(c["regression"] for c in comparison)
+
+    comparison = {c["metric"]: c for c in compare_results(base, results(2., 50.))}
+    assert comparison["convert_time"]["regression"]
+    assert comparison["ess_per_second"]["regression"]
+
+    comparison = compare_results(base, results(0.5, 200.))
+    assert not any(c["regression"] for c in comparison)
+    assert "REGRESSION" not in format_comparison(comparison)
+
+    untimed = results(1., 100.)
+    untimed["results"]["small"]["compile_time"] = None
+    base["results"]["small"]["compile_time"] = 10.
+    assert "compile_time" not in {c["metric"] for c in compare_results(base, untimed)}
+
+
+def test_benchmark_cli(tmp_path):
+    """
+    Run and compare benchmarks from command line
+    """
+    runner = CliRunner()
+    base = tmp_path / "base.json"
+    result = runner.invoke(benchmark_cli, ["run", str(base), "--size", "small", "--stage", "convert",
+                                           "--repeat", "1"])
+    assert result.exit_code == 0
+
+    result = runner.invoke(benchmark_cli, ["compare", str(base), str(base)])
+    assert result.exit_code == 0
+
+    head = tmp_path / "head.json"
+    slow = read_results(base)
+    slow["results"]["small"]["convert_time"] *= 10
+    write_results(head, slow)
+
+    result = runner.invoke(benchmark_cli, ["compare", str(base), str(head)])
+    assert result.exit_code == 1
+    assert "REGRESSION" in result.output
@@ -0,0 +1,191 @@
+"""
+Test building many Stan programs
+================================
+"""
+
+import os
+import shutil
+
+import pytest
+
+from stanhf import Convert
+from stanhf.build import (BuildScheduler, build_many, compare_profiles, compile_cached, exe_file_name, is_outdated, is_stale,
+                          profile_options, PROFILES)
+from stanhf.cache import ExecutableCache
+
+
+CWD = os.path.dirname(os.path.realpath(__file__))
+EXAMPLES = [os.path.normpath(os.path.join(CWD, "..", "examples", f"{e}.json"))
+            for e in ["normfactor", "normsys"]]
+
+
+def test_build_many(tmp_path):
+    """
+    Build distinct and identical programs concurrently
+    """
+    stan_file_names = [Convert(shutil.copy(e, tmp_path)).write_stan_file() for e in EXAMPLES]
+    duplicate = shutil.copy(stan_file_names[0], tmp_path / "duplicate.stan")
+
+    reports = build_many(stan_file_names + [str(duplicate)], jobs=2)
+
+    assert all(r["error"] is None for r in reports)
+    assert reports[2]["duplicate_of"] == stan_file_names[0]
+    assert all(os.path.isfile(r["exe"]) for r in reports)
+
+
+def test_copy_duplicate(tmp_path):
+    """
+    Failure to copy an executable of an identical program is recorded in its report
+    """
+    report = {"stan": str(tmp_path / "a.stan"), "exe": str(tmp_path / "missing"), "time": 1.,
+              "error": None, "duplicate_of": None}
+    duplicate = BuildScheduler()._copy(report, str(tmp_path / "b.stan"))
+
+    assert duplicate["exe"] is None
+    assert duplicate["error"] is not None
+    assert duplicate["duplicate_of"] == report["stan"]
+    assert not os.listdir(tmp_path)
+
+
+def test_profile_options():
+    """
+    Options for each build profile are copies
+    """
+    options = profile_options("max-performance")
+    options["cpp_options"]["O"] = "0"
+    assert PROFILES["max-performance"]["cpp_options"]["O"] == "3"
+    assert profile_options() == {}
+
+    with pytest.raises(ValueError):
+        profile_options("unknown")
+
+
+def test_exe_cache(tmp_path):
+    """
+    Identical programs in different directories share one executable
+    """
+    exe_cache = ExecutableCache(tmp_path / "cache")
+    a = Convert(shutil.copy(EXAMPLES[0], tmp_path)).write_stan_file()
+    os.makedirs(tmp_path / "b")
+    b = shutil.copy(a, tmp_path / "b" / "model.stan")
+
+    exe = [compile_cached(f, exe_cache) for f in [a, b]]
+
+    assert len(exe_cache.entries()) == 1
+    assert all(os.path.isfile(e) for e in exe)
+
+
+def test_exe_cache_store(tmp_path, monkeypatch):
+    """
+    Executables that are not cached are used in place
+    """
+    exe = tmp_path / "model"
+    exe.write_text("exe")
+    exe_cache = ExecutableCache(tmp_path / "cache")
+
+    assert os.path.dirname(exe_cache.store("a", exe)) == exe_cache.path("a")
+
+    monkeypatch.setattr(exe_cache, "put", lambda *args, **kwargs: None)
+    assert exe_cache.store("b", exe) == exe
+
+
+def test_is_stale(tmp_path):
+    """
+    Executables are stale if absent or older than their programs
+    """
+    stan_file_name = tmp_path / "model.stan"
+    stan_file_name.write_text("")
+    assert is_stale(stan_file_name)
+
+    exe = exe_file_name(stan_file_name)
+    with open(exe, "w", encoding="utf-8") as f:
+        f.write("")
+    os.utime(stan_file_name, (0, 0))
+    assert not is_stale(stan_file_name)
+
+    os.utime(exe, (0, 0))
+    os.utime(stan_file_name)
+    assert is_stale(stan_file_name)
+
+
+def test_exe_cache_key():
+    """
+    Programs differing only in comments and whitespace share a key
+    """
+    program = "data {\n  int n;\n}"
+    assert ExecutableCache.key(program) == ExecutableCache.key(f"// header\n{program} // comment\n\n")
+    assert ExecutableCache.key(program) != ExecutableCache.key(program, profile_options("fast-compile"))
+
+
+def fake_compile(calls):
+    """
+    @returns Function recording options and writing an empty executable in place of compiling
+    """
+    def compile_stan_file(stan_file_name, force=False, **kwargs):
+        calls.append(dict(kwargs, force=force))
+        exe = exe_file_name(stan_file_name)
+        if force or not os.path.isfile(exe):
+            with open(exe, "w", encoding="utf-8") as f:
+                f.write(str(kwargs))
+        return exe
+    return compile_stan_file
+
+
+def test_exe_cache_miss(tmp_path, monkeypatch):
+    """
+    Executables present are rebuilt before storing under options that missed the cache
+    """
+    calls = []
+    monkeypatch.setattr("stanhf.build.compile_stan_file", fake_compile(calls))
+    exe_cache = ExecutableCache(tmp_path / "cache")
+    stan_file_name = tmp_path / "model.stan"
+    stan_file_name.write_text("")
+
+    compile_cached(stan_file_name, exe_cache)
+    options = profile_options("fast-compile")
+    compile_cached(stan_file_name, exe_cache, **options)
+
+    assert all(c["force"] for c in calls)
+    with open(exe_cache.load(exe_cache.key("", options)), encoding="utf-8") as f:
+        assert f.read() == str(options)
+
+
+def test_profile_rebuild(tmp_path, monkeypatch):
+    """
+    Executables present are rebuilt if built under other options
+    """
+    calls = []
+    monkeypatch.setattr("stanhf.build.compile_stan_file", fake_compile(calls))
+    stan_file_name = tmp_path / "model.stan"
+    stan_file_name.write_text("")
+    options = profile_options("fast-compile")
+
+    compile_cached(stan_file_name)
+    assert not is_outdated(stan_file_name, {})
+    assert is_outdated(stan_file_name, options)
+
+    exe = compile_cached(stan_file_name, **options)
+    compile_cached(stan_file_name, **options)
+
+    assert [c["force"] for c in calls] == [True, True, False]
+    with open(exe, encoding="utf-8") as f:
+        assert f.read() == str(options)
+
+
+def test_compare_profiles(tmp_path, monkeypatch):
+    """
+    Executables of profiles are kept only in a directory given
+    """
+    monkeypatch.setattr("stanhf.build.compile_stan_file", fake_compile([]))
+    monkeypatch.setattr("stanhf.build.log_prob_throughput", lambda *args: 1.)
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path / "tmp"))
+    os.makedirs(tmp_path / "tmp")
+    stan_file_name = tmp_path / "model.stan"
+    stan_file_name.write_text("")
+
+    reports = compare_profiles(stan_file_name, None, None, ["default", "fast-compile"])
+    assert all(r["exe"] is None for r in reports)
+    assert not os.listdir(tmp_path / "tmp")
+
+    reports = compare_profiles(stan_file_name, None, None, ["default"], directory=tmp_path / "keep")
+    assert os.path.isfile(reports[0]["exe"])
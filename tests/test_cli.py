@@ -3,9 +3,14 @@ Test stanhf CLI
 ===============
 """
 
+import json
 import os
+import shutil
 
 from click.testing import CliRunner
+
+import stanhf.batch
+from stanhf.batch import process_model
 from stanhf.cli import cli
 
 
@@ -16,4 +21,53 @@ EXAMPLE = os.path.normpath(os.path.join(CWD, "..", "examples", "test.json"))
 def test_cli():
   runner = CliRunner()
   result = runner.invoke(cli, [EXAMPLE])
-  assert result.exit_code == 0
\ No newline at end of file
+  assert result.exit_code == 0
+
+
+def test_cli_many(tmp_path):
+  for e in ["normfactor", "normsys", "patchset"]:
+    shutil.copy(os.path.join(CWD, "..", "examples", f"{e}.json"), tmp_path)
+  summary = tmp_path / "summary.json"
+  runner = CliRunner()
+  result = runner.invoke(cli, [str(tmp_path), "--no-build", "--no-validate-par-names",
+                               "--workers", "2", "--summary", str(summary)])
+  assert result.exit_code == 0
+
+  with open(summary, encoding="utf-8") as f:
+    models = {os.path.basename(m["hf"]): m for m in json.load(f)["models"]}
+  assert models["patchset.json"]["status"] == "skipped"
+  assert models["normfactor.json"]["status"] == "ok"
+  assert models["normfactor.json"]["model_size"][0] == 1
+
+
+def crash(hf_file_name, **kwargs):
+  if hf_file_name.endswith("normsys.json"):
+    os._exit(1)
+  return process_model(hf_file_name, **kwargs)
+
+
+def test_cli_many_crash(tmp_path, monkeypatch):
+  for e in ["normfactor", "normsys"]:
+    shutil.copy(os.path.join(CWD, "..", "examples", f"{e}.json"), tmp_path)
+  summary = tmp_path / "summary.json"
+  monkeypatch.setattr(stanhf.batch, "process_model", crash)
+  runner = CliRunner()
+  result = runner.invoke(cli, [str(tmp_path), "--no-build", "--no-validate-par-names",
+                               "--summary", str(summary)])
+  assert result.exit_code == 1
+
+  with open(summary, encoding="utf-8") as f:
+    models = {os.path.basename(m["hf"]): m for m in json.load(f)["models"]}
+  assert models["normsys.json"]["status"] == "failed"
+  assert models["normsys.json"]["stage"] == "worker"
+
+
+def test_cli_patchset_manifest(tmp_path):
+  hf_file_name = shutil.copy(os.path.join(CWD, "..", "examples", "normfactor.json"), tmp_path)
+  patch_file_name = os.path.join(CWD, "..", "examples", "patchset.json")
+  runner = CliRunner()
+  runner.invoke(cli, [hf_file_name, "--patch", patch_file_name, "0-1", "--no-build"])
+
+  with open(tmp_path / "normfactor_manifest.json", encoding="utf-8") as f:
+    manifest = json.load(f)
+  assert all(os.path.isfile(m["data"]) for m in manifest.values())
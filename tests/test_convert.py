@@ -3,16 +3,28 @@ Test elements of converter from hf to Stan
 ==========================================
 """
 
+import copy
+import gc
+import json
 import os
 import re
+import shutil
+import subprocess
+import sys
+import warnings
 
 import pytest
+from cmdstanpy import write_stan_json
 
 from stanhf import Convert
+from stanhf.cache import ModelCache
+from stanhf.emit import METHODS
 
 
 CWD = os.path.dirname(os.path.realpath(__file__))
 EXAMPLE = os.path.normpath(os.path.join(CWD, "..", "examples", "test.json"))
+NORMFACTOR = os.path.normpath(os.path.join(CWD, "..", "examples", "normfactor.json"))
+SRC = os.path.normpath(os.path.join(CWD, "..", "src"))
 
 CON = Convert(EXAMPLE)
 BLOCKS = ["functions_block", "data_block",
@@ -64,6 +76,218 @@ def test_attribute(block):
     assert call(block) == expected
 
 
+@pytest.mark.parametrize("indent", [None, 4])
+def test_write_data_card(tmp_path, indent):
+    """
+    Test whether streamed data card agrees with data card written by cmdstanpy
+    """
+    expected_file_name = tmp_path / "expected.json"
+    write_stan_json(expected_file_name, CON.data_card())
+    file_name = CON.write_stan_data_file(tmp_path / "data.json", indent=indent)
+
+    with open(expected_file_name, encoding="utf-8") as expected_file:
+        expected = json.load(expected_file)
+    with open(file_name, encoding="utf-8") as data_file:
+        assert json.load(data_file) == expected
+
+
+def test_from_dict():
+    """
+    Test whether in-memory conversion agrees with conversion from disk
+    """
+    with open(EXAMPLE, encoding="utf-8") as hf_file:
+        convert = Convert.from_dict(json.load(hf_file))
+
+    program, data, init = convert.to_memory()
+
+    assert program.split("\n", 1)[1] == CON.to_stan().split("\n", 1)[1]
+    assert data == CON.data_card(metadata=False)
+    assert init == CON.init_card(metadata=False)
+
+
+def test_from_dict_directory(tmp_path):
+    """
+    Test whether files of in-memory conversions are removed with the converter unless a directory is given
+    """
+    with open(EXAMPLE, encoding="utf-8") as hf_file:
+        hf = json.load(hf_file)
+
+    convert = Convert.from_dict(hf)
+    directory = os.path.dirname(convert.write_stan_data_file())
+    assert os.path.isdir(directory)
+
+    del convert
+    gc.collect()
+    assert not os.path.exists(directory)
+
+    convert = Convert.from_dict(hf, directory=tmp_path / "out")
+    data_file_name = convert.write_stan_data_file()
+    del convert
+    gc.collect()
+    assert os.path.isfile(data_file_name)
+
+
+def test_cache(tmp_path):
+    """
+    Test whether cached conversion agrees with conversion and skips parsing
+    """
+    cache = ModelCache(tmp_path)
+    cold = Convert(EXAMPLE, cache=cache)
+    assert cold.to_stan() == CON.to_stan()
+
+    warm = Convert(EXAMPLE, cache=cache)
+    assert str(warm) == str(CON)
+    assert warm.to_stan() == CON.to_stan()
+    assert warm.init_card() == CON.init_card()
+    assert "_hf" not in warm.__dict__
+
+
+def test_fragments():
+    """
+    Test whether emission by channel agrees with sequential emission
+    """
+    convert = Convert(EXAMPLE)
+    assert all(convert._fragments[m] == [getattr(e, m)() for e in convert._data] for m in METHODS)
+
+
+def test_structure(tmp_path):
+    """
+    Test whether Stan program is not rewritten if only numbers in model change
+    """
+    hf_file_name = shutil.copy(EXAMPLE, tmp_path)
+    stan_file_name = Convert(hf_file_name).write_stan_file(lint=False)
+    mtime = os.path.getmtime(stan_file_name)
+
+    with open(hf_file_name, encoding="utf-8") as hf_file:
+        hf = json.load(hf_file)
+
+    hf["channels"][0]["samples"][0]["data"][0] += 1.
+
+    with open(hf_file_name, "w", encoding="utf-8") as hf_file:
+        json.dump(hf, hf_file)
+
+    os.utime(hf_file_name, (mtime + 1., mtime + 1.))
+
+    with pytest.warns(UserWarning, match="structure of model unchanged"):
+        Convert(hf_file_name).write_stan_file(lint=False)
+
+    assert os.path.getmtime(stan_file_name) == mtime
+
+    hf["channels"][0]["samples"][0]["modifiers"].pop()
+    assert Convert.from_dict(hf).structure_hash != CON.structure_hash
+
+
+def test_deterministic():
+    """
+    Test whether Stan program is independent of hash seed
+    """
+    code = f"from stanhf import Convert; print(Convert({EXAMPLE!r}).to_stan())"
+    programs = [subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                               env=dict(os.environ, PYTHONHASHSEED=str(seed), PYTHONPATH=SRC)).stdout
+                for seed in range(3)]
+    assert programs[0] == programs[1] == programs[2]
+
+
+def test_select_measurement():
+    """
+    Test whether measurements share a Stan program and differ in data
+    """
+    with open(EXAMPLE, encoding="utf-8") as hf_file:
+        hf = json.load(hf_file)
+
+    measurement = copy.deepcopy(hf["measurements"][0])
+    measurement["name"] = "fixed_lumi"
+    measurement["config"]["poi"] = "k_normfactor"
+    measurement["config"]["parameters"][0]["fixed"] = True
+    hf["measurements"].append(measurement)
+
+    convert = Convert.from_dict(hf)
+    fixed = convert.select_measurement("fixed_lumi")
+
+    assert fixed.to_stan() == convert.to_stan()
+    assert fixed.structure_hash == convert.structure_hash
+    assert fixed.data_card()["fix_lumi"] and not convert.data_card()["fix_lumi"]
+    assert fixed.data_card()["_poi"] == "k_normfactor"
+    assert fixed.init_card()["free_lumi"] == []
+    assert fixed.par_names[1] == ["lumi"]
+
+    with pytest.raises(ValueError):
+        convert.select_measurement("unknown").data_card()
+
+
+def test_subset(tmp_path):
+    """
+    Test whether subset of model is pruned of unused parameters and cached separately
+    """
+    cache = ModelCache(tmp_path)
+    subset = Convert(EXAMPLE, cache=cache, include={"channels": ["single*"]},
+                     exclude={"modifier_types": ["shapesys"]})
+
+    assert subset.model_size[0] == 1
+    assert "m_staterror" not in subset.par_names[0]
+    assert "k_shapesys" not in subset.par_names[0]
+    assert subset.structure_hash != Convert(EXAMPLE, cache=cache).structure_hash
+
+    with pytest.raises(ValueError):
+        Convert(EXAMPLE, exclude={"channels": ["*"]}).to_stan()
+
+
+def test_combine(tmp_path):
+    """
+    Test whether combined model shares parameters and keeps identical channels once
+    """
+    with open(NORMFACTOR, encoding="utf-8") as hf_file:
+        hf = json.load(hf_file)
+
+    hf["channels"][0]["name"] = hf["observations"][0]["name"] = "other"
+    other = tmp_path / "other.json"
+
+    with open(other, "w", encoding="utf-8") as hf_file:
+        json.dump(hf, hf_file)
+
+    combined = Convert.combine([NORMFACTOR, other, NORMFACTOR])
+    assert combined.model_size[0] == 2
+    assert combined.par_names == [["mu"], [], []]
+
+    uncorrelated = Convert.combine([NORMFACTOR, other], [None, {"mu": "nu"}])
+    assert uncorrelated.par_names[0] == ["mu", "nu"]
+
+
+def test_combine_same():
+    """
+    Test whether a workspace combined with itself under a correlation map is kept once
+    """
+    correlations = [{"k_normsys": "k_normsys_2015"}] * 2
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        combined = Convert.combine([EXAMPLE, EXAMPLE], correlations)
+        assert combined.model_size == Convert(EXAMPLE).model_size
+
+    assert not any("differs" in str(w.message) for w in caught)
+    assert "k_normsys_2015" in combined.par_names[0]
+
+
+def test_combine_clash(tmp_path):
+    """
+    Test whether per-channel modifiers of a channel renamed as it clashes are renamed too
+    """
+    with open(EXAMPLE, encoding="utf-8") as hf_file:
+        hf = json.load(hf_file)
+
+    hf["observations"][0]["data"] = [d + 1 for d in hf["observations"][0]["data"]]
+    other = tmp_path / "other.json"
+
+    with open(other, "w", encoding="utf-8") as hf_file:
+        json.dump(hf, hf_file)
+
+    with pytest.warns(UserWarning, match="differs between workspaces"):
+        combined = Convert.combine([EXAMPLE, other])
+
+    assert combined.model_size[0] == Convert(EXAMPLE).model_size[0] + 1
+    combined.to_stan()
+
+
 if __name__ == "__main__":
     for b in BLOCKS:
         write_expected(b)
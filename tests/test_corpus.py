@@ -0,0 +1,77 @@
+"""
+Test running a corpus of models
+===============================
+"""
+
+import json
+import os
+
+from click.testing import CliRunner
+
+from stanhf.cli import corpus_cli
+from stanhf.contrib.corpus import Corpus, format_table, run_corpus
+
+
+CWD = os.path.dirname(os.path.realpath(__file__))
+EXAMPLES = os.path.normpath(os.path.join(CWD, "..", "examples"))
+
+
+def make_corpus(directory):
+    """
+    @returns Corpus of examples
+    """
+    corpus = Corpus(directory)
+    corpus.add("normsys", os.path.join(EXAMPLES, "normsys.json"))
+    corpus.add("normfactor_patch", os.path.join(EXAMPLES, "normfactor.json"),
+               os.path.join(EXAMPLES, "patchset.json"), patch=0)
+    return corpus
+
+
+def test_corpus(tmp_path):
+    """
+    Run every entry in corpus from local files only
+    """
+    make_corpus(tmp_path)
+    corpus = Corpus(tmp_path)
+
+    assert len(corpus) == 2
+    assert not any(corpus.verify(n) for n in corpus.entries)
+
+    reports = {r["name"]: r for r in run_corpus(corpus, workers=2, build=False, validate_par_names=False)}
+
+    assert all(r["status"] == "ok" for r in reports.values())
+    assert "mass_100" in reports["normfactor_patch"]["files"]["data"]
+    assert "normsys" in format_table(reports.values())
+
+
+def test_corpus_verify(tmp_path):
+    """
+    Entries with changed files fail
+    """
+    corpus = make_corpus(tmp_path)
+
+    with open(corpus.path("normsys"), "a", encoding="utf-8") as f:
+        f.write(" ")
+
+    assert corpus.verify("normsys")
+
+    reports = {r["name"]: r for r in run_corpus(corpus, build=False, validate_par_names=False)}
+    assert reports["normsys"]["stage"] == "verify"
+    assert reports["normfactor_patch"]["status"] == "ok"
+
+
+def test_corpus_cli(tmp_path):
+    """
+    Add to and run corpus from command line
+    """
+    runner = CliRunner()
+    result = runner.invoke(corpus_cli, ["add", str(tmp_path), "normsys", os.path.join(EXAMPLES, "normsys.json")])
+    assert result.exit_code == 0
+
+    summary = tmp_path / "summary.json"
+    result = runner.invoke(corpus_cli, ["run", str(tmp_path), "--no-build", "--no-validate-par-names",
+                                        "--summary", str(summary)])
+    assert result.exit_code == 0
+
+    with open(summary, encoding="utf-8") as f:
+        assert json.load(f)["models"][0]["name"] == "normsys"
@@ -0,0 +1,90 @@
+"""
+Test NumPy evaluation of models
+===============================
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from stanhf import Convert
+from stanhf.contrib.generate import generate_workspace
+from stanhf.pars import get_stan_par_names
+from stanhf.run import perturb, run_pyhf_model_batch, run_stanhf_model_batch
+
+
+CWD = os.path.dirname(os.path.realpath(__file__))
+EXAMPLES = [os.path.normpath(os.path.join(CWD, "..", "examples", f"{e}.json"))
+            for e in ["normfactor", "normsys", "test", "tweak"]]
+RNG = np.random.default_rng(111)
+
+
+def draws(convert, n=10):
+    """
+    @returns Points around initial values
+    """
+    init = convert.init_card(metadata=False)
+    return [{k: perturb(v, rng=RNG) for k, v in init.items()} for _ in range(n)]
+
+
+@pytest.mark.parametrize("example", EXAMPLES)
+def test_pyhf(example):
+    """
+    Log-likelihood agrees with pyhf up to a constant
+    """
+    convert = Convert(example)
+    model = convert.numpy_model()
+    points = draws(convert)
+
+    log_likelihood = model.log_likelihood(model.to_theta(points))
+    pyhf_target = run_pyhf_model_batch(points, convert._workspace)
+    assert np.allclose(log_likelihood - log_likelihood[0], pyhf_target - pyhf_target[0])
+
+
+def test_pyhf_null():
+    """
+    Log-likelihood agrees with pyhf up to a constant if parameters of only null modifiers are ignored
+    """
+    spec = generate_workspace(channels=2, bins=3, samples=2, normsys=4, histosys=2, null=0.5, seed=1)
+    convert = Convert.from_dict(spec)
+    model = convert.numpy_model()
+    points = draws(convert)
+
+    log_likelihood = model.log_likelihood(model.to_theta(points))
+    pyhf_target = run_pyhf_model_batch(points, convert._workspace)
+    assert not np.allclose(log_likelihood, pyhf_target)
+    assert np.allclose(log_likelihood - log_likelihood[0], pyhf_target - pyhf_target[0], rtol=0., atol=1e-9)
+
+
+@pytest.mark.parametrize("example", EXAMPLES)
+def test_gradient(example):
+    """
+    Gradient agrees with finite differences
+    """
+    convert = Convert(example)
+    model = convert.numpy_model()
+    theta = model.to_theta(draws(convert))
+
+    _, grad = model.log_likelihood_gradient(theta)
+
+    step = 1e-6 * np.eye(model.par_size)
+    finite = np.array([model.log_likelihood(theta + s) - model.log_likelihood(theta - s)
+                       for s in step]).T / 2e-6
+    assert np.allclose(grad, finite, atol=1e-5)
+
+
+def test_stan(tmp_path):
+    """
+    Log-likelihood agrees with Stan target up to a constant
+    """
+    convert = Convert(EXAMPLES[2])
+    model = convert.numpy_model()
+    points = draws(convert)
+
+    stan_file_name, data_file_name, _ = convert.write_to_disk()
+    stan = run_stanhf_model_batch(points, get_stan_par_names(stan_file_name), data_file_name,
+                                  convert.build(stan_file_name), tmp_path / "draws.csv")
+    log_likelihood = model.log_likelihood(model.to_theta(points))
+
+    assert np.allclose(stan - stan[0], log_likelihood - log_likelihood[0])
@@ -0,0 +1,79 @@
+"""
+Test generating synthetic models
+================================
+"""
+
+import json
+
+import numpy as np
+import pyhf
+from click.testing import CliRunner
+
+from stanhf import Convert
+from stanhf.cli import generate_cli
+from stanhf.contrib.generate import generate_patchset, generate_workspace
+from stanhf.run import perturb, run_pyhf_model_batch
+
+
+SIZE = {"channels": 3, "bins": 4, "samples": 2, "normsys": 3, "histosys": 2, "shapesys": 1, "staterror": True,
+        "shapefactor": 1, "normfactor": 1, "lumi": True, "null": 0.3, "fixed": 1}
+
+
+def test_workspace():
+    """
+    Generated workspace is valid, of the requested size and converts
+    """
+    spec = generate_workspace(seed=1, **SIZE)
+    model = pyhf.Workspace(spec).model()
+
+    assert model.config.nmaindata == SIZE["channels"] * SIZE["bins"]
+    assert len(model.config.samples) == SIZE["samples"] + 1
+
+    convert = Convert.from_dict(spec)
+    numpy_model = convert.numpy_model()
+    init = convert.init_card(metadata=False)
+    rng = np.random.default_rng(1)
+    points = [{k: perturb(v, rng=rng) for k, v in init.items()} for _ in range(5)]
+
+    # parameters of only null modifiers are ignored, contributing a constant
+    log_likelihood = numpy_model.log_likelihood(numpy_model.to_theta(points))
+    pyhf_target = run_pyhf_model_batch(points, convert._workspace)
+    assert np.allclose(log_likelihood - log_likelihood[0], pyhf_target - pyhf_target[0])
+
+
+def test_seed():
+    """
+    Generated models depend only on seed
+    """
+    assert generate_workspace(seed=2, **SIZE) == generate_workspace(seed=2, **SIZE)
+    assert generate_workspace(seed=2, **SIZE) != generate_workspace(seed=3, **SIZE)
+
+
+def test_patchset():
+    """
+    Generated patches are valid and change only data
+    """
+    spec = generate_workspace(seed=1, **SIZE)
+    patchset = pyhf.PatchSet(generate_patchset(spec, 3, seed=1))
+
+    assert len(patchset.patches) == 3
+
+    convert = Convert.from_dict(spec)
+    patched = Convert.from_dict(spec, patch=patchset.patches[1])
+    assert patched.structure_hash == convert.structure_hash
+
+
+def test_generate_cli(tmp_path):
+    """
+    Generate workspace and patchset from command line
+    """
+    hf_file_name = tmp_path / "big.json"
+    result = CliRunner().invoke(generate_cli, [str(hf_file_name), "--channels", "2", "--bins", "3",
+                                               "--normsys", "2", "--patches", "2", "--seed", "1"])
+    assert result.exit_code == 0
+
+    with open(hf_file_name, encoding="utf-8") as hf_file:
+        spec = json.load(hf_file)
+
+    with open(tmp_path / "big_patchset.json", encoding="utf-8") as patchset_file:
+        pyhf.PatchSet(json.load(patchset_file)).verify(pyhf.Workspace(spec))
@@ -0,0 +1,126 @@
+"""
+Test instrumenting stages
+=========================
+"""
+
+import asyncio
+import json
+import os
+
+from click.testing import CliRunner
+
+from stanhf import Convert
+from stanhf.cli import cli
+from stanhf.instrument import profiled, profiling, stage
+
+
+CWD = os.path.dirname(os.path.realpath(__file__))
+EXAMPLES = os.path.normpath(os.path.join(CWD, "..", "examples"))
+
+
+@profiled()
+def allocate(size):
+    """
+    @returns List of given size
+    """
+    return [0] * size
+
+
+def test_stages():
+    """
+    Nested stages record time and peak memory
+    """
+    records = []
+
+    with profiling(callback=records.append) as profiler:
+        with stage("outer", size=10**6):
+            big = allocate(10**6)
+            del big
+            allocate(10)
+
+    report = profiler.report()
+    stages = {r["name"]: r for r in report["stages"]}
+
+    assert [r["name"] for r in records] == ["allocate", "allocate", "outer"]
+    assert report["summary"]["allocate"]["calls"] == 2
+    assert stages["allocate"]["parent"] == "outer"
+    assert stages["outer"]["wall"] >= stages["allocate"]["wall"]
+    assert stages["outer"]["peak_memory"] >= 8 * 10**6
+    assert stages["outer"]["args"] == {"size": 10**6}
+
+
+def test_tasks():
+    """
+    Stages of concurrent tasks are nested within their own task
+    """
+    async def task(name):
+        with stage(name):
+            await asyncio.sleep(0.01)
+            with stage(f"{name}.inner"):
+                await asyncio.sleep(0.01)
+
+    async def run():
+        with stage("outer"):
+            await asyncio.gather(task("a"), task("b"))
+
+    with profiling() as profiler:
+        asyncio.run(run())
+
+    stages = {r["name"]: r for r in profiler.records}
+
+    for name in ["a", "b"]:
+        assert stages[name]["parent"] == "outer"
+        assert stages[f"{name}.inner"]["parent"] == name
+        assert stages[f"{name}.inner"]["depth"] == 2
+
+    assert stages["a"]["start"] < stages["b"]["start"] + stages["b"]["wall"]
+    assert stages["b"]["start"] < stages["a"]["start"] + stages["a"]["wall"]
+
+
+def test_disabled():
+    """
+    Nothing is recorded when not profiling
+    """
+    with profiling() as profiler:
+        pass
+
+    with stage("ignored"):
+        allocate(10)
+
+    assert not profiler.records
+    assert stage("ignored") is stage("other")
+
+
+def test_convert(tmp_path):
+    """
+    Stages of converting are recorded and written as report and trace
+    """
+    with profiling() as profiler:
+        Convert(os.path.join(EXAMPLES, "normfactor.json"),
+                (os.path.join(EXAMPLES, "patchset.json"), 0)).to_stan()
+
+    names = {r["name"] for r in profiler.records}
+    assert {"Convert._hf", "pyhf.Workspace", "patch", "Convert.to_stan"} <= names
+
+    with open(profiler.write_trace(tmp_path / "trace.json"), encoding="utf-8") as trace_file:
+        events = json.load(trace_file)["traceEvents"]
+
+    assert all(e["ph"] == "X" and e["dur"] >= 0 for e in events)
+
+    with open(profiler.write_report(tmp_path / "report.json"), encoding="utf-8") as report_file:
+        assert "Convert.to_stan" in json.load(report_file)["summary"]
+
+
+def test_profile_cli(tmp_path):
+    """
+    Profile command line
+    """
+    report = tmp_path / "profile.json"
+    result = CliRunner().invoke(cli, [os.path.join(EXAMPLES, "normsys.json"), "--no-build",
+                                      "--profile", str(report)])
+    assert result.exit_code == 0
+
+    with open(report, encoding="utf-8") as report_file:
+        assert "Convert.write_stan_file" in json.load(report_file)["summary"]
+
+    assert os.path.isfile(tmp_path / "profile_trace.json")
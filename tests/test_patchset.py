@@ -0,0 +1,107 @@
+"""
+Test conversion of patches
+==========================
+"""
+
+import json
+import os
+import shutil
+
+import pyhf
+import pytest
+
+from stanhf import Convert
+from stanhf.batch import convert_patchset
+from stanhf.cache import ModelCache, ValidationCache
+from stanhf.patchset import PatchSetIndex, select_patches
+
+
+CWD = os.path.dirname(os.path.realpath(__file__))
+EXAMPLE = os.path.normpath(os.path.join(CWD, "..", "examples", "normfactor.json"))
+PATCHSET = os.path.normpath(os.path.join(CWD, "..", "examples", "patchset.json"))
+
+
+@pytest.mark.parametrize("selection, expected", [("all", [0, 1, 2, 3]),
+                                                 ("2", [2]),
+                                                 ("3,1", [3, 1]),
+                                                 ("0-2,1", [0, 1, 2])])
+def test_select_patches(selection, expected):
+    """
+    Test selection of patch numbers
+    """
+    assert select_patches(selection, 4) == expected
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_convert_patchset(tmp_path, workers):
+    """
+    Test that patches with identical programs share a program
+    """
+    hf_file_name = shutil.copy(EXAMPLE, tmp_path)
+    manifest, programs = convert_patchset(hf_file_name, PATCHSET, [0, 1, 2], workers=workers)
+
+    assert len(manifest) == 3
+    assert len(programs) == 2
+    assert manifest["mass_100"]["stan"] == manifest["mass_200"]["stan"]
+    assert manifest["mass_100"]["data"] != manifest["mass_200"]["data"]
+
+    for convert, stan_file_name in programs.values():
+        with open(stan_file_name, encoding="utf-8") as stan_file:
+            assert convert.structure_hash in stan_file.read()
+
+
+@pytest.mark.parametrize("patch_number", [0, 1, 2])
+def test_apply_patch(patch_number):
+    """
+    Test that incremental application of a patch agrees with applying it to the workspace
+    """
+    patch = PatchSetIndex(PATCHSET).patch(patch_number)
+    base = Convert(EXAMPLE)
+    incremental = base.apply_patch(patch)
+    full = Convert(EXAMPLE, (PATCHSET, patch_number))
+
+    assert incremental.to_stan() == full.to_stan()
+    assert incremental.data_card() == full.data_card()
+    assert incremental.init_card() == full.init_card()
+    assert base.to_stan() == Convert(EXAMPLE).to_stan()
+
+
+def test_apply_patch_in_memory(tmp_path):
+    """
+    Test that patched in-memory models keep cache and are validated with a cache
+    """
+    with open(EXAMPLE, encoding="utf-8") as hf_file:
+        hf = json.load(hf_file)
+
+    patch = PatchSetIndex(PATCHSET).patch(1)
+    cache = ModelCache(tmp_path / "models")
+    patched = Convert.from_dict(hf, cache=cache).apply_patch(patch)
+
+    assert patched.cache is cache
+    assert patched._content_key == Convert.from_dict(hf, patch)._content_key
+    assert patched.to_stan() == Convert.from_dict(hf, patch).to_stan()
+    assert cache.entries()
+
+    validation_cache = ValidationCache(tmp_path / "validation")
+    patched.validate_par_names(validation_cache=validation_cache)
+    assert validation_cache.entries()
+
+
+def test_patch_set_index(tmp_path):
+    """
+    Test that patches read through index agree with those from parsing patchset
+    """
+    patch_file_name = shutil.copy(PATCHSET, tmp_path)
+    index = PatchSetIndex(patch_file_name)
+    assert os.path.isfile(index.index_file_name)
+
+    cached = PatchSetIndex(patch_file_name)
+    assert cached.index == index.index
+
+    with open(PATCHSET, encoding="utf-8") as patch_file:
+        patch_set = pyhf.PatchSet(json.load(patch_file))
+
+    for number, patch in enumerate(patch_set.patches):
+        metadata = patch.metadata | patch_set.metadata | {"version": patch_set.version}
+        assert cached.patch(number).patch == patch.patch
+        assert cached.patch(patch.name).metadata == metadata
@@ -6,8 +6,12 @@ Test Stan target function
 import os
 
 import numpy as np
+import pytest
 
 from stanhf import Convert
+from stanhf.cache import ValidationCache
+from stanhf.pars import flatten_par, get_pyhf_pars, ParMap
+from stanhf.run import perturb, run_pyhf_model, run_pyhf_model_batch
 
 
 CWD = os.path.dirname(os.path.realpath(__file__))
@@ -21,4 +25,73 @@ def test_target():
     """
     convert = Convert(EXAMPLE)
     convert.validate_par_names()
-    convert.validate_target(rng=RNG)
+    summary = convert.validate_target(rng=RNG, points=50)
+    assert summary["points"] == 50
+    assert summary["max"] < 1e-4
+
+
+def test_pyhf_batch():
+    """
+    Batched pyhf target agrees with one point at a time
+    """
+    convert = Convert(EXAMPLE)
+    init = convert.init_card(metadata=False)
+    draws = [{k: perturb(v, rng=RNG) for k, v in init.items()} for _ in range(5)]
+
+    batch = run_pyhf_model_batch(draws, convert._workspace)
+    single = [run_pyhf_model(d, convert._workspace) for d in draws]
+
+    assert np.allclose(batch, single)
+
+
+def test_in_process():
+    """
+    Validate target evaluated in process against pyhf
+    """
+    pytest.importorskip("bridgestan")
+    convert = Convert(EXAMPLE)
+    summary = convert.validate_target(rng=RNG, points=10, backend="bridgestan")
+    assert summary["max"] < 1e-4
+
+    model = convert.in_process()
+    theta = model.unconstrain_many([convert.init_card(metadata=False)] * 3)
+    lp, grad, hess = model.log_density_hessian_many(theta)
+    assert np.allclose(lp, model.log_density(theta[0]))
+    assert hess.shape == (3, theta.shape[1], theta.shape[1])
+
+
+def test_par_map():
+    """
+    Map whole sets of Stan draws to pyhf parameters and back
+    """
+    convert = Convert(EXAMPLE)
+    model = convert._workspace.model(poi_name=None)
+    init = convert.init_card(metadata=False)
+    draws = [{k: perturb(v, rng=RNG) for k, v in init.items()} for _ in range(5)]
+
+    columns = [c for p in init for c in flatten_par(p, init[p])[0]]
+    rows = [[v for p in init for v in flatten_par(p, d[p])[1]] for d in draws]
+    par_map = ParMap(columns, model)
+    pars = par_map.to_pyhf(rows)
+
+    assert np.allclose(pars, [get_pyhf_pars(d, model) for d in draws])
+    assert np.allclose(par_map.to_stan(pars), rows)
+
+
+def test_validation_cache(tmp_path):
+    """
+    Reuse outcomes of validation unless forced
+    """
+    convert = Convert(EXAMPLE)
+    cache = ValidationCache(tmp_path)
+
+    convert.validate_par_names(validation_cache=cache)
+    summary = convert.validate_target(points=10, seed=1, validation_cache=cache)
+    assert len(cache.entries()) == 3
+
+    assert convert.validate_target(points=10, seed=1, validation_cache=cache) == summary
+    assert convert.validate_target(points=10, seed=1, validation_cache=cache, force=True) == summary
+    assert len(cache.entries()) == 3
+
+    convert.validate_target(points=10, seed=2, validation_cache=cache)
+    assert len(cache.entries()) == 5